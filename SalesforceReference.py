@@ -2,66 +2,403 @@
 __version__ = "2.1.1"
 __author__ = "James Hill <me@jameshill.io>"
 __copyright__ = "SublimeSalesforceReference: (C) 2014-2017 James Hill. GNU GPL 3."
-__credits__ = ["All Salesforce Documentation is © Copyright 2000–2015 salesforce.com, inc.", "ThreadProgress.py is under the MIT License, Will Bond <will@wbond.net>, and SalesforceReference.py's RetrieveIndexThread method is a derives in part from code under the same license"]
+__credits__ = ["All Salesforce Documentation is © Copyright 2000–2015 salesforce.com, inc.", "SalesforceReference.py's RetrieveIndexThread method and salesforce_reference/progress.py's indicator derive in part from code under the MIT License, Will Bond <will@wbond.net>"]
 
 import sublime, sublime_plugin
 import webbrowser
 import threading
+import html
+import os
+import time
 from queue import Queue
 # TODO: See if possible to rename the plugin while playing nice with Package
 #       Control. The current name is "sublime-salesforce-reference" - which
 #       means we can't do (for example)
 #       `import sublime-salesforce-reference.salesforce_reference.cache`
 #       as the dashes are interpreted as minuses
-from .salesforce_reference.cache import SalesforceReferenceCache
-from .salesforce_reference.retrieve import DocTypeEnum, DocType
-from .ThreadProgress import ThreadProgress
+from .salesforce_reference.retrieve import DocTypeEnum, DocType, create_strategy, DEFAULT_LOCALE
+from .salesforce_reference.connection import shared_pool
+from .salesforce_reference.instrumentation import recorder
+from .salesforce_reference.usage import UsageStats
+from .salesforce_reference.crawler import MemberCrawler, RateLimiter
+from .salesforce_reference.store import SharedIndex, dump_index, index_entries
+from .salesforce_reference.startup import StartupScheduler
+from .salesforce_reference.progress import tracker as progress_tracker
+from .salesforce_reference.versions import DocVersionIndex, LocaleMap, versioned_path
+from .salesforce_reference.pages import PageCache, absolute_links, command_links, content_url, load_page
+from .salesforce_reference.search import SearchIndex, SearchIndexer, search_targets
+from .salesforce_reference.cache import SalesforceReferenceCache, SalesforceReferenceCacheEntry
 
 
-#Global reference cache for holding all documentation entries
-reference_cache = SalesforceReferenceCache()
+#Global caches per documentation version and locale, keyed by (version,
+#locale) - a version of None being the latest release - and a map of pages
+#across locales for each version. reference_cache, completion_index,
+#shared_index and doc_type_meta below are those of the selected version and
+#locale (see select_doc_version)
+locale_maps = {None: LocaleMap()}
+doc_indexes = {(None, DEFAULT_LOCALE): DocVersionIndex(None, DEFAULT_LOCALE, locale_map=locale_maps[None])}
+selected_version = None
+selected_locale = DEFAULT_LOCALE
 cache_lock = threading.Lock()
 
+#Global reference cache for holding all documentation entries
+reference_cache = doc_indexes[(None, DEFAULT_LOCALE)].cache
+
+#Global prefix index of Apex/Visualforce names, kept in step with the cache
+completion_index = doc_indexes[(None, DEFAULT_LOCALE)].completions
+
+#Global rate limit shared by every member crawler, and the crawlers running
+crawl_rate_limiter = RateLimiter(4)
+active_crawlers = {}
+crawlers_lock = threading.Lock()
+
+#Global record of which pages have been opened, for ranking the quick panel,
+#and a count of the saves of it requested and done (see save_usage_stats_soon)
+usage_stats = UsageStats()
+usage_saves_requested = 0
+usage_saves_done = 0
+
+#Global on-disk index shared with other Sublime Text instances, and the ToC
+#metadata (e.g. documentation version) of each doc type in the cache
+shared_index = None
+doc_type_meta = doc_indexes[(None, DEFAULT_LOCALE)].doc_type_meta
+
+#The last page opened from the quick panel, and the DocVersionIndex it came
+#from, for opening it in another locale
+last_opened = None
+
+#Global cache of documentation pages rendered for viewing in Sublime Text
+page_cache = PageCache()
+
+#Global full-text indexes of page content per documentation version and
+#locale, loaded when first searched, the indexers keeping them up to date,
+#and the last query searched for
+search_indexes = {}
+active_search_indexers = {}
+search_lock = threading.Lock()
+last_search_query = ""
+
+#Global scheduler deferring startup caching until the editor is idle
+startup_scheduler = None
+
+#How long to wait for another process refreshing the shared index to finish,
+#before retrieving without it
+SHARED_INDEX_LOCK_TIMEOUT = 60
+
+#How long after a page is opened to save usage statistics, in milliseconds.
+#Pages opened in quick succession are saved once
+USAGE_SAVE_DELAY = 2000
+
 
 def plugin_loaded():
     # Add settings to global, and pre-cache documentation if/as appropriate
     global settings
     settings = sublime.load_settings("SublimeSalesforceReference.sublime-settings")
+    recorder.log_to_console = settings.get("logPerformance") == True
+    progress_tracker.show = sublime.status_message
+    progress_tracker.schedule = sublime.set_timeout
+    usage_stats.load(os.path.join(sublime.packages_path(), "User", "SublimeSalesforceReference.usage.json"))
+    crawler_settings = settings.get("memberCrawler") or {}
+    try:
+        crawl_rate_limiter.rate = crawler_settings.get("requestsPerSecond", 4)
+    except (TypeError, ValueError) as e:
+        print("SublimeSalesforceReference: Ignoring memberCrawler.requestsPerSecond: %s" % e)
+        crawl_rate_limiter.rate = 4
+    page_cache_settings = settings.get("pageCache") or {}
+    page_cache.directory = os.path.join(sublime.cache_path(), "SublimeSalesforceReference", "pages")
+    page_cache.max_pages = int(page_cache_settings.get("memoryPages", 50))
+    page_cache.max_disk_bytes = int(float(page_cache_settings.get("diskMegabytes", 50)) * 1024 * 1024)
+    select_doc_version(settings.get("docVersion") or None, settings.get("docLocale") or DEFAULT_LOCALE)
+    settings.clear_on_change("docSelection")
+    settings.add_on_change("docSelection", on_doc_selection_changed)
     if settings != None and settings.get("refreshCacheOnLoad") == True:
-        thread = RetrieveIndexThread(sublime.active_window(), "*", open_when_done=False,sublime_opening_cache_refresh=True)
-        print("SublimeSalesforceReference: Startup caching will begin shortly")
-        thread.start()
+        start_startup_scheduler()
+        print("SublimeSalesforceReference: Startup caching will begin once Sublime Text is idle")
     else:
+        sublime.set_timeout_async(sync_shared_index, 0)
         print("SublimeSalesforceReference: refreshCacheOnLoad is False, or "
               "settings file missing. Skipping startup caching")
 
+def plugin_unloaded():
+    # Don't leave keep-alive sockets to developer.salesforce.com open across
+    # plugin reloads, or startup caching running for the old plugin
+    if startup_scheduler is not None:
+        startup_scheduler.cancel()
+    if usage_saves_done != usage_saves_requested:
+        save_usage_stats(usage_saves_requested)
+    shared_pool.close_all()
+
+def start_startup_scheduler():
+    # Loading the shared index happens straight away, in the background.
+    # Retrieving anything it lacks waits until the editor has been idle for a
+    # while (see the deferStartupCaching setting), one doc type at a time
+    global startup_scheduler
+    window = sublime.active_window()
+    max_age = float(settings.get("indexMaxAgeHours", 24)) * 60 * 60
+    def prepare():
+        sync_shared_index()
+        return RetrieveIndexThread(window, "*", sublime_opening_cache_refresh=True, max_age=max_age).doc_types_to_retrieve()
+    def retrieve(doc_type):
+        RetrieveIndexThread(window, doc_type, open_when_done=False, progress_label="Startup caching",
+                            max_age=max_age).run()
+    defer_settings = settings.get("deferStartupCaching") or {}
+    startup_scheduler = StartupScheduler(
+        prepare,
+        retrieve,
+        float(defer_settings.get("idleSeconds", 3)),
+        float(defer_settings.get("secondsBetweenDocTypes", 2))
+    )
+    startup_scheduler.start()
+
+def hurry_startup_caching():
+    # A command is being used, so whatever startup caching is still deferred
+    # is wanted now
+    if startup_scheduler is not None:
+        startup_scheduler.start_now()
+
+def save_usage_stats_soon():
+    # Save usage statistics off the UI thread, once no page has been opened
+    # for USAGE_SAVE_DELAY. Each call supersedes the save requested before it
+    global usage_saves_requested
+    usage_saves_requested += 1
+    request = usage_saves_requested
+    sublime.set_timeout_async(lambda: save_usage_stats(request), USAGE_SAVE_DELAY)
+
+def save_usage_stats(request):
+    global usage_saves_done
+    if request != usage_saves_requested:
+        return
+    usage_saves_done = request
+    try:
+        usage_stats.save()
+    except (IOError, OSError) as e:
+        print("SublimeSalesforceReference: Could not save usage statistics to %s: %s" % (usage_stats.path, e))
+
+def open_page(window, doc_index, entry):
+    # Open an entry's page in the browser, or in Sublime Text if that's what
+    # the openDocumentationIn setting asks for and the documentation's ToC
+    # said where to find page content
+    doc_type = DocTypeEnum.get_by_name(entry.doc_type).variant(doc_index.version, doc_index.locale)
+    url = doc_type.doc_base_url + entry.url
+    where = settings.get("openDocumentationIn") or "browser"
+    if where != "browser":
+        page, _, fragment = entry.url.partition("#")
+        page_content_url = content_url(doc_type.toc_url, doc_index.doc_type_meta.get(entry.doc_type), page)
+        if page_content_url:
+            ShowPageThread(window, entry, url, page_content_url, fragment, where).start()
+            return
+    webbrowser.open_new_tab(url)
+
+def get_search_index(doc_index):
+    # The content search index for a DocVersionIndex's version and locale,
+    # loaded from disk the first time it's needed
+    key = (doc_index.version, doc_index.locale)
+    with search_lock:
+        search_index = search_indexes.get(key)
+        if search_index is None:
+            search_index = search_indexes[key] = SearchIndex.load(search_index_path(*key))
+    return search_index
+
+def search_index_path(version, locale):
+    return versioned_path(os.path.join(sublime.cache_path(), "SublimeSalesforceReference", "search.idx"), version, locale)
+
+def update_search_index(doc_index, search_index):
+    # Start bringing a content search index up to date with the pages of each
+    # doc type cached in doc_index, unless that's already under way. Returns
+    # the indexer doing so
+    key = (doc_index.version, doc_index.locale)
+    with search_lock:
+        running = active_search_indexers.get(key)
+        if running is not None and running.is_alive():
+            return running
+        targets = {}
+        with cache_lock:
+            for doc_type_name, entries in doc_index.cache.entries_by_doc_type.items():
+                meta = doc_index.doc_type_meta.get(doc_type_name) or {}
+                doc_type = DocTypeEnum.get_by_name(doc_type_name).variant(doc_index.version, doc_index.locale)
+                page_targets = search_targets(doc_type_name, entries, doc_type.toc_url, meta)
+                if page_targets:
+                    targets[doc_type_name] = (meta.get("version"), page_targets)
+        search_settings = settings.get("contentSearch") or {}
+        indexer = SearchIndexer(
+            search_index,
+            search_index_path(*key),
+            targets,
+            crawl_rate_limiter,
+            search_settings.get("maxConcurrency", 4),
+            page_cache=page_cache
+        )
+        active_search_indexers[key] = indexer
+    indexer.start()
+    return indexer
+
+def get_doc_index(version, locale):
+    # The DocVersionIndex for a version and locale, created (empty, but with
+    # its shared index file opened) the first time it's needed
+    with cache_lock:
+        doc_index = doc_indexes.get((version, locale))
+        if doc_index is None:
+            locale_map = locale_maps.setdefault(version, LocaleMap())
+            doc_index = doc_indexes[(version, locale)] = DocVersionIndex(version, locale, locale_map=locale_map)
+    if doc_index.shared_index is None:
+        doc_index.shared_index = SharedIndex(shared_index_path(version, locale))
+    return doc_index
+
+def select_doc_version(version, locale=DEFAULT_LOCALE):
+    # Make the cache (and completions, etc.) for `version` in `locale` the
+    # current one. One selected before keeps everything it had loaded, so
+    # switching back to it is immediate
+    global selected_version, selected_locale, reference_cache, completion_index, shared_index, doc_type_meta
+    doc_index = get_doc_index(version, locale)
+    selected_version = version
+    selected_locale = locale
+    reference_cache = doc_index.cache
+    completion_index = doc_index.completions
+    doc_type_meta = doc_index.doc_type_meta
+    shared_index = doc_index.shared_index
+
+def on_doc_selection_changed():
+    version = settings.get("docVersion") or None
+    locale = settings.get("docLocale") or DEFAULT_LOCALE
+    if (version, locale) == (selected_version, selected_locale):
+        return
+    select_doc_version(version, locale)
+    print("SublimeSalesforceReference: Switched to %s documentation (%s)" % (version or "the latest", locale))
+    # Load its index in the background, if another process has built one;
+    # anything else is retrieved when a command next needs it
+    sublime.set_timeout_async(sync_shared_index, 0)
+
+def shared_index_path(version, locale):
+    # The index is shared by every Sublime Text instance using the same cache
+    # directory, or may be somewhere else named by the indexPath setting (e.g.
+    # an index built for a team by `python -m salesforce_reference`). Each
+    # documentation version and locale has its own file
+    index_path = settings.get("indexPath")
+    if index_path:
+        index_path = os.path.expandvars(os.path.expanduser(index_path))
+    else:
+        index_path = os.path.join(sublime.cache_path(), "SublimeSalesforceReference", "index.json")
+    return versioned_path(index_path, version, locale)
+
+def open_shared_index():
+    # (Re)open the selected version's shared index, forgetting which
+    # generation of it has been loaded
+    global shared_index
+    doc_index = doc_indexes[(selected_version, selected_locale)]
+    shared_index = doc_index.shared_index = SharedIndex(shared_index_path(selected_version, selected_locale))
+
+def sync_shared_index(version_index=None):
+    # Load whatever another process has published to the (selected version's)
+    # shared index since we last looked. When nothing has changed this costs a
+    # single stat()
+    version_index = version_index or doc_indexes[(selected_version, selected_locale)]
+    shared = version_index.shared_index
+    if shared is None or not shared.changed():
+        return
+    index = shared.load()
+    if index is None:
+        return
+    loaded = {doc_type: index_entries(index, [doc_type]) for doc_type in index["doc_types"]}
+    with cache_lock:
+        version_index.cache.replace_doc_types(loaded)
+        for doc_type, stored in index["doc_types"].items():
+            meta = dict(stored.get("meta") or {})
+            # Indexes written before doc types recorded when they were
+            # retrieved are as old as the index itself
+            meta.setdefault("retrieved", index["header"].get("generated"))
+            meta["empty"] = not stored["entries"]
+            version_index.doc_type_meta[doc_type] = meta
+    print("SublimeSalesforceReference: Loaded %d entries from %s (generation %s)" % (
+        sum(len(entries) for entries in loaded.values()), shared.path, shared.generation))
+
 # Command to retrieve Apex reference
 class SalesforceReferenceApexCommand(sublime_plugin.WindowCommand):
     def run(self):
-        thread = RetrieveIndexThread(self.window, DocTypeEnum.APEX)
+        thread = RetrieveIndexThread(self.window, DocTypeEnum.APEX, progress_label="Apex")
+        hurry_startup_caching()
         thread.start()
-        ThreadProgress(thread, "Retrieving Salesforce Apex Reference Index...", "")
 
 # Command to retrieve Visualforce reference
 class SalesforceReferenceVisualforceCommand(sublime_plugin.WindowCommand):
     def run(self):
-        thread = RetrieveIndexThread(self.window, DocTypeEnum.VISUALFORCE)
+        thread = RetrieveIndexThread(self.window, DocTypeEnum.VISUALFORCE, progress_label="Visualforce")
+        hurry_startup_caching()
         thread.start()
-        ThreadProgress(thread, "Retrieving Salesforce Visualforce Reference Index...", "")
 
 # Command to retrieve Service Console reference
 class SalesforceReferenceServiceConsoleCommand(sublime_plugin.WindowCommand):
     def run(self):
-        thread = RetrieveIndexThread(self.window, DocTypeEnum.SERVICECONSOLE)
+        thread = RetrieveIndexThread(self.window, DocTypeEnum.SERVICECONSOLE, progress_label="Service Console")
+        hurry_startup_caching()
         thread.start()
-        ThreadProgress(thread, "Retrieving Salesforce Service Console Reference Index...", "")
 
 # Command to retrieve all documentation (except for any specifically excluded by user in settings)
 class SalesforceReferenceAllDocumentationTypesCommand(sublime_plugin.WindowCommand):
     def run(self):
-        thread = RetrieveIndexThread(self.window, "*")
+        thread = RetrieveIndexThread(self.window, "*", progress_label="All Documentation")
+        hurry_startup_caching()
         thread.start()
-        ThreadProgress(thread, "Retrieving Salesforce Reference Index...", "")
+
+# Command to show timing information for retrieval and caching
+class SalesforceReferencePerformanceReportCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        view = self.window.new_file()
+        view.set_name("Salesforce Reference Performance Report")
+        view.set_scratch(True)
+        view.run_command("append", {"characters": recorder.report()})
+        view.set_read_only(True)
+
+# Command to open the page last opened from a Salesforce Reference command in
+# another of the locales in the docLocales setting
+class SalesforceReferenceOpenInLocaleCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        if last_opened is None:
+            sublime.status_message("Open a page with a Salesforce Reference command first")
+            return
+        doc_index, entry = last_opened
+        OpenInLocaleThread(self.window, doc_index, entry).start()
+
+# Command to search the text of documentation pages, rather than their titles
+class SalesforceReferenceSearchContentCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        self.window.show_input_panel("Search Salesforce Docs Content:", last_search_query, self.on_done, None, None)
+
+    def on_done(self, query):
+        global last_search_query
+        last_search_query = query
+        if not query.strip():
+            return
+        hurry_startup_caching()
+        SearchContentThread(self.window, doc_indexes[(selected_version, selected_locale)], query).start()
+
+# Offers Apex class and Visualforce component names from the cached index as
+# completions, in views matching the selectors in the completionSelectors
+# setting
+class SalesforceReferenceCompletionsListener(sublime_plugin.EventListener):
+    def on_query_completions(self, view, prefix, locations):
+        if not prefix or not settings.get("completions", True):
+            return None
+        selectors = settings.get("completionSelectors") or {}
+        doc_types = [doc_type_name.upper() for doc_type_name, selector in selectors.items()
+                     if view.match_selector(locations[0], selector)]
+        if not doc_types:
+            return None
+        line_start = view.line(locations[0]).begin()
+        text_before_prefix = view.substr(sublime.Region(line_start, locations[0] - len(prefix)))
+        return completion_index.complete(prefix, doc_types, text_before_prefix)
+
+# Tells the startup scheduler the editor is in use, so deferred startup
+# caching waits for a lull
+class SalesforceReferenceIdleListener(sublime_plugin.EventListener):
+    def on_modified(self, view):
+        self.on_activity()
+    def on_selection_modified(self, view):
+        self.on_activity()
+    def on_activated(self, view):
+        self.on_activity()
+    def on_activity(self):
+        if startup_scheduler is not None and startup_scheduler.pending:
+            startup_scheduler.activity()
 
 
 class RetrieveIndexThread(threading.Thread):
@@ -69,7 +406,8 @@ class RetrieveIndexThread(threading.Thread):
     A thread to run retrieval of the Saleforce Documentation index, and access the reference_cache
     """
 
-    def __init__(self, window, doc_type, open_when_done=True, sublime_opening_cache_refresh=False):
+    def __init__(self, window, doc_type, open_when_done=True, sublime_opening_cache_refresh=False,
+                 progress_label="Retrieving", doc_index=None, max_age=None):
         """
         :param window:
             An instance of :class:`sublime.Window` that represents the Sublime
@@ -94,6 +432,16 @@ class RetrieveIndexThread(threading.Thread):
                 however...
              - if refreshCacheOnLoad is set to False in the settings for a
                 particular doc type, this doc type will not be cached
+        :param progress_label:
+            what to call this retrieval in the status bar while it runs
+        :param doc_index:
+            the DocVersionIndex to retrieve into and show. Defaults to the
+            selected documentation version and locale
+        :param max_age:
+            if set, doc types already cached are retrieved again (and
+            republished to the shared index) once they were retrieved this
+            many seconds ago. Otherwise only doc types not yet cached are
+            retrieved
         """
         self.window = window
         if not isinstance(doc_type,DocType) and doc_type != "*":
@@ -109,11 +457,71 @@ class RetrieveIndexThread(threading.Thread):
         if sublime_opening_cache_refresh:
             self.doc_type = "*"
             self.open_when_done = False
+        self.progress_label = progress_label
+        self.progress = None
+        # Retrieve into the version and locale selected now, even if another is
+        # selected before this thread is done
+        self.doc_index = doc_index or doc_indexes[(selected_version, selected_locale)]
+        self.max_age = max_age
         self.queue = Queue()
-        global reference_cache
+        self.strategies = []
+        self.panel_entries = []
         threading.Thread.__init__(self)
 
     def run(self):
+        shared = self.doc_index.shared_index
+        sync_shared_index(self.doc_index)
+        doc_types = self.doc_types_to_retrieve()
+        if doc_types:
+            self.progress = progress_tracker.start_job(self.progress_label, len(doc_types))
+        try:
+            if shared is not None and doc_types:
+                # Only one process refreshes the shared index at a time. Having
+                # waited for the lock, check the index again: whoever held it has
+                # most likely just published the doc types we're missing
+                try:
+                    locked = shared.lock.acquire(SHARED_INDEX_LOCK_TIMEOUT)
+                except (IOError, OSError):
+                    locked = False
+                try:
+                    sync_shared_index(self.doc_index)
+                    self.retrieve()
+                    if locked:
+                        self.publish_shared_index()
+                finally:
+                    if locked:
+                        shared.lock.release()
+            else:
+                self.retrieve()
+        finally:
+            if self.progress is not None:
+                self.progress.finish()
+
+        if(self.open_when_done):
+            doc_type_name = None if self.doc_type == "*" else self.doc_type.name
+            with recorder.phase("panel open", doc_type_name):
+                # Failed retrievals are shown at the top of the panel, but are
+                # never cached, so the next command will retry them
+                self.panel_entries = [strategy.error_entry() for strategy in self.strategies if strategy.error]
+                if self.doc_type == "*":
+                    entries = self.doc_index.cache.entries
+                else:
+                    entries = self.doc_index.cache.entries_by_doc_type.get(self.doc_type.name, [])
+                if settings.get("rankByUsage", True):
+                    entries = usage_stats.rank(entries)
+                self.panel_entries.extend(entries)
+                if self.panel_entries:
+                    self.window.show_quick_panel([entry.title for entry in self.panel_entries], self.open_documentation)
+                else:
+                    sublime.status_message("Salesforce Reference: no %sdocumentation found in %s" % (
+                        doc_type_name.lower() + " " if doc_type_name else "", self.doc_index.locale))
+
+    def doc_types_to_retrieve(self):
+        """
+        The DocTypes this thread should retrieve: those requested but not yet
+        cached, or (with max_age) cached too long ago
+        """
+        doc_types = []
         if self.doc_type == "*":
             all_doc_type_settings = settings.get("docTypes")
             for doc_type in DocTypeEnum.get_all():
@@ -131,40 +539,280 @@ class RetrieveIndexThread(threading.Thread):
 
                 if  (
                             not exclude
-                        and not reference_cache.entries_by_doc_type.get(doc_type.name)
+                        and self.needs_retrieving(doc_type)
                         and not (
                                         self.sublime_opening_cache_refresh
                                     and not refresh_on_load
                                 )
                     ):
-                    self.queue.put(doc_type.preferred_strategy(self.window,reference_cache,cache_lock,self.queue.task_done))
+                    doc_types.append(doc_type)
         else:
-            if not reference_cache.entries_by_doc_type.get(self.doc_type.name):
-                self.queue.put(self.doc_type.preferred_strategy(self.window,reference_cache,cache_lock,self.queue.task_done))
+            if self.needs_retrieving(self.doc_type):
+                doc_types.append(self.doc_type)
+        return doc_types
+
+    def needs_retrieving(self, doc_type):
+        # A doc type retrieved with no entries (e.g. one whose sections can't
+        # be found in this locale) counts as cached, so it isn't retried every
+        # time, but is retried once stale like any other
+        meta = self.doc_index.doc_type_meta.get(doc_type.name) or {}
+        if not self.doc_index.cache.entries_by_doc_type.get(doc_type.name) and not meta.get("empty"):
+            return True
+        if self.max_age is None:
+            return False
+        retrieved = meta.get("retrieved")
+        return retrieved is None or time.time() - retrieved >= self.max_age
+
+    def retrieve(self):
+        doc_types = self.doc_types_to_retrieve()
+        if self.progress is not None:
+            # Anything no longer missing was loaded from the shared index
+            self.progress.step_done(self.progress.total - len(doc_types))
+        for doc_type in doc_types:
+            self.queue_strategy(doc_type)
 
         while not self.queue.empty():
             self.queue.get().start()
 
-        if(self.open_when_done):
-            self.queue.join()
-            if self.doc_type == "*":
-                self.window.show_quick_panel(reference_cache.titles, self.open_documentation)
-            else:
-                self.window.show_quick_panel(reference_cache.titles_by_doc_type.get(self.doc_type.name), self.open_documentation)
+        self.queue.join()
+        with cache_lock:
+            # Doc types being refreshed were retrieved into caches of their
+            # own (see queue_strategy), so they replace the old entries whole
+            refreshed = {}
+            retrieved = [strategy for strategy in self.strategies if not strategy.error]
+            for strategy in retrieved:
+                entries = strategy.cache.entries_by_doc_type.get(strategy.doc_type)
+                if strategy.cache is not self.doc_index.cache and entries:
+                    refreshed[strategy.doc_type] = entries
+            self.doc_index.cache.replace_doc_types(refreshed)
+            for strategy in retrieved:
+                empty = not self.doc_index.cache.entries_by_doc_type.get(strategy.doc_type)
+                self.doc_index.doc_type_meta[strategy.doc_type] = dict(strategy.toc_meta, empty=empty)
+        self.start_member_crawlers()
+
+    def publish_shared_index(self):
+        """Write the cache to the shared index, if any doc types were retrieved"""
+        if all(strategy.error for strategy in self.strategies):
+            return
+        shared = self.doc_index.shared_index
+        with cache_lock:
+            index = dump_index(self.doc_index.cache, self.doc_index.doc_type_meta)
+        try:
+            shared.publish(index)
+        except (IOError, OSError) as e:
+            print("SublimeSalesforceReference: Could not write shared index %s: %s" % (shared.path, e))
+
+    def queue_strategy(self, doc_type):
+        # A doc type that is already cached keeps its entries until the new
+        # ones have all been retrieved, so pages since removed from the
+        # documentation are dropped, and the old entries stay usable meanwhile
+        cache = self.doc_index.cache
+        if cache.entries_by_doc_type.get(doc_type.name):
+            cache = SalesforceReferenceCache()
+        strategy = create_strategy(
+            doc_type.variant(self.doc_index.version, self.doc_index.locale),
+            self.window,
+            cache,
+            cache_lock,
+            self.strategy_done
+        )
+        strategy.progress = self.progress
+        self.strategies.append(strategy)
+        self.queue.put(strategy)
+
+    def strategy_done(self):
+        if self.progress is not None:
+            self.progress.step_done()
+        self.queue.task_done()
+
+    def start_member_crawlers(self):
+        """
+        Crawl the pages of any doc types just retrieved for member entries, if
+        the memberCrawler setting enables it. Crawling carries on in the
+        background, adding entries to the cache as it goes
+        """
+        crawler_settings = settings.get("memberCrawler") or {}
+        if not crawler_settings.get("enabled"):
+            return
+        for strategy in self.strategies:
+            if strategy.error or not strategy.crawl_targets:
+                continue
+            crawler_key = (strategy.doc_type, self.doc_index.version, self.doc_index.locale)
+            with crawlers_lock:
+                running = active_crawlers.get(crawler_key)
+                if running is not None and running.is_alive():
+                    continue
+                crawler = MemberCrawler(
+                    self.doc_index.cache,
+                    cache_lock,
+                    strategy.doc_type,
+                    strategy.crawl_targets,
+                    strategy.source.toc_url,
+                    strategy.toc_meta,
+                    versioned_path(
+                        os.path.join(sublime.cache_path(), "SublimeSalesforceReference", "members-%s.json" % strategy.doc_type.lower()),
+                        self.doc_index.version,
+                        self.doc_index.locale
+                    ),
+                    crawl_rate_limiter,
+                    crawler_settings.get("maxConcurrency", 4)
+                )
+                active_crawlers[crawler_key] = crawler
+            crawler.start()
 
     def open_documentation(self, reference_index):
-        url = ""
+        global last_opened
         if(reference_index != -1):
-            if self.doc_type == "*":
-                entry = reference_cache.entries[reference_index]
-            else:
-                entry = reference_cache.entries_by_doc_type.get(self.doc_type.name)[reference_index]
+            entry = self.panel_entries[reference_index]
 
             if entry:
-                if self.doc_type == "*":
-                    url = DocTypeEnum.get_by_name(entry.doc_type).doc_base_url + entry.url
-                else:
-                    url = self.doc_type.doc_base_url + entry.url
+                if not entry.url:
+                    # Error placeholder: show the console with the details
+                    self.window.run_command("show_panel", {"panel": "console"})
+                    return
+                usage_stats.record(entry)
+                save_usage_stats_soon()
+                last_opened = (self.doc_index, entry)
+                open_page(self.window, self.doc_index, entry)
+
+
+class OpenInLocaleThread(threading.Thread):
+    """
+    Offers a page in each of the locales in the docLocales setting, and opens
+    the one chosen. Locales whose index for the page's doc type isn't cached
+    yet are retrieved first, in parallel. After that, finding the page in
+    each locale is a lookup in the version's LocaleMap
+    """
+    def __init__(self, window, doc_index, entry):
+        self.window = window
+        self.doc_index = doc_index
+        self.entry = entry
+        self.locales = []
+        threading.Thread.__init__(self)
+
+    def run(self):
+        version = self.doc_index.version
+        doc_type = DocTypeEnum.get_by_name(self.entry.doc_type)
+        self.locales = [locale for locale in settings.get("docLocales") or [] if locale != self.doc_index.locale]
+        retrievals = [
+            RetrieveIndexThread(self.window, doc_type, open_when_done=False, progress_label=locale,
+                                doc_index=get_doc_index(version, locale))
+            for locale in self.locales
+        ]
+        for retrieval in retrievals:
+            retrieval.start()
+        for retrieval in retrievals:
+            retrieval.join()
+
+        translations = locale_maps[version].translations(self.entry.doc_type, self.entry.url)
+        items = []
+        for locale in self.locales:
+            translated = translations.get(locale)
+            if translated is not None:
+                items.append([translated.title, locale])
+            else:
+                items.append([self.entry.title, "%s - not found in this locale's index" % locale])
+        if items:
+            self.window.show_quick_panel(items, self.open_locale)
+        else:
+            sublime.status_message("Add locales to the docLocales setting to open pages in them")
+
+    def open_locale(self, index):
+        if index == -1:
+            return
+        locale = self.locales[index]
+        doc_index = get_doc_index(self.doc_index.version, locale)
+        translations = locale_maps[doc_index.version].translations(self.entry.doc_type, self.entry.url)
+        open_page(self.window, doc_index, translations.get(locale) or self.entry)
+
+
+class ShowPageThread(threading.Thread):
+    """
+    Shows a documentation page in Sublime Text, in an output panel or (where
+    HTML sheets are supported) a sheet of its own, rendered from the page's
+    content. Pages come from page_cache where they can, and are otherwise
+    fetched and rendered in the background. If the page can't be fetched it
+    is opened in the browser instead
+    """
+    PANEL_NAME = "salesforce_reference"
+
+    def __init__(self, window, entry, url, page_content_url, fragment, where):
+        self.window = window
+        self.entry = entry
+        self.url = url
+        self.page_content_url = page_content_url
+        self.fragment = fragment
+        self.where = where
+        threading.Thread.__init__(self)
+
+    def run(self):
+        try:
+            with recorder.doc_type(self.entry.doc_type):
+                rendered = load_page(page_cache, self.page_content_url, self.fragment)
+        except Exception as e:
+            print("SublimeSalesforceReference: could not show %s, opening it in the browser instead: %s" % (
+                self.page_content_url, e))
+            webbrowser.open_new_tab(self.url)
+            return
+        page_html = (
+            '<body id="salesforce-reference">'
+            '<p><a href="%s">Open in browser</a></p>%s'
+            '</body>'
+        ) % (html.escape(self.url), absolute_links(rendered, self.url))
+        sublime.set_timeout(lambda: self.show(page_html), 0)
+
+    def show(self, page_html):
+        if self.where == "sheet" and hasattr(self.window, "new_html_sheet"):
+            self.window.new_html_sheet(self.entry.title, command_links(page_html))
+            return
+        panel = self.window.create_output_panel(self.PANEL_NAME)
+        panel.erase_phantoms(self.PANEL_NAME)
+        panel.add_phantom(self.PANEL_NAME, sublime.Region(0, 0), page_html, sublime.LAYOUT_BLOCK,
+                          webbrowser.open_new_tab)
+        self.window.run_command("show_panel", {"panel": "output." + self.PANEL_NAME})
+
+
+class SearchContentThread(threading.Thread):
+    """
+    Searches the text of the pages of the documentation cached in a
+    DocVersionIndex, showing the best matches (with a snippet of each match)
+    in a quick panel, and opening the one chosen as the quick panel does.
+
+    The search index is brought up to date in the background each time, so
+    on first use (or after new documentation is retrieved) results are
+    limited to the pages indexed so far
+    """
+    def __init__(self, window, doc_index, query):
+        self.window = window
+        self.doc_index = doc_index
+        self.query = query
+        self.results = []
+        threading.Thread.__init__(self)
+
+    def run(self):
+        sync_shared_index(self.doc_index)
+        if not self.doc_index.cache.entries:
+            RetrieveIndexThread(self.window, "*", open_when_done=False, progress_label="Search",
+                                doc_index=self.doc_index).run()
+        search_index = get_search_index(self.doc_index)
+        indexer = update_search_index(self.doc_index, search_index)
+        search_settings = settings.get("contentSearch") or {}
+        self.results = search_index.search(self.query, search_settings.get("maxResults", 50))
+        still_indexing = indexer.is_alive() and indexer.progress is not None
+        if not self.results:
+            if still_indexing:
+                sublime.status_message("Salesforce Reference: nothing found for \"%s\" yet - "
+                                       "page content is still being indexed" % self.query)
+            else:
+                sublime.status_message("Salesforce Reference: nothing found for \"%s\"" % self.query)
+            return
+        if still_indexing:
+            print("SublimeSalesforceReference: searched %d pages so far; page content is still being indexed" % len(search_index))
+        items = [[result.title, result.snippet] for result in self.results]
+        sublime.set_timeout(lambda: self.window.show_quick_panel(items, self.open_result), 0)
 
-            if url:
-                webbrowser.open_new_tab(url)
+    def open_result(self, index):
+        if index == -1:
+            return
+        result = self.results[index]
+        open_page(self.window, self.doc_index, SalesforceReferenceCacheEntry(result.title, result.page, result.doc_type))
@@ -1,47 +0,0 @@
-"""MIT License, Will Bond <will@wbond.net>, see README.md for full info"""
-import sublime
-
-
-class ThreadProgress():
-    """
-    Animates an indicator, [=   ], in the status area while a thread runs
-
-    :param thread:
-        The thread to track for activity
-
-    :param message:
-        The message to display next to the activity indicator
-
-    :param success_message:
-        The message to display once the thread is complete
-    """
-
-    def __init__(self, thread, message, success_message):
-        self.thread = thread
-        self.message = message
-        self.success_message = success_message
-        self.addend = 1
-        self.size = 8
-        sublime.set_timeout(lambda: self.run(0), 100)
-
-    def run(self, i):
-        if not self.thread.is_alive():
-            if hasattr(self.thread, 'result') and not self.thread.result:
-                sublime.status_message('')
-                return
-            sublime.status_message(self.success_message)
-            return
-
-        before = i % self.size
-        after = (self.size - 1) - before
-
-        sublime.status_message('%s [%s=%s]' % \
-            (self.message, ' ' * before, ' ' * after))
-
-        if not after:
-            self.addend = -1
-        if not before:
-            self.addend = 1
-        i += self.addend
-
-        sublime.set_timeout(lambda: self.run(i), 100)
\ No newline at end of file
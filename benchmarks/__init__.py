@@ -0,0 +1,4 @@
+"""
+Benchmarks for SublimeSalesforceReference, runnable outside Sublime Text.
+See `python -m benchmarks --help`
+"""
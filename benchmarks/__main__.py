@@ -0,0 +1,79 @@
+"""
+Run the plugin benchmarks:
+
+    python -m benchmarks [--scale N] [--repeat N] [--scenario NAME ...]
+                         [--json] [--output FILE] [--record]
+
+Results can be appended to a JSON lines file with --output, tagged with the
+current git commit, to track performance over time.
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+from . import harness
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stderr=subprocess.DEVNULL
+        ).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_table(results):
+    lines = ["%-18s %6s %12s %12s %12s %12s %14s" %
+             ("Scenario", "Scale", "Min (ms)", "Median (ms)", "Max (ms)", "Peak (KiB)", "Alloc blocks")]
+    lines.append("-" * len(lines[0]))
+    for result in results:
+        lines.append("%-18s %6d %12.2f %12.2f %12.2f %12s %14s" % (
+            result["scenario"],
+            result["scale"],
+            result["wall_ms_min"],
+            result["wall_ms_median"],
+            result["wall_ms_max"],
+            "%.1f" % result["peak_kib"] if result["peak_kib"] is not None else "n/a",
+            result["alloc_blocks"] if result["alloc_blocks"] is not None else "n/a",
+        ))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmark SublimeSalesforceReference")
+    parser.add_argument("--scale", type=int, default=1, help="synthetically multiply fixture ToC entries by this factor")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per scenario")
+    parser.add_argument("--scenario", action="append", choices=harness.SCENARIOS, help="scenario(s) to run (default: all)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON instead of a table")
+    parser.add_argument("--output", help="append results, tagged with the git commit, to this JSON lines file")
+    parser.add_argument("--record", action="store_true", help="re-record fixtures from developer.salesforce.com and exit")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        harness.record_fixtures()
+        return 0
+
+    results = harness.run(args.scenario, args.scale, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(format_table(results))
+
+    if args.output:
+        commit = current_commit()
+        timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        with open(args.output, "a") as output:
+            for result in results:
+                result = dict(result, commit=commit, timestamp=timestamp, python=sys.version.split()[0])
+                output.write(json.dumps(result) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
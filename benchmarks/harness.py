@@ -0,0 +1,421 @@
+"""
+Loads the plugin against the Sublime stubs and a local replay server, and
+measures the plugin's user-visible operations
+"""
+import copy
+import contextlib
+import gc
+import io
+import importlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import threading
+import time
+import types
+import urllib.parse
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from . import sublime_stub
+from .server import ReplayServer
+
+PACKAGE = "SublimeSalesforceReference"
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Fixture file for each DocTypeEnum name, and a predicate picking the ToC node
+# whose children get cloned when synthetically scaling that fixture
+FIXTURES = {
+    "APEX": ("apex.json", lambda node: node.get("id") == "apex_reference"),
+    "VISUALFORCE": ("visualforce.json", lambda node: node.get("id") == "pages_compref"),
+    "SERVICECONSOLE": ("serviceconsole.json", lambda node: node.get("text", "").startswith("Methods for")),
+}
+
+SCENARIOS = ["editor_start", "cold_start", "warm_start", "shared_index_start", "full_refresh", "panel_open",
+             "completion_query", "version_retrieve", "version_switch", "locale_lookup",
+             "page_view", "page_reopen", "content_search"]
+
+# A pinned documentation version the replay server also serves (with the same
+# fixtures, as consecutive releases' indexes are nearly identical)
+PINNED_VERSION = "244.0"
+# Likewise for a second locale
+OTHER_LOCALE = "ja-jp"
+
+
+def load_fixture(doc_type_name):
+    with open(os.path.join(FIXTURES_DIR, FIXTURES[doc_type_name][0]), encoding="utf-8") as fixture:
+        return json.load(fixture)
+
+
+def scale_toc(document, doc_type_name, factor):
+    """
+    Return a copy of a ToC document with the children of every scale point
+    cloned `factor` times (renamed so each clone is a distinct entry), giving
+    roughly `factor` times as many index entries
+    """
+    if factor <= 1:
+        return document
+    is_scale_point = FIXTURES[doc_type_name][1]
+    document = copy.deepcopy(document)
+
+    def rename(node, copy_number):
+        node["text"] = "%s %d" % (node["text"], copy_number)
+        if "a_attr" in node:
+            href = node["a_attr"]["href"]
+            page, _, anchor = href.partition("#")
+            node["a_attr"]["href"] = page.replace(".htm", "_%d.htm" % copy_number) + (_ + anchor)
+        if "id" in node:
+            node["id"] = "%s_%d" % (node["id"], copy_number)
+        for child in node.get("children", []):
+            rename(child, copy_number)
+
+    def walk(nodes):
+        for node in nodes:
+            if is_scale_point(node):
+                originals = node.get("children", [])
+                clones = []
+                for copy_number in range(2, factor + 1):
+                    for original in originals:
+                        clone = copy.deepcopy(original)
+                        rename(clone, copy_number)
+                        clones.append(clone)
+                node["children"] = originals + clones
+            else:
+                walk(node.get("children", []))
+
+    walk(document["toc"])
+    return document
+
+
+def load_plugin(settings_overrides=None):
+    """
+    Import SalesforceReference.py as Sublime would (as a module of the package
+    named after the package directory), with the Sublime API stubbed out
+    """
+    sublime = sublime_stub.install(settings_overrides)
+    for name in list(sys.modules):
+        if name == PACKAGE or name.startswith(PACKAGE + "."):
+            del sys.modules[name]
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [sublime_stub.PACKAGE_ROOT]
+    sys.modules[PACKAGE] = package
+    plugin = importlib.import_module(PACKAGE + ".SalesforceReference")
+    return plugin, sublime
+
+
+# The class page shown by the page_* scenarios
+PAGE = "apex_methods_system_string.htm"
+
+
+def synthesize_page(scale=1):
+    """
+    Content of a class page shaped like Salesforce's, with 40 (times `scale`)
+    member topics, each with a signature, a parameter table and an example
+    """
+    members = []
+    for i in range(40 * max(1, scale)):
+        members.append(
+            '<div class="topic reference nested1" id="apex_System_String_method%d">'
+            '<h2 class="helpHead2">method%d(input)</h2>'
+            '<div class="body refbody"><p class="shortdesc">Returns the <a href="apex_methods_system_string.htm#x%d">'
+            'result</a> of applying the method to <var>input</var>.</p>'
+            '<div class="section"><h4>Signature</h4><p><samp>public String method%d(String input)</samp></p></div>'
+            '<table class="featureTable"><thead><tr><th>Parameter</th><th>Type</th></tr></thead>'
+            '<tbody><tr><td>input</td><td>String</td></tr></tbody></table>'
+            '<pre class="codeblock">String s = \'abc\';\nString result = s.method%d(s);</pre>'
+            '<script>track(%d)</script></div></div>' % (i, i, i, i, i, i)
+        )
+    return ('<div class="topic reference" id="apex_methods_system_string"><h1 class="helpHead1">String Class</h1>'
+            '<div class="body refbody"><p>Contains methods for the String primitive data type.</p>%s</div></div>'
+            % "".join(members))
+
+
+def redirect_doc_types(plugin, base_url, scale=1):
+    """
+    Point every DocType's ToC URL at the replay server, returning the
+    server routes (path -> body) that serve the (scaled) fixtures
+    """
+    retrieve = sys.modules[PACKAGE + ".salesforce_reference.retrieve"]
+    routes = {}
+    for doc_type in retrieve.DocTypeEnum.get_all():
+        path = urllib.parse.urlsplit(doc_type.toc_url).path
+        document = scale_toc(load_fixture(doc_type.name), doc_type.name, scale)
+        routes[path] = json.dumps(document, separators=(",", ":")).encode("utf-8")
+        redirected = retrieve.DocType(
+            doc_type.name,
+            doc_type.doc_base_url,
+            base_url + path,
+            doc_type.preferred_strategy
+        )
+        setattr(retrieve.DocTypeEnum, doc_type.name, redirected)
+        pinned_path = urllib.parse.urlsplit(redirected.for_version(PINNED_VERSION).toc_url).path
+        routes[pinned_path] = routes[path]
+        locale_path = urllib.parse.urlsplit(redirected.for_locale(OTHER_LOCALE).toc_url).path
+        routes[locale_path] = routes[path]
+    return routes
+
+
+def wait_for_threads(before):
+    """Join every non-daemon thread started since `before` was captured"""
+    while True:
+        started = [t for t in threading.enumerate()
+                   if t not in before and t is not threading.current_thread() and not t.daemon and t.is_alive()]
+        if not started:
+            return
+        for thread in started:
+            thread.join()
+
+
+class Bench(object):
+    """
+    Holds a loaded plugin and its replay server, and implements each
+    scenario as a method returning a callable to be measured
+    """
+    # Startup caching is measured through to completion, so don't defer it
+    SETTINGS = {"deferStartupCaching": {"idleSeconds": 0, "secondsBetweenDocTypes": 0}}
+
+    def __init__(self, scale=1):
+        self.scale = scale
+        self.plugin, self.sublime = load_plugin(self.SETTINGS)
+        self.server = ReplayServer()
+        self.server.routes = redirect_doc_types(self.plugin, self.server.base_url, scale)
+        self.pages_module = sys.modules[PACKAGE + ".salesforce_reference.pages"]
+        apex = sys.modules[PACKAGE + ".salesforce_reference.retrieve"].DocTypeEnum.APEX
+        self.page_url = self.pages_module.content_url(
+            apex.toc_url, {"deliverable": "apexcode", "locale": "en-us", "version": "210.0"}, PAGE)
+        self.server.routes[urllib.parse.urlsplit(self.page_url).path] = json.dumps(
+            {"content": synthesize_page(scale)}).encode("utf-8")
+        self.server.start()
+        self.cache_module = sys.modules[PACKAGE + ".salesforce_reference.cache"]
+        self.connection_module = sys.modules[PACKAGE + ".salesforce_reference.connection"]
+        self.plugin.settings = self.sublime.load_settings("SublimeSalesforceReference.sublime-settings")
+        self.plugin.open_shared_index()
+
+    def close(self):
+        self.stop_startup_caching()
+        self.connection_module.shared_pool.close_all()
+        self.server.stop()
+
+    def reset_cache(self):
+        # Cleared in place, so listeners registered on the cache keep working
+        self.stop_startup_caching()
+        self.plugin.reference_cache.clear()
+        self.remove_shared_index()
+
+    def remove_shared_index(self):
+        try:
+            os.remove(self.plugin.shared_index.path)
+        except OSError:
+            pass
+        self.plugin.open_shared_index()
+
+    def populate_cache(self):
+        self.reset_cache()
+        self.plugin.settings = self.sublime.load_settings("SublimeSalesforceReference.sublime-settings")
+        before = set(threading.enumerate())
+        thread = self.plugin.RetrieveIndexThread(self.sublime.active_window(), "*", open_when_done=False)
+        thread.run()
+        wait_for_threads(before)
+
+    def stop_startup_caching(self):
+        if self.plugin.startup_scheduler is not None:
+            self.plugin.startup_scheduler.cancel()
+            self.plugin.startup_scheduler.join()
+
+    def run_plugin_loaded(self):
+        before = set(threading.enumerate())
+        self.plugin.plugin_loaded()
+        if self.plugin.startup_scheduler is not None:
+            self.plugin.startup_scheduler.join()
+        wait_for_threads(before)
+
+    def setup_editor_start(self):
+        """plugin_loaded returning control to Sublime, with startup caching deferred as by default"""
+        self.reset_cache()
+        settings = self.sublime.load_settings("SublimeSalesforceReference.sublime-settings")
+        settings.set("deferStartupCaching", {"idleSeconds": 3, "secondsBetweenDocTypes": 2})
+        def run():
+            try:
+                self.plugin.plugin_loaded()
+            finally:
+                settings.set("deferStartupCaching", self.SETTINGS["deferStartupCaching"])
+        return run
+
+    def setup_cold_start(self):
+        """plugin_loaded with an empty cache and no pooled connections, until startup caching is done"""
+        self.reset_cache()
+        self.connection_module.shared_pool.close_all()
+        return self.run_plugin_loaded
+
+    def setup_warm_start(self):
+        """plugin_loaded when the reference cache is already populated"""
+        self.populate_cache()
+        return self.run_plugin_loaded
+
+    def setup_shared_index_start(self):
+        """plugin_loaded with an empty cache, when another instance has published the index"""
+        self.populate_cache()
+        self.plugin.reference_cache.clear()
+        # As a new instance would, knowing nothing of the index's generation
+        self.plugin.open_shared_index()
+        self.connection_module.shared_pool.close_all()
+        return self.run_plugin_loaded
+
+    def setup_full_refresh(self):
+        """'All Documentation Types' on an empty cache, until the panel shows"""
+        self.reset_cache()
+        self.plugin.settings = self.sublime.load_settings("SublimeSalesforceReference.sublime-settings")
+        window = self.sublime.active_window()
+        def run():
+            window.panel_shown.clear()
+            self.plugin.RetrieveIndexThread(window, "*").run()
+            window.panel_shown.wait()
+        return run
+
+    def setup_panel_open(self):
+        """'All Documentation Types' with a populated cache"""
+        self.populate_cache()
+        window = self.sublime.active_window()
+        def run():
+            self.plugin.RetrieveIndexThread(window, "*").run()
+        return run
+
+    def setup_completion_query(self):
+        """A broad single-letter completion query with every doc type cached"""
+        self.populate_cache()
+        doc_types = ["APEX", "VISUALFORCE"]
+        def run():
+            self.plugin.completion_index.complete("s", doc_types)
+        return run
+
+    def setup_version_retrieve(self):
+        """Retrieving a pinned version's index, with the latest release's already cached"""
+        self.populate_cache()
+        self.plugin.select_doc_version(PINNED_VERSION)
+        self.plugin.reference_cache.clear()
+        self.remove_shared_index()
+        window = self.sublime.active_window()
+        def run():
+            try:
+                self.plugin.RetrieveIndexThread(window, "*", open_when_done=False).run()
+            finally:
+                self.plugin.select_doc_version(None)
+        return run
+
+    def setup_version_switch(self):
+        """Switching to a pinned version and back, with both already cached"""
+        self.setup_version_retrieve()()
+        def run():
+            self.plugin.select_doc_version(PINNED_VERSION)
+            self.plugin.select_doc_version(None)
+        return run
+
+    def setup_locale_lookup(self):
+        """Finding every cached page in another locale, with both locales cached"""
+        self.populate_cache()
+        other = self.plugin.get_doc_index(None, OTHER_LOCALE)
+        window = self.sublime.active_window()
+        self.plugin.RetrieveIndexThread(window, "*", open_when_done=False, doc_index=other).run()
+        locale_map = self.plugin.locale_maps[None]
+        entries = list(self.plugin.reference_cache.entries)
+        def run():
+            for entry in entries:
+                locale_map.translations(entry.doc_type, entry.url)
+        return run
+
+    def setup_page_view(self):
+        """Showing a class page in Sublime Text for the first time: fetched and rendered"""
+        page_cache = self.plugin.page_cache
+        page_cache.directory = os.path.join(self.sublime.cache_path(), "SublimeSalesforceReference", "pages")
+        shutil.rmtree(page_cache.directory, ignore_errors=True)
+        page_cache.clear()
+        def run():
+            self.pages_module.load_page(page_cache, self.page_url)
+        return run
+
+    def setup_page_reopen(self):
+        """Showing that page again after a restart, from the disk cache"""
+        self.setup_page_view()()
+        self.plugin.page_cache.clear()
+        def run():
+            self.pages_module.load_page(self.plugin.page_cache, self.page_url)
+        return run
+
+    def setup_content_search(self):
+        """A three word content search over 400 (times the scale) class pages"""
+        search = sys.modules[PACKAGE + ".salesforce_reference.search"]
+        text = search.extract_text(synthesize_page())
+        search_index = search.SearchIndex()
+        for i in range(400 * max(1, self.scale)):
+            search_index.add("APEX", "page_%d.htm" % i, "Class%d Class" % i,
+                             text.replace("method", "method%d_" % i if i % 4 else "method"))
+        def run():
+            search_index.search("returns the result")
+        return run
+
+    def measure(self, scenario, repeat):
+        """
+        Run `scenario` `repeat` times for wall time, then once more under
+        tracemalloc for peak memory and allocated block counts
+        """
+        setup = getattr(self, "setup_" + scenario)
+        timings = []
+        for i in range(repeat):
+            run = setup()
+            gc.collect()
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+
+        result = {
+            "scenario": scenario,
+            "scale": self.scale,
+            "repeat": repeat,
+            "wall_ms_min": min(timings) * 1000,
+            "wall_ms_median": statistics.median(timings) * 1000,
+            "wall_ms_max": max(timings) * 1000,
+            "peak_kib": None,
+            "alloc_blocks": None,
+        }
+        if tracemalloc is not None:
+            run = setup()
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            run()
+            after = tracemalloc.take_snapshot()
+            result["peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024.0
+            tracemalloc.stop()
+            result["alloc_blocks"] = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+        return result
+
+
+def run(scenarios=None, scale=1, repeat=5):
+    # The plugin reports progress with print(); keep that out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        bench = Bench(scale)
+        try:
+            return [bench.measure(scenario, repeat) for scenario in (scenarios or SCENARIOS)]
+        finally:
+            bench.close()
+
+
+def record_fixtures():
+    """
+    Replace the fixtures with live ToC responses from developer.salesforce.com
+    """
+    plugin, sublime = load_plugin()
+    retrieve = sys.modules[PACKAGE + ".salesforce_reference.retrieve"]
+    connection = sys.modules[PACKAGE + ".salesforce_reference.connection"]
+    for doc_type in retrieve.DocTypeEnum.get_all():
+        document = json.loads(connection.shared_pool.fetch(doc_type.toc_url, {"User-Agent": "Mozilla/5.0"}).decode("utf-8"))
+        path = os.path.join(FIXTURES_DIR, FIXTURES[doc_type.name][0])
+        with open(path, "w", encoding="utf-8") as fixture:
+            json.dump(document, fixture, separators=(",", ":"))
+        print("Recorded %s -> %s" % (doc_type.toc_url, path))
+    connection.shared_pool.close_all()
@@ -0,0 +1,64 @@
+"""
+A local keep-alive HTTP server that replays recorded documentation responses
+"""
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, Nagle's
+    # algorithm plus delayed ACKs add ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.routes.get(self.path.split("?")[0])
+        self.server.request_count += 1
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves `routes`, a dict of URL path -> response body bytes, on a random
+    local port. Use as a context manager, or call start()/stop()
+    """
+    daemon_threads = True
+
+    def __init__(self, routes=None):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), ReplayHandler)
+        self.routes = dict(routes or {})
+        self.request_count = 0
+        self.__thread = None
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
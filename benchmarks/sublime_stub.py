@@ -0,0 +1,185 @@
+"""
+Minimal stand-ins for the `sublime` and `sublime_plugin` modules, sufficient
+to import and drive SalesforceReference.py outside of Sublime Text.
+
+Only the API surface the plugin actually uses is provided. Calls that would
+affect the UI are recorded on the stub objects so benchmarks (and anyone
+poking at the plugin from a REPL) can see what happened.
+"""
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import types
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def strip_json_comments(text):
+    """Remove the /* */ and // comments Sublime allows in settings files"""
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    return re.sub(r"^\s*//.*$", "", text, flags=re.M)
+
+
+class Settings(object):
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def has(self, key):
+        return key in self.values
+
+    def erase(self, key):
+        self.values.pop(key, None)
+
+    def add_on_change(self, key, callback):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+
+class View(object):
+    def __init__(self, window):
+        self.window_ = window
+        self.name_ = ""
+        self.text = ""
+        self.settings_ = Settings()
+        self.read_only = False
+
+    def window(self):
+        return self.window_
+
+    def set_name(self, name):
+        self.name_ = name
+
+    def name(self):
+        return self.name_
+
+    def set_scratch(self, scratch):
+        pass
+
+    def set_read_only(self, read_only):
+        self.read_only = read_only
+
+    def settings(self):
+        return self.settings_
+
+    def run_command(self, command, args=None):
+        if command == "append":
+            self.text += (args or {}).get("characters", "")
+
+    def score_selector(self, point, selector):
+        return 0
+
+
+class Window(object):
+    """
+    Records quick panels shown on it. `panel_shown` is set whenever
+    show_quick_panel is called, so callers can wait for the plugin to finish
+    """
+    def __init__(self):
+        self.quick_panels = []
+        self.views = []
+        self.panel_shown = threading.Event()
+
+    def show_quick_panel(self, items, on_select, flags=0, selected_index=-1, on_highlight=None):
+        self.quick_panels.append((items, on_select))
+        self.panel_shown.set()
+
+    def new_file(self):
+        view = View(self)
+        self.views.append(view)
+        return view
+
+    def active_view(self):
+        return self.views[-1] if self.views else None
+
+    def create_output_panel(self, name):
+        return self.new_file()
+
+    def run_command(self, command, args=None):
+        pass
+
+
+def build_sublime_module(settings_overrides=None):
+    module = types.ModuleType("sublime")
+    module.status_messages = []
+    module.active_window_ = Window()
+
+    with open(os.path.join(PACKAGE_ROOT, "SublimeSalesforceReference.sublime-settings")) as settings_file:
+        defaults = json.loads(strip_json_comments(settings_file.read()))
+    defaults.update(settings_overrides or {})
+    settings_cache = {"SublimeSalesforceReference.sublime-settings": Settings(defaults)}
+    cache_dir = tempfile.mkdtemp(prefix="sublime-salesforce-reference-bench-")
+
+    def load_settings(name):
+        return settings_cache.setdefault(name, Settings())
+
+    def save_settings(name):
+        pass
+
+    def set_timeout(callback, delay=0):
+        if delay:
+            timer = threading.Timer(delay / 1000.0, callback)
+            timer.daemon = True
+            timer.start()
+        else:
+            callback()
+
+    module.load_settings = load_settings
+    module.save_settings = save_settings
+    module.set_timeout = set_timeout
+    module.set_timeout_async = set_timeout
+    module.active_window = lambda: module.active_window_
+    module.windows = lambda: [module.active_window_]
+    module.status_message = module.status_messages.append
+    module.error_message = module.status_messages.append
+    module.message_dialog = module.status_messages.append
+    module.cache_path = lambda: cache_dir
+    module.packages_path = lambda: cache_dir
+    module.version = lambda: "3211"
+    module.platform = lambda: sys.platform
+    return module
+
+
+def build_sublime_plugin_module():
+    module = types.ModuleType("sublime_plugin")
+
+    class WindowCommand(object):
+        def __init__(self, window):
+            self.window = window
+
+    class TextCommand(object):
+        def __init__(self, view):
+            self.view = view
+
+    class ApplicationCommand(object):
+        pass
+
+    class EventListener(object):
+        pass
+
+    module.WindowCommand = WindowCommand
+    module.TextCommand = TextCommand
+    module.ApplicationCommand = ApplicationCommand
+    module.EventListener = EventListener
+    return module
+
+
+def install(settings_overrides=None):
+    """
+    Install the stubs into sys.modules, returning the `sublime` stub.
+    `settings_overrides` are applied on top of the package's default settings
+    """
+    sublime = build_sublime_module(settings_overrides)
+    sys.modules["sublime"] = sublime
+    sys.modules["sublime_plugin"] = build_sublime_plugin_module()
+    return sublime
@@ -23,6 +23,7 @@ __license__ = "MIT"
 
 __all__ = ['BeautifulSoup']
 
+from collections import deque
 import os
 import re
 import warnings
@@ -41,6 +42,7 @@ from .element import (
     ResultSet,
     SoupStrainer,
     Tag,
+    TreeIndex,
     )
 
 # The very first thing we do is give a useful error if someone is
@@ -78,10 +80,16 @@ class BeautifulSoup(Tag):
     ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
 
     def __init__(self, markup="", features=None, builder=None,
-                 parse_only=None, from_encoding=None, **kwargs):
+                 parse_only=None, from_encoding=None, indexed=False,
+                 **kwargs):
         """The Soup object is initialized as the 'root tag', and the
         provided markup (which can be a string or a file-like object)
-        is fed into the underlying parser."""
+        is fed into the underlying parser.
+
+        If `indexed` is true, the tree's tags are indexed by name, id
+        and class (see TreeIndex), which makes find(), find_all() and
+        select() much faster when searching a large document many
+        times."""
 
         if 'convertEntities' in kwargs:
             warnings.warn(
@@ -203,11 +211,95 @@ class BeautifulSoup(Tag):
         self.markup = None
         self.builder.soup = None
 
+        if indexed:
+            self._index = TreeIndex(self)
+
+    @classmethod
+    def incremental(cls, features=None, builder=None, parse_only=None,
+                    from_encoding=None, indexed=False, **kwargs):
+        """Start parsing a document that will arrive a piece at a time.
+
+        Takes the same arguments as the constructor, other than the
+        markup. Returns an IncrementalParser: pass the pieces of the
+        document (strings or bytestrings) to its feed() method as
+        they arrive, then call close() to get the finished soup.
+        Only some tree builders (such as html.parser's) can do this.
+        """
+        soup = cls("", features, builder, parse_only, **kwargs)
+        soup.builder.soup = soup
+        soup.reset()
+        soup.builder.start_incremental(from_encoding)
+        return IncrementalParser(soup, indexed)
+
+    @classmethod
+    def iterparse(cls, source, match, features=None, within=None,
+                  builder=None, from_encoding=None, chunk_size=65536):
+        """Parse a document, yielding the tags that match `match` one at
+        a time, without building the rest of the tree.
+
+        Each matching tag is yielded, along with its contents, as soon
+        as it closes, detached from the document. Everything else is
+        thrown away once it's been parsed, so however big the
+        document, no more than one matching tag is held in memory at
+        once. A match within a match is part of the outer one and
+        isn't yielded by itself.
+
+        :param source: The document: a string or bytestring, a file,
+            or an iterable of strings or bytestrings (such as the
+            pieces of a download).
+        :param match: The tags to yield: a SoupStrainer, or a name (or
+            list of names) to make one from.
+        :param within: If given, only tags inside a tag matching this
+            (a SoupStrainer or name) are yielded.
+        """
+        kwargs = dict(match=match, within=within)
+        try:
+            parser = StreamingSoup.incremental(
+                features, builder, from_encoding=from_encoding, **kwargs)
+        except NotImplementedError:
+            # This tree builder needs the whole document at once.
+            if hasattr(source, 'read'):
+                source = source.read()
+            elif not isinstance(source, (str, bytes)):
+                pieces = list(source)
+                source = pieces[0][:0].join(pieces) if pieces else ''
+            soup = StreamingSoup(
+                source, features, builder, from_encoding=from_encoding,
+                **kwargs)
+            for tag in soup.found:
+                yield tag
+            return
+
+        soup = parser.soup
+        if hasattr(source, 'read'):
+            pieces = iter(lambda: source.read(chunk_size), source.read(0))
+        elif isinstance(source, (str, bytes)):
+            pieces = (source[i:i+chunk_size]
+                      for i in range(0, len(source), chunk_size))
+        else:
+            pieces = source
+        for piece in pieces:
+            parser.feed(piece)
+            while soup.found:
+                yield soup.found.popleft()
+        parser.close()
+        while soup.found:
+            yield soup.found.popleft()
+
+    def reindex(self):
+        """Rebuild the tree's index (if it has one) the next time it's
+        used. Only needed after assigning to a tag's .name or .attrs."""
+        if self._index is not None:
+            self._index.invalidate()
+
     def _feed(self):
         # Convert the document to Unicode.
         self.builder.reset()
 
         self.builder.feed(self.markup)
+        self._close_open_tags()
+
+    def _close_open_tags(self):
         # Close out any unfinished strings and close all the open tags.
         self.endData()
         while self.currentTag.name != self.ROOT_TAG_NAME:
@@ -362,14 +454,7 @@ class BeautifulSoup(Tag):
         """Returns a string or Unicode representation of this document.
         To get Unicode, pass None for encoding."""
 
-        if self.is_xml:
-            # Print the XML declaration
-            encoding_part = ''
-            if eventual_encoding != None:
-                encoding_part = ' encoding="%s"' % eventual_encoding
-            prefix = '<?xml version="1.0"%s?>\n' % encoding_part
-        else:
-            prefix = ''
+        prefix = self._xml_declaration(eventual_encoding)
         if not pretty_print:
             indent_level = None
         else:
@@ -377,6 +462,26 @@ class BeautifulSoup(Tag):
         return prefix + super(BeautifulSoup, self).decode(
             indent_level, eventual_encoding, formatter)
 
+    def _write_to(self, write, pretty_print, eventual_encoding, formatter):
+        prefix = self._xml_declaration(eventual_encoding)
+        if prefix:
+            write(prefix)
+        if not pretty_print:
+            indent_level = None
+        else:
+            indent_level = 0
+        self._serialize(write, indent_level, eventual_encoding, formatter)
+
+    def _xml_declaration(self, eventual_encoding):
+        """The XML declaration that starts this document, if it's XML."""
+        if not self.is_xml:
+            return ''
+        # Print the XML declaration
+        encoding_part = ''
+        if eventual_encoding != None:
+            encoding_part = ' encoding="%s"' % eventual_encoding
+        return '<?xml version="1.0"%s?>\n' % encoding_part
+
 # Alias to make it easier to type import: 'from bs4 import _soup'
 _s = BeautifulSoup
 _soup = BeautifulSoup
@@ -392,6 +497,120 @@ class BeautifulStoneSoup(BeautifulSoup):
         super(BeautifulStoneSoup, self).__init__(*args, **kwargs)
 
 
+class StreamingSoup(BeautifulSoup):
+    """The tree builder's target for BeautifulSoup.iterparse().
+
+    As the document is parsed, a tag that matches `match` (inside a tag
+    that matches `within`, if that's given) is taken out of the tree
+    when it closes and added to `found`. Every other tag is thrown
+    away when it closes, as are strings outside a matching tag, so the
+    tree never holds more than the open tags and the match being
+    built.
+    """
+
+    def __init__(self, markup="", features=None, builder=None,
+                 parse_only=None, from_encoding=None, match=None,
+                 within=None, **kwargs):
+        if match is not None and not isinstance(match, SoupStrainer):
+            match = SoupStrainer(match)
+        if within is not None and not isinstance(within, SoupStrainer):
+            within = SoupStrainer(within)
+        self.match = match
+        self.within = within
+        self.found = deque()
+        super(StreamingSoup, self).__init__(
+            markup, features, builder, None, from_encoding, **kwargs)
+
+    def reset(self):
+        super(StreamingSoup, self).reset()
+        # The open tag that matched, and the open tags that matched
+        # `within`.
+        self._open_match = None
+        self._open_within = []
+
+    def handle_starttag(self, name, namespace, nsprefix, attrs):
+        tag = super(StreamingSoup, self).handle_starttag(
+            name, namespace, nsprefix, attrs)
+        if tag is None or self._open_match is not None:
+            return tag
+        if ((self.within is None or self._open_within)
+            and self.match is not None and self.match.search_tag(tag)):
+            self._open_match = tag
+        elif self.within is not None and self.within.search_tag(tag):
+            self._open_within.append(tag)
+        return tag
+
+    def popTag(self):
+        tag = self.currentTag
+        current = super(StreamingSoup, self).popTag()
+        if tag is self._open_match:
+            self._open_match = None
+            self._drop(tag)
+            self.found.append(tag)
+        elif self._open_match is None:
+            if self._open_within and tag is self._open_within[-1]:
+                self._open_within.pop()
+            self._drop(tag)
+            # Its contents are gone already, so this breaks its last
+            # link to the tree.
+            tag.next_element = None
+        return current
+
+    def _drop(self, tag):
+        # Take a closed tag out of the tree. Nothing has been parsed
+        # since it closed, so it's the last element in the tree, and
+        # quicker to unlink than with extract().
+        del tag.parent.contents[-1]
+        previous = tag.previous_element
+        if previous is not None:
+            previous.next_element = None
+        if tag.previous_sibling is not None:
+            tag.previous_sibling.next_sibling = None
+        tag.parent = tag.previous_element = tag.previous_sibling = None
+        self._most_recent_element = previous
+
+    def object_was_parsed(self, o, parent=None, most_recent_element=None):
+        if self._open_match is None:
+            # A string that no match will ever contain.
+            return
+        super(StreamingSoup, self).object_was_parsed(
+            o, parent, most_recent_element)
+
+
+class IncrementalParser(object):
+    """Builds a BeautifulSoup object from a document given a piece at a
+    time. Made by BeautifulSoup.incremental().
+
+    The tree is the same one the BeautifulSoup constructor would build
+    from the whole document. While the document is being fed in,
+    `soup` holds the tree built so far.
+    """
+
+    def __init__(self, soup, indexed=False):
+        self.soup = soup
+        self.indexed = indexed
+
+    def feed(self, markup):
+        """Parse the next piece of the document."""
+        if self.soup.builder.soup is None:
+            raise ValueError("This document has already been closed.")
+        self.soup.builder.feed_incremental(markup)
+
+    def close(self):
+        """Finish parsing the document and return the soup."""
+        soup = self.soup
+        if soup.builder.soup is None:
+            return soup
+        (soup.original_encoding, soup.declared_html_encoding,
+         soup.contains_replacement_characters) = (
+            soup.builder.close_incremental())
+        soup._close_open_tags()
+        soup.builder.soup = None
+        if self.indexed:
+            soup._index = TreeIndex(soup)
+        return soup
+
+
 class StopParsing(Exception):
     pass
 
@@ -122,6 +122,29 @@ class TreeBuilder(object):
     def feed(self, markup):
         raise NotImplementedError()
 
+    def start_incremental(self, user_specified_encoding=None):
+        """Get ready to parse a document that arrives a piece at a time.
+
+        The pieces are passed to feed_incremental(), and then
+        close_incremental() is called. Builders that can't parse a
+        document this way raise NotImplementedError.
+        """
+        raise NotImplementedError(
+            "%s can't parse a document a piece at a time."
+            % self.__class__.__name__)
+
+    def feed_incremental(self, markup):
+        raise NotImplementedError()
+
+    def close_incremental(self):
+        """Finish parsing an incremental document.
+
+        :return: A 3-tuple (original encoding, encoding declared
+        within markup, whether any characters had to be replaced with
+        REPLACEMENT CHARACTER), as for prepare_markup().
+        """
+        raise NotImplementedError()
+
     def prepare_markup(self, markup, user_specified_encoding=None,
                        document_declared_encoding=None):
         return markup, None, None, False
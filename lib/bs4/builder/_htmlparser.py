@@ -4,26 +4,37 @@ __all__ = [
     'HTMLParserTreeBuilder',
     ]
 
-from html.parser import (
-    HTMLParser,
-    HTMLParseError,
-    )
+from html.parser import HTMLParser
+try:
+    from html.parser import HTMLParseError
+except ImportError as e:
+    # HTMLParseError was removed in Python 3.5. Since it can never be
+    # raised past that point, a local stand-in keeps the except clause
+    # below valid.
+    class HTMLParseError(Exception):
+        pass
 import sys
 import warnings
 
 # Starting in Python 3.2, the HTMLParser constructor takes a 'strict'
 # argument, which we'd like to set to False. Unfortunately,
 # http://bugs.python.org/issue13273 makes strict=True a better bet
-# before Python 3.2.3.
+# before Python 3.2.3. The argument was removed in Python 3.5.
 #
 # At the end of this file, we monkeypatch HTMLParser so that
 # strict=True works well on Python 3.2.2.
 major, minor, release = sys.version_info[:3]
 CONSTRUCTOR_TAKES_STRICT = (
-    major > 3
-    or (major == 3 and minor > 2)
+    (major == 3 and minor > 2 and minor < 5)
     or (major == 3 and minor == 2 and release >= 3))
 
+# Starting in Python 3.4, the HTMLParser constructor takes a
+# 'convert_charrefs' argument, which defaults to True from Python 3.5.
+# We handle character and entity references ourselves, so it must be
+# False.
+CONSTRUCTOR_TAKES_CONVERT_CHARREFS = (
+    major > 3 or (major == 3 and minor >= 4))
+
 from bs4.element import (
     CData,
     Comment,
@@ -31,7 +42,11 @@ from bs4.element import (
     Doctype,
     ProcessingInstruction,
     )
-from bs4.dammit import EntitySubstitution, UnicodeDammit
+from bs4.dammit import (
+    EntitySubstitution,
+    IncrementalUnicodeDammit,
+    UnicodeDammit,
+    )
 
 from bs4.builder import (
     HTML,
@@ -133,6 +148,8 @@ class HTMLParserTreeBuilder(HTMLTreeBuilder):
     def __init__(self, *args, **kwargs):
         if CONSTRUCTOR_TAKES_STRICT:
             kwargs['strict'] = False
+        if CONSTRUCTOR_TAKES_CONVERT_CHARREFS:
+            kwargs['convert_charrefs'] = False
         self.parser_args = (args, kwargs)
 
     def prepare_markup(self, markup, user_specified_encoding=None,
@@ -153,9 +170,35 @@ class HTMLParserTreeBuilder(HTMLTreeBuilder):
                dammit.contains_replacement_characters)
 
     def feed(self, markup):
+        self._feed_parser(self._new_parser(), markup)
+
+    def start_incremental(self, user_specified_encoding=None):
+        self.parser = self._new_parser()
+        self.dammit = IncrementalUnicodeDammit(
+            [user_specified_encoding], is_html=True)
+
+    def feed_incremental(self, markup):
+        if not isinstance(markup, str):
+            markup = self.dammit.feed(markup)
+        if markup:
+            self._feed_parser(self.parser, markup)
+
+    def close_incremental(self):
+        markup = self.dammit.close()
+        if markup:
+            self._feed_parser(self.parser, markup)
+        dammit = self.dammit
+        self.parser = self.dammit = None
+        return (dammit.original_encoding, dammit.declared_html_encoding,
+                dammit.contains_replacement_characters)
+
+    def _new_parser(self):
         args, kwargs = self.parser_args
         parser = BeautifulSoupHTMLParser(*args, **kwargs)
         parser.soup = self.soup
+        return parser
+
+    def _feed_parser(self, parser, markup):
         try:
             parser.feed(markup)
         except HTMLParseError as e:
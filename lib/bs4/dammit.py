@@ -8,6 +8,7 @@ XML or HTML to reflect a new encoding; that's the tree builder's job.
 """
 
 import codecs
+import functools
 from html.entities import codepoint2name
 import re
 import logging
@@ -46,6 +47,30 @@ xml_encoding_re = re.compile(
     '^<\?.*encoding=[\'"](.*?)[\'"].*\?>'.encode(), re.I)
 html_meta_re = re.compile(
     '<\s*meta[^>]+charset\s*=\s*["\']?([^>]*?)[ /;\'">]'.encode(), re.I)
+non_ascii_re = re.compile(b'[\x80-\xff]')
+
+if hasattr(str, 'isascii'):
+    _is_ascii = str.isascii
+else:
+    # Python 3.6 and earlier. Encoding an ASCII string to UTF-8 is
+    # just a copy.
+    def _is_ascii(s):
+        return len(s.encode('utf-8', 'surrogatepass')) == len(s)
+
+# How many codec names to remember the lookup of.
+CODEC_CACHE_SIZE = 256
+
+@functools.lru_cache(maxsize=CODEC_CACHE_SIZE)
+def _lookup_codec(charset):
+    """The codec called `charset`, or None if there's no such codec.
+
+    Failed lookups are slow, and the same few names turn up again and
+    again, so the answers are cached.
+    """
+    try:
+        return codecs.lookup(charset)
+    except (LookupError, ValueError):
+        return None
 
 class EntitySubstitution(object):
 
@@ -70,6 +95,12 @@ class EntitySubstitution(object):
     (CHARACTER_TO_HTML_ENTITY, HTML_ENTITY_TO_CHARACTER,
      CHARACTER_TO_HTML_ENTITY_RE) = _populate_class_variables()
 
+    # The characters with named entities, other than the XML special
+    # characters. They're all outside ASCII.
+    CHARACTER_TO_NON_XML_HTML_ENTITY_RE = re.compile("[%s]" % "".join(
+        character for character in CHARACTER_TO_HTML_ENTITY
+        if character not in "&<>"))
+
     CHARACTER_TO_XML_ENTITY = {
         "'": "apos",
         '"': "quot",
@@ -84,6 +115,8 @@ class EntitySubstitution(object):
 
     AMPERSAND_OR_BRACKET = re.compile("([<>&])")
 
+    BARE_AMPERSAND = re.compile(r"&(?!#\d+;|#x[0-9a-fA-F]+;|\w+;)")
+
     @classmethod
     def _substitute_html_entity(cls, matchobj):
         entity = cls.CHARACTER_TO_HTML_ENTITY.get(matchobj.group(0))
@@ -96,6 +129,16 @@ class EntitySubstitution(object):
         entity = cls.CHARACTER_TO_XML_ENTITY[matchobj.group(0)]
         return "&%s;" % entity
 
+    @staticmethod
+    def _escape_brackets(value):
+        # str.replace is much quicker than a regular expression with a
+        # callback, and most strings don't need it at all.
+        if "<" in value:
+            value = value.replace("<", "&lt;")
+        if ">" in value:
+            value = value.replace(">", "&gt;")
+        return value
+
     @classmethod
     def quoted_attribute_value(self, value):
         """Make a value into a quoted XML attribute, possibly escaping it.
@@ -147,8 +190,9 @@ class EntitySubstitution(object):
          quoted, as befits an attribute value.
         """
         # Escape angle brackets and ampersands.
-        value = cls.AMPERSAND_OR_BRACKET.sub(
-            cls._substitute_xml_entity, value)
+        if "&" in value:
+            value = value.replace("&", "&amp;")
+        value = cls._escape_brackets(value)
 
         if make_quoted_attribute:
             value = cls.quoted_attribute_value(value)
@@ -169,8 +213,9 @@ class EntitySubstitution(object):
         """
         # Escape angle brackets, and ampersands that aren't part of
         # entities.
-        value = cls.BARE_AMPERSAND_OR_BRACKET.sub(
-            cls._substitute_xml_entity, value)
+        if "&" in value:
+            value = cls.BARE_AMPERSAND.sub("&amp;", value)
+        value = cls._escape_brackets(value)
 
         if make_quoted_attribute:
             value = cls.quoted_attribute_value(value)
@@ -188,7 +233,14 @@ class EntitySubstitution(object):
         character with "&eacute;" will make it more readable to some
         people.
         """
-        return cls.CHARACTER_TO_HTML_ENTITY_RE.sub(
+        # The XML special characters are quickly replaced, which
+        # leaves nothing to do for an ASCII string.
+        if "&" in s:
+            s = s.replace("&", "&amp;")
+        s = cls._escape_brackets(s)
+        if _is_ascii(s):
+            return s
+        return cls.CHARACTER_TO_NON_XML_HTML_ENTITY_RE.sub(
             cls._substitute_html_entity, s)
 
 
@@ -205,18 +257,28 @@ class EncodingDetector:
     document), or in a <meta> tag (if the bytestring is to be
     interpreted as an HTML document.)
 
-    3. An encoding detected through textual analysis by chardet,
+    3. UTF-8, if the bytestring is valid UTF-8. Text in any other
+    encoding almost never is, so this is tried before the slower
+    textual analysis.
+
+    4. An encoding detected through textual analysis by chardet,
     cchardet, or a similar external library.
 
-    4. UTF-8.
+    5. UTF-8.
 
-    5. Windows-1252.
+    6. Windows-1252.
     """
+
+    # chardet is slow, and all it needs to see are the non-ASCII
+    # bytes: it's given this many bytes, from the first of them.
+    CHARDET_SAMPLE_SIZE = 64 * 1024
+
     def __init__(self, markup, override_encodings=None, is_html=False):
         self.override_encodings = override_encodings or []
         self.chardet_encoding = None
         self.is_html = is_html
         self.declared_encoding = None
+        self._utf8_markup = None
 
         # First order of business: strip a byte-order mark.
         self.markup, self.sniffed_encoding = self.strip_byte_order_mark(markup)
@@ -250,10 +312,15 @@ class EncodingDetector:
         if self._usable(self.declared_encoding, tried):
             yield self.declared_encoding
 
+        # If the document is valid UTF-8, there's no need to guess.
+        if 'utf-8' not in tried and self.utf8_markup is not None:
+            tried.add('utf-8')
+            yield 'utf-8'
+
         # Use third-party character set detection to guess at the
         # encoding.
         if self.chardet_encoding is None:
-            self.chardet_encoding = chardet_dammit(self.markup)
+            self.chardet_encoding = chardet_dammit(self._chardet_sample())
         if self._usable(self.chardet_encoding, tried):
             yield self.chardet_encoding
 
@@ -262,6 +329,29 @@ class EncodingDetector:
             if self._usable(e, tried):
                 yield e
 
+    @property
+    def utf8_markup(self):
+        """The markup decoded as UTF-8, or None if it isn't valid UTF-8.
+
+        Decoding is the quickest way to find out, and UnicodeDammit
+        reuses the result rather than decoding the markup again.
+        """
+        if self._utf8_markup is None:
+            try:
+                self._utf8_markup = self.markup.decode('utf-8')
+            except UnicodeDecodeError:
+                self._utf8_markup = False
+        if self._utf8_markup is False:
+            return None
+        return self._utf8_markup
+
+    def _chardet_sample(self):
+        match = non_ascii_re.search(self.markup)
+        if match is None:
+            return self.markup[:self.CHARDET_SAMPLE_SIZE]
+        start = match.start()
+        return self.markup[start:start + self.CHARDET_SAMPLE_SIZE]
+
     @classmethod
     def strip_byte_order_mark(cls, data):
         """If a byte-order mark is present, strip it and return the encoding it implies."""
@@ -425,6 +515,14 @@ class UnicodeDammit:
     def _to_unicode(self, data, encoding, errors="strict"):
         '''Given a string and its encoding, decodes the string into Unicode.
         %encoding is a string recognized by encodings.aliases'''
+        codec = _lookup_codec(encoding)
+        if (errors == "strict" and data is self.detector.markup
+            and codec is not None and codec.name == 'utf-8'):
+            # The detector may have decoded it already.
+            u = self.detector.utf8_markup
+            if u is None:
+                raise ValueError("The markup isn't valid UTF-8.")
+            return u
         return str(data, encoding, errors)
 
     @property
@@ -448,11 +546,8 @@ class UnicodeDammit:
         if not charset:
             return charset
         codec = None
-        try:
-            codecs.lookup(charset)
+        if _lookup_codec(charset) is not None:
             codec = charset
-        except (LookupError, ValueError):
-            pass
         return codec
 
 
@@ -827,3 +922,129 @@ class UnicodeDammit:
             byte_chunks.append(in_bytes[chunk_start:])
         return b''.join(byte_chunks)
 
+
+
+class IncrementalUnicodeDammit(UnicodeDammit):
+    """Converts a document to Unicode a piece at a time, as it arrives.
+
+    The encoding is chosen as UnicodeDammit would choose it, but from
+    the start of the document only: up to PREFIX_SIZE bytes are held
+    back while looking for a byte-order mark or a declared encoding,
+    and the first candidate encoding that can decode them is used. If
+    that encoding turns out to be wrong further on, the rest of the
+    document is decoded with the next candidate that works, and as a
+    last resort with REPLACEMENT CHARACTER. `original_encoding` is
+    the encoding in use at the end of the document.
+    """
+
+    PREFIX_SIZE = 2048
+
+    def __init__(self, override_encodings=[], is_html=False):
+        self.smart_quotes_to = None
+        self.tried_encodings = []
+        self.contains_replacement_characters = False
+        self.is_html = is_html
+        self.override_encodings = override_encodings
+        self.detector = None
+        self.markup = self.unicode_markup = None
+        self.original_encoding = None
+        self._prefix = []
+        self._prefix_length = 0
+        self._candidates = None
+        self._decoder = None
+
+    def feed(self, data):
+        """Returns as much of the document as can be decoded so far."""
+        if self._decoder is not None:
+            return self._decode(data, False)
+        self._prefix.append(data)
+        self._prefix_length += len(data)
+        if (self._prefix_length < self.PREFIX_SIZE
+            and not (any(self.override_encodings)
+                     and self._prefix_length >= 4)):
+            return ''
+        return self._start(False)
+
+    def close(self):
+        """Returns the rest of the document."""
+        if self._decoder is None:
+            return self._start(True)
+        return self._decode(b'', True)
+
+    def _start(self, final):
+        # Choose an encoding from the bytes held back so far.
+        self.detector = EncodingDetector(
+            b''.join(self._prefix), self.override_encodings, self.is_html)
+        self._prefix = None
+        data = self.detector.markup
+        if final and not data:
+            return ''
+        self._candidates = []
+        for encoding in self.detector.encodings:
+            encoding = self.find_codec(encoding)
+            if encoding and encoding not in self._candidates:
+                self._candidates.append(encoding)
+        for encoding in self._candidates:
+            decoder = self._incremental_decoder(encoding)
+            if decoder is None:
+                continue
+            try:
+                u = decoder.decode(data, final)
+            except Exception:
+                continue
+            self.original_encoding = encoding
+            self._decoder = decoder
+            return u
+        # Nothing could decode even the start of the document.
+        self._switch_encoding(None)
+        return self._decode(data, final)
+
+    def _incremental_decoder(self, encoding, errors="strict"):
+        if (encoding, errors) in self.tried_encodings:
+            return None
+        self.tried_encodings.append((encoding, errors))
+        try:
+            return codecs.getincrementaldecoder(encoding)(errors)
+        except Exception:
+            return None
+
+    def _switch_encoding(self, failed):
+        # Move on to the next encoding that hasn't been tried, or, if
+        # they've all failed, to decoding with replacement characters.
+        for encoding in self._candidates:
+            decoder = self._incremental_decoder(encoding)
+            if decoder is not None:
+                break
+        else:
+            for encoding in [failed] + self._candidates:
+                if encoding and encoding != "ascii":
+                    decoder = self._incremental_decoder(encoding, "replace")
+                    if decoder is not None:
+                        break
+            logging.warning(
+                "Some characters could not be decoded, and were "
+                "replaced with REPLACEMENT CHARACTER.")
+            self.contains_replacement_characters = True
+        self.original_encoding = encoding
+        self._decoder = decoder
+
+    def _decode(self, data, final):
+        pieces = []
+        while True:
+            try:
+                pieces.append(self._decoder.decode(data, final))
+                break
+            except UnicodeDecodeError as e:
+                # Everything before the bad bytes decoded fine; go on
+                # from them with another encoding.
+                pieces.append(e.object[:e.start].decode(
+                    self.original_encoding, 'replace'))
+                data = e.object[e.start:]
+                self._switch_encoding(self.original_encoding)
+        return ''.join(pieces)
+
+    @property
+    def declared_html_encoding(self):
+        if not self.is_html or self.detector is None:
+            return None
+        return self.detector.declared_encoding
@@ -4,11 +4,14 @@ from io import StringIO
 from html.parser import HTMLParser
 import bs4
 from bs4 import BeautifulSoup, __version__
+from bs4.dammit import UnicodeDammit
+from bs4.element import SoupStrainer
 from bs4.builder import builder_registry
 
 import os
 import pstats
 import random
+import re
 import tempfile
 import time
 import traceback
@@ -186,6 +189,332 @@ def benchmark_parsers(num_elements=100000):
     b = time.time()
     print("Raw html5lib parsed the markup in %.2fs." % (b-a))
 
+def rtagged_doc(num_elements=1000, num_classes=50):
+    """Randomly generate a valid HTML document whose tags all have ids
+    and classes."""
+    tag_names = ['p', 'div', 'span', 'a', 'li']
+    classes = [rword() for i in range(num_classes)]
+    elements = []
+    open_tags = []
+    for i in range(num_elements):
+        if open_tags and random.randint(0, 2) == 0:
+            elements.append("</%s>" % open_tags.pop())
+        tag_name = random.choice(tag_names)
+        elements.append('<%s id="e%d" class="%s">%s' % (
+            tag_name, i, random.choice(classes), rsentence(1)))
+        open_tags.append(tag_name)
+    elements.extend("</%s>" % tag_name for tag_name in reversed(open_tags))
+    return "<html><body>" + "\n".join(elements) + "</body></html>", classes
+
+def benchmark_searches(num_elements=100000, num_queries=100,
+                       parser="html.parser"):
+    """Compare searching a large document with and without an index."""
+    print("Search benchmark on Beautiful Soup %s" % __version__)
+    data, classes = rtagged_doc(num_elements)
+    print("Generated an HTML document with %d tags (%d bytes)." % (
+        num_elements, len(data)))
+    ids = ["e%d" % random.randint(0, num_elements - 1)
+           for i in range(num_queries)]
+    searches = [
+        ("find(id=...)", lambda soup, i: soup.find(id=ids[i])),
+        ("find_all(class_=...)",
+         lambda soup, i: soup.find_all(class_=classes[i % len(classes)])),
+        ("find_all('a', limit=10)",
+         lambda soup, i: soup.body.find_all('a', limit=10)),
+        ("select('#...')", lambda soup, i: soup.select("#" + ids[i])),
+        ("select('li....')",
+         lambda soup, i: soup.select("li." + classes[i % len(classes)])),
+    ]
+    plain = BeautifulSoup(data, parser)
+    indexed = BeautifulSoup(data, parser, indexed=True)
+    a = time.time()
+    indexed.find(id=ids[0])
+    b = time.time()
+    print("Indexed the tree in %.2fs." % (b-a))
+    for description, search in searches:
+        timings = []
+        for soup in (plain, indexed):
+            a = time.time()
+            for i in range(num_queries):
+                search(soup, i)
+            b = time.time()
+            timings.append(b-a)
+        print("%d x %s: %.3fs without an index, %.3fs with one." % (
+            num_queries, description, timings[0], timings[1]))
+
+def benchmark_selectors(num_elements=100000, num_queries=20,
+                        parser="html.parser"):
+    """Time repeated CSS selections on a large document."""
+    print("Selector benchmark on Beautiful Soup %s" % __version__)
+    data, classes = rtagged_doc(num_elements)
+    print("Generated an HTML document with %d tags (%d bytes)." % (
+        num_elements, len(data)))
+    soup = BeautifulSoup(data, parser)
+    for selector in ["li", "div > a", "div span a.%s" % classes[0],
+                     "p + li", "a[id$=\"7\"]", "#e%d" % (num_elements // 2),
+                     "li:nth-of-type(2)", "a.%s, li.%s" % (classes[1], classes[2])]:
+        a = time.time()
+        for i in range(num_queries):
+            found = soup.select(selector)
+        b = time.time()
+        print("%d x select(%r) found %d tags in %.3fs." % (
+            num_queries, selector, len(found), b-a))
+
+def benchmark_find_all(num_elements=100000, num_queries=20,
+                       parser="html.parser"):
+    """Time repeated find_all() calls with different kinds of criteria
+    on a large document."""
+    print("find_all benchmark on Beautiful Soup %s" % __version__)
+    data, classes = rtagged_doc(num_elements)
+    print("Generated an HTML document with %d tags (%d bytes)." % (
+        num_elements, len(data)))
+    soup = BeautifulSoup(data, parser)
+    id_re = re.compile("7$")
+    searches = [
+        ("'a'", dict(name="a")),
+        ("'a', limit=10", dict(name="a", limit=10)),
+        ("['a', 'li']", dict(name=["a", "li"])),
+        ("class_=...", dict(class_=classes[0])),
+        ("'a', class_=[...]", dict(name="a", class_=classes[:5])),
+        ("id=re.compile(...)", dict(id=id_re)),
+        ("'span', id=True, limit=10", dict(name="span", id=True, limit=10)),
+        ("text=re.compile(...)", dict(text=re.compile("^" + classes[0][:2]))),
+    ]
+    for description, arguments in searches:
+        a = time.time()
+        for i in range(num_queries):
+            found = soup.find_all(**arguments)
+        b = time.time()
+        print("%d x find_all(%s) found %d in %.3fs." % (
+            num_queries, description, len(found), b-a))
+
+def benchmark_memory(num_elements=100000, parser="html.parser"):
+    """Measure the memory taken by the tree built from a large document."""
+    try:
+        import tracemalloc
+    except ImportError:
+        print("Measuring memory needs tracemalloc (Python 3.4 or later).")
+        return
+    print("Memory benchmark on Beautiful Soup %s" % __version__)
+    data = rdoc(num_elements)
+    print("Generated a large invalid HTML document (%d bytes)." % len(data))
+    tracemalloc.start()
+    try:
+        a = tracemalloc.get_traced_memory()[0]
+        soup = BeautifulSoup(data, parser)
+        b, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    num_tags = len(soup.find_all(True))
+    num_strings = len(soup.find_all(text=True))
+    print("BS4+%s built %d tags and %d strings in %.1f MB (%d bytes per "
+          "element, peaking at %.1f MB)." % (
+              parser, num_tags, num_strings, (b-a) / 1024.0 / 1024,
+              (b-a) // (num_tags + num_strings), (peak-a) / 1024.0 / 1024))
+
+def benchmark_incremental(num_elements=100000, chunk_size=65536,
+                          parser="html.parser"):
+    """Compare parsing a file read all at once with feeding it to
+    BeautifulSoup.incremental() a chunk at a time, as it would arrive
+    over the network."""
+    try:
+        import tracemalloc
+    except ImportError:
+        print("Measuring memory needs tracemalloc (Python 3.4 or later).")
+        return
+    print("Incremental parsing benchmark on Beautiful Soup %s" % __version__)
+    data = rdoc(num_elements).encode("utf8")
+    print("Generated a large invalid HTML document (%d bytes)." % len(data))
+    with tempfile.TemporaryFile() as fp:
+        fp.write(data)
+        del data
+
+        def whole():
+            fp.seek(0)
+            return BeautifulSoup(fp.read(), parser)
+
+        def in_chunks():
+            fp.seek(0)
+            incremental = BeautifulSoup.incremental(parser)
+            while True:
+                chunk = fp.read(chunk_size)
+                if not chunk:
+                    break
+                incremental.feed(chunk)
+            return incremental.close()
+
+        for description, parse in [
+            ("Whole document", whole),
+            ("%d-byte chunks" % chunk_size, in_chunks),
+            ]:
+            a = time.time()
+            parse()
+            b = time.time()
+            tracemalloc.start()
+            try:
+                soup = parse()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            print("%s: parsed in %.2fs, peaking at %.1f MB." % (
+                description, b-a, peak / 1024.0 / 1024))
+            del soup
+
+def benchmark_iterparse(num_sections=20000, parser="html.parser"):
+    """Compare ways of pulling the links out of one part of a big
+    reference page: building the whole tree, building only the links
+    with parse_only, and BeautifulSoup.iterparse()."""
+    try:
+        import tracemalloc
+    except ImportError:
+        print("Measuring memory needs tracemalloc (Python 3.4 or later).")
+        return
+    print("Streaming extraction benchmark on Beautiful Soup %s" % __version__)
+    section = ('<div class="section"><h2>%s</h2><p>%s <a href="#%%d">%s</a>'
+               ' <code>%s</code></p></div>' % (
+                   rsentence(2), rsentence(8), rsentence(1), rsentence(1)))
+    data = ('<html><body><div id="nav">%s</div><div id="content">%s</div>'
+            '</body></html>' % (
+                '<a href="/nav">nav</a>' * 100,
+                "\n".join(section % i for i in range(num_sections))))
+    print("Generated a page with %d sections (%d bytes)." % (
+        num_sections, len(data)))
+    links = SoupStrainer("a", href=True)
+    content = SoupStrainer("div", id="content")
+
+    def whole_tree():
+        soup = BeautifulSoup(data, parser)
+        return soup.find("div", id="content").find_all(links)
+
+    def parse_only():
+        # Can't restrict the links to #content this way.
+        return BeautifulSoup(data, parser, parse_only=links).find_all("a")
+
+    def iterparse():
+        return [a["href"] for a in BeautifulSoup.iterparse(
+            data, links, parser, within=content)]
+
+    for description, extract in [
+        ("Whole tree", whole_tree),
+        ("parse_only", parse_only),
+        ("iterparse()", iterparse),
+        ]:
+        a = time.time()
+        found = len(extract())
+        b = time.time()
+        tracemalloc.start()
+        try:
+            extract()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        print("%s: %d links in %.2fs, peaking at %.1f MB." % (
+            description, found, b-a, peak / 1024.0 / 1024))
+
+def benchmark_encoding_detection(num_elements=50000):
+    """Time working out the encoding of large documents."""
+    print("Encoding detection benchmark on Beautiful Soup %s" % __version__)
+    if bs4.dammit.chardet_dammit(b"\xe9t\xe9") is None:
+        print("(No chardet or cchardet is installed.)")
+    words = rdoc(num_elements).split(" ")
+    for i in range(0, len(words), 20):
+        words[i] = "caf\N{LATIN SMALL LETTER E WITH ACUTE}"
+    text = " ".join(words)
+    half = len(text) // 2
+    for description, data in [
+        ("UTF-8", text.encode("utf8")),
+        ("Windows-1252", text.encode("windows-1252")),
+        ("Mixed", text[:half].encode("utf8") + text[half:].encode("windows-1252")),
+        ]:
+        a = time.time()
+        dammit = UnicodeDammit(data, is_html=True)
+        b = time.time()
+        print("%s document (%d bytes): detected %s in %.3fs." % (
+            description, len(data), dammit.original_encoding, b-a))
+
+def benchmark_entity_substitution(num_sections=5000, parser="html.parser"):
+    """Time serializing a page full of characters that need entities,
+    like a reference page full of code samples."""
+    print("Entity substitution benchmark on Beautiful Soup %s" % __version__)
+    section = (
+        '<div class="section"><h2 title="A &amp; B &quot;x&quot;">%s'
+        ' &lt;T&gt;</h2><p>%s &amp; caf\N{LATIN SMALL LETTER E WITH ACUTE}'
+        ' &mdash; <code>List&lt;String&gt; a = b &amp;&amp; c;</code>'
+        ' <a href="/x?a=1&amp;b=2">%s</a></p></div>')
+    data = "<html><body>%s</body></html>" % "\n".join(
+        section % (rsentence(2), rsentence(8), rsentence(1))
+        for i in range(num_sections))
+    soup = BeautifulSoup(data, parser)
+    print("Parsed a page with %d sections (%d bytes)." % (
+        num_sections, len(data)))
+    for formatter in ("minimal", "html"):
+        a = time.time()
+        for i in range(5):
+            soup.decode(formatter=formatter)
+        b = time.time()
+        print('decode(formatter="%s") took %.3fs.' % (formatter, (b-a)/5))
+
+def benchmark_extract(width=20000, parser="html.parser"):
+    """Time removing many children from a very wide tag, as when
+    stripping a long list out of a page."""
+    print("Extract benchmark on Beautiful Soup %s" % __version__)
+    data = "<ul>%s</ul>" % "\n".join(
+        "<li>%s</li>" % rsentence(1) for i in range(width))
+    print("Generated a list with %d items (%d bytes)." % (width, len(data)))
+
+    def in_order(items):
+        return items
+    def in_reverse(items):
+        return list(reversed(items))
+    def shuffled(items):
+        items = list(items)
+        random.shuffle(items)
+        return items
+
+    for description, order, method in [
+        ("extract() in order", in_order, "extract"),
+        ("extract() in reverse", in_reverse, "extract"),
+        ("extract() in random order", shuffled, "extract"),
+        ("decompose() in order", in_order, "decompose"),
+        ("unwrap() in order", in_order, "unwrap"),
+        ]:
+        soup = BeautifulSoup(data, parser)
+        items = order(soup.find_all("li"))
+        a = time.time()
+        for item in items:
+            getattr(item, method)()
+        b = time.time()
+        print("%s of %d items took %.2fs." % (description, width, b-a))
+
+def benchmark_serialization(depth=5000, width=20000, parser="html.parser"):
+    """Time turning deep and wide documents back into markup."""
+    print("Serialization benchmark on Beautiful Soup %s" % __version__)
+    deep = "".join(
+        "<div>%s" % rsentence(5) for i in range(depth)) + "</div>" * depth
+    wide = "<div>%s</div>" % "\n".join(
+        "<p class='x'>%s <b>%s</b></p>" % (rsentence(2), rsentence(1))
+        for i in range(width))
+    for description, data in [
+        ("%d nested tags" % depth, deep),
+        ("%d sibling tags" % width, wide),
+        ]:
+        soup = BeautifulSoup(data, parser)
+        for method in ("decode", "prettify"):
+            a = time.time()
+            try:
+                getattr(soup, method)()
+            except RuntimeError as e:
+                print("%s() of %s failed: %s" % (method, description, e))
+                continue
+            b = time.time()
+            print("%s() of %s took %.2fs." % (method, description, b-a))
+        if hasattr(BeautifulSoup, 'write_to'):
+            a = time.time()
+            with tempfile.TemporaryFile() as fp:
+                soup.write_to(fp, encoding="utf8")
+            b = time.time()
+            print("write_to() of %s took %.2fs." % (description, b-a))
+
 def profile(num_elements=100000, parser="lxml"):
 
     filehandle = tempfile.NamedTemporaryFile()
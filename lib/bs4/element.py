@@ -1,7 +1,12 @@
-import collections
+from bisect import bisect_left, bisect_right, insort
+import codecs
+import functools
+from itertools import islice
 import re
 import sys
+from sys import intern
 import warnings
+import weakref
 from bs4.dammit import EntitySubstitution
 
 DEFAULT_OUTPUT_ENCODING = "utf-8"
@@ -120,6 +125,14 @@ class PageElement(object):
     """Contains the navigational information for some part of the page
     (either a tag or a piece of text)"""
 
+    # A document has as many elements as it has tags and strings, so
+    # they keep their attributes in slots rather than a __dict__ each.
+    # Subclasses declare these (NavigableString can't share a layout
+    # with a base class that has slots of its own).
+    __slots__ = ()
+    NAVIGATION_SLOTS = ('parent', 'previous_element', 'next_element',
+                        'previous_sibling', 'next_sibling', '_position')
+
     # There are five possible values for the "formatter" argument passed in
     # to methods like encode() and prettify():
     #
@@ -152,7 +165,7 @@ class PageElement(object):
 
     def format_string(self, s, formatter='minimal'):
         """Format the given string using the given formatter."""
-        if not isinstance(formatter, collections.Callable):
+        if not callable(formatter):
             formatter = self._formatter_for_name(formatter)
         if formatter is None:
             output = s
@@ -166,15 +179,16 @@ class PageElement(object):
 
         This is used when mapping a formatter name ("minimal") to an
         appropriate function (one that performs entity-substitution on
-        the contents of <script> and <style> tags, or not). It's
-        inefficient, but it should be called very rarely.
+        the contents of <script> and <style> tags, or not). It walks
+        up to the top of the tree, so it should be called rarely.
         """
-        if self.parent is None:
-            # This is the top-level object. It should have .is_xml set
-            # from tree creation. If not, take a guess--BS is usually
-            # used on HTML markup.
-            return getattr(self, 'is_xml', False)
-        return self.parent._is_xml
+        top = self
+        while top.parent is not None:
+            top = top.parent
+        # This is the top-level object. It should have .is_xml set
+        # from tree creation. If not, take a guess--BS is usually
+        # used on HTML markup.
+        return getattr(top, 'is_xml', False)
 
     def _formatter_for_name(self, name):
         "Look up a formatter function based on its name and the tree."
@@ -195,13 +209,41 @@ class PageElement(object):
         self.next_element = None
         self.previous_sibling = None
         self.next_sibling = None
+        self._position = 0
         if self.parent is not None and self.parent.contents:
             self.previous_sibling = self.parent.contents[-1]
             self.previous_sibling.next_sibling = self
+            self._position = len(self.parent.contents)
+            if self.parent._removed_positions:
+                self._position += len(self.parent._removed_positions)
 
     nextSibling = _alias("next_sibling")  # BS3
     previousSibling = _alias("previous_sibling")  # BS3
 
+    # The TreeIndex of the tree this element is the root of, if it's
+    # been given one. See BeautifulSoup(indexed=True).
+    _index = None
+
+    def _tree_changed(self):
+        "Tells the index of this element's tree, if there is one, that the tree has changed."
+        if not TreeIndex.instances:
+            # No tree has an index, so there's no need to find the root.
+            return
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        if root._index is not None:
+            root._index.invalidate()
+
+    def _tree_index(self):
+        "The index of this element's tree, or None if it doesn't have one."
+        if not TreeIndex.instances:
+            return None
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        return root._index
+
     def replace_with(self, replace_with):
         if replace_with is self:
             return
@@ -232,7 +274,11 @@ class PageElement(object):
     def extract(self):
         """Destructively rips this element out of the tree."""
         if self.parent is not None:
-            del self.parent.contents[self.parent.index(self)]
+            parent = self.parent
+            parent._tree_changed()
+            del parent.contents[parent.index(self)]
+            if parent._removed_positions is not None:
+                insort(parent._removed_positions, self._position)
 
         #Find the two elements that would be next to each other if
         #this element (and any children) hadn't been parsed. Connect
@@ -332,6 +378,13 @@ class PageElement(object):
         if new_childs_last_element.next_element is not None:
             new_childs_last_element.next_element.previous_element = new_childs_last_element
         self.contents.insert(position, new_child)
+        if position == len(self.contents) - 1 and self._removed_positions is not None:
+            # Appended, so numbered after every child there's been.
+            new_child._position = position + len(self._removed_positions)
+        else:
+            new_child._position = position
+            self._removed_positions = None
+        self._tree_changed()
 
     def append(self, tag):
         """Appends the given tag to the contents of this tag."""
@@ -483,18 +536,32 @@ class PageElement(object):
         else:
             strainer = SoupStrainer(name, attrs, text, **kwargs)
 
-        if text is None and not limit and not attrs and not kwargs:
+        if text is None and not attrs and not kwargs:
             if name is True or name is None:
                 # Optimization to find all tags.
                 result = (element for element in generator
                           if isinstance(element, Tag))
-                return ResultSet(strainer, result)
+                return ResultSet(strainer, islice(result, limit or None))
             elif isinstance(name, str):
                 # Optimization to find all tags with a given name.
                 result = (element for element in generator
                           if isinstance(element, Tag)
                             and element.name == name)
-                return ResultSet(strainer, result)
+                return ResultSet(strainer, islice(result, limit or None))
+        if strainer.__class__ is SoupStrainer:
+            # Use the strainer's compiled matchers directly. Only tags
+            # can match a search by name or attributes, or without
+            # text; only strings can match any other search.
+            if strainer.name or strainer.attrs or not strainer.text:
+                tag_matches = strainer.tag_matches
+                result = (element for element in generator
+                          if isinstance(element, Tag) and tag_matches(element))
+            else:
+                text_matches = strainer.text_matches
+                result = (element for element in generator
+                          if isinstance(element, NavigableString) and element
+                          and text_matches(element))
+            return ResultSet(strainer, islice(result, limit or None))
         results = ResultSet(strainer)
         while True:
             try:
@@ -548,20 +615,6 @@ class PageElement(object):
 
     # Methods for supporting CSS selectors.
 
-    tag_name_re = re.compile('^[a-z0-9]+$')
-
-    # /^(\w+)\[(\w+)([=~\|\^\$\*]?)=?"?([^\]"]*)"?\]$/
-    #   \---/  \---/\-------------/    \-------/
-    #     |      |         |               |
-    #     |      |         |           The value
-    #     |      |    ~,|,^,$,* or =
-    #     |   Attribute
-    #    Tag
-    attribselect_re = re.compile(
-        r'^(?P<tag>\w+)?\[(?P<attribute>\w+)(?P<operator>[=~\|\^\$\*]?)' +
-        r'=?"?(?P<value>[^\]"]*)"?\]$'
-        )
-
     def _attr_value_as_string(self, value, default=None):
         """Force an attribute value into a string representation.
 
@@ -573,55 +626,6 @@ class PageElement(object):
             value =" ".join(value)
         return value
 
-    def _tag_name_matches_and(self, function, tag_name):
-        if not tag_name:
-            return function
-        else:
-            def _match(tag):
-                return tag.name == tag_name and function(tag)
-            return _match
-
-    def _attribute_checker(self, operator, attribute, value=''):
-        """Create a function that performs a CSS selector operation.
-
-        Takes an operator, attribute and optional value. Returns a
-        function that will return True for elements that match that
-        combination.
-        """
-        if operator == '=':
-            # string representation of `attribute` is equal to `value`
-            return lambda el: el._attr_value_as_string(attribute) == value
-        elif operator == '~':
-            # space-separated list representation of `attribute`
-            # contains `value`
-            def _includes_value(element):
-                attribute_value = element.get(attribute, [])
-                if not isinstance(attribute_value, list):
-                    attribute_value = attribute_value.split()
-                return value in attribute_value
-            return _includes_value
-        elif operator == '^':
-            # string representation of `attribute` starts with `value`
-            return lambda el: el._attr_value_as_string(
-                attribute, '').startswith(value)
-        elif operator == '$':
-            # string represenation of `attribute` ends with `value`
-            return lambda el: el._attr_value_as_string(
-                attribute, '').endswith(value)
-        elif operator == '*':
-            # string representation of `attribute` contains `value`
-            return lambda el: value in el._attr_value_as_string(attribute, '')
-        elif operator == '|':
-            # string representation of `attribute` is either exactly
-            # `value` or starts with `value` and then a dash.
-            def _is_or_starts_with_dash(element):
-                attribute_value = element._attr_value_as_string(attribute, '')
-                return (attribute_value == value or attribute_value.startswith(
-                        value + '-'))
-            return _is_or_starts_with_dash
-        else:
-            return lambda el: el.has_attr(attribute)
-
     # Old non-property versions of the generators, for backwards
     # compatibility with BS3.
     def nextGenerator(self):
@@ -642,6 +646,8 @@ class PageElement(object):
 
 class NavigableString(str, PageElement):
 
+    __slots__ = PageElement.NAVIGATION_SLOTS
+
     PREFIX = ''
     SUFFIX = ''
 
@@ -693,6 +699,8 @@ class PreformattedString(NavigableString):
     but the return value will be ignored.
     """
 
+    __slots__ = ()
+
     def output_ready(self, formatter="minimal"):
         """CData strings are passed into the formatter.
         But the return value is ignored."""
@@ -701,26 +709,31 @@ class PreformattedString(NavigableString):
 
 class CData(PreformattedString):
 
+    __slots__ = ()
     PREFIX = '<![CDATA['
     SUFFIX = ']]>'
 
 class ProcessingInstruction(PreformattedString):
 
+    __slots__ = ()
     PREFIX = '<?'
     SUFFIX = '?>'
 
 class Comment(PreformattedString):
 
+    __slots__ = ()
     PREFIX = '<!--'
     SUFFIX = '-->'
 
 
 class Declaration(PreformattedString):
+    __slots__ = ()
     PREFIX = '<!'
     SUFFIX = '!>'
 
 
 class Doctype(PreformattedString):
+    __slots__ = ()
 
     @classmethod
     def for_name_and_ids(cls, name, pub_id, system_id):
@@ -742,10 +755,15 @@ class Tag(PageElement):
 
     """Represents a found HTML tag with its attributes and contents."""
 
+    __slots__ = PageElement.NAVIGATION_SLOTS + (
+        'parser_class', 'name', 'namespace', 'prefix', 'attrs', 'contents',
+        'hidden', 'can_be_empty_element', '_removed_positions')
+
     def __init__(self, parser=None, builder=None, name=None, namespace=None,
                  prefix=None, attrs=None, parent=None, previous=None):
         "Basic constructor."
 
+        self._removed_positions = None
         if parser is None:
             self.parser_class = None
         else:
@@ -754,16 +772,25 @@ class Tag(PageElement):
             self.parser_class = parser.__class__
         if name is None:
             raise ValueError("No value provided for new tag's name.")
+        # A document uses the same few names many times over, so
+        # every tag with a given name (or attribute) shares one string.
+        if type(name) is str:
+            name = intern(name)
         self.name = name
         self.namespace = namespace
         self.prefix = prefix
         if attrs is None:
             attrs = {}
-        elif attrs and builder.cdata_list_attributes:
-            attrs = builder._replace_cdata_list_attribute_values(
-                self.name, attrs)
         else:
-            attrs = dict(attrs)
+            if (attrs and builder is not None
+                and builder.cdata_list_attributes):
+                attrs = builder._replace_cdata_list_attribute_values(
+                    self.name, attrs)
+            if isinstance(attrs, dict):
+                attrs = attrs.items()
+            attrs = dict(
+                (intern(key) if type(key) is str else key, value)
+                for key, value in attrs)
         self.attrs = attrs
         self.contents = []
         self.setup(parent, previous)
@@ -859,8 +886,11 @@ class Tag(PageElement):
         i = self
         while i is not None:
             next = i.next_element
-            i.__dict__.clear()
-            i.contents = []
+            i.parent = i.next_element = i.previous_element = None
+            i.next_sibling = i.previous_sibling = None
+            if isinstance(i, Tag):
+                i.contents = []
+                i._removed_positions = None
             i = next
 
     def clear(self, decompose=False):
@@ -877,15 +907,73 @@ class Tag(PageElement):
             for element in self.contents[:]:
                 element.extract()
 
+    # How many siblings index() will count back past before it looks
+    # at every child instead.
+    MAX_POSITION_WALK = 64
+
     def index(self, element):
         """
         Find the index of a child by identity, not value. Avoids issues with
         tag.contents.index(element) getting the index of equal elements.
         """
-        for i, child in enumerate(self.contents):
+        # Every child remembers its position in contents, so finding it
+        # doesn't mean looking at every child. Removing or inserting a
+        # child moves the ones after it, though, so there are two ways
+        # of keeping track:
+        #
+        # After index() has had to number every child, removals are
+        # recorded in _removed_positions (the numbers of the children
+        # removed since, in order), and a child's position is its
+        # number less the removals before it.
+        #
+        # Inserting a child anywhere but the end stops that, and the
+        # numbers become hints. A child that isn't where its hint says
+        # is counted from the nearest sibling before it that is, which
+        # is close by when many children are removed or unwrapped in
+        # turn.
+        contents = self.contents
+        length = len(contents)
+        position = getattr(element, '_position', -1)
+        removed = self._removed_positions
+        if removed:
+            position -= bisect_left(removed, position)
+        if 0 <= position < length and contents[position] is element:
+            return position
+        self._removed_positions = None
+
+        if getattr(element, 'parent', None) is self:
+            chain = [element]
+            previous = element.previous_sibling
+            start = 0
+            while previous is not None:
+                if len(chain) >= self.MAX_POSITION_WALK:
+                    start = None
+                    break
+                position = getattr(previous, '_position', -1)
+                if 0 <= position < length and contents[position] is previous:
+                    start = position + 1
+                    break
+                chain.append(previous)
+                previous = previous.previous_sibling
+            if start is not None:
+                position = start + len(chain) - 1
+                if position < length and contents[position] is element:
+                    for child in reversed(chain):
+                        child._position = start
+                        start += 1
+                    return position
+
+        # Number every child, looking for this one along the way.
+        found = None
+        for i, child in enumerate(contents):
             if child is element:
-                return i
-        raise ValueError("Tag.index: element not in tag")
+                found = i
+            if isinstance(child, PageElement):
+                child._position = i
+        self._removed_positions = []
+        if found is None:
+            raise ValueError("Tag.index: element not in tag")
+        return found
 
     def get(self, key, default=None):
         """Returns the value of the 'key' attribute for the tag, or
@@ -923,10 +1011,12 @@ class Tag(PageElement):
         """Setting tag[key] sets the value of the 'key' attribute for the
         tag."""
         self.attrs[key] = value
+        self._tree_changed()
 
     def __delitem__(self, key):
         "Deleting tag[key] deletes all 'key' attributes for the tag."
         self.attrs.pop(key, None)
+        self._tree_changed()
 
     def __call__(self, *args, **kwargs):
         """Calling a tag like a function is the same as calling its
@@ -1011,86 +1101,8 @@ class Tag(PageElement):
            document contains a <META> tag that mentions the document's
            encoding.
         """
-
-        # First off, turn a string formatter into a function. This
-        # will stop the lookup from happening over and over again.
-        if not isinstance(formatter, collections.Callable):
-            formatter = self._formatter_for_name(formatter)
-
-        attrs = []
-        if self.attrs:
-            for key, val in sorted(self.attrs.items()):
-                if val is None:
-                    decoded = key
-                else:
-                    if isinstance(val, list) or isinstance(val, tuple):
-                        val = ' '.join(val)
-                    elif not isinstance(val, str):
-                        val = str(val)
-                    elif (
-                        isinstance(val, AttributeValueWithCharsetSubstitution)
-                        and eventual_encoding is not None):
-                        val = val.encode(eventual_encoding)
-
-                    text = self.format_string(val, formatter)
-                    decoded = (
-                        str(key) + '='
-                        + EntitySubstitution.quoted_attribute_value(text))
-                attrs.append(decoded)
-        close = ''
-        closeTag = ''
-
-        prefix = ''
-        if self.prefix:
-            prefix = self.prefix + ":"
-
-        if self.is_empty_element:
-            close = '/'
-        else:
-            closeTag = '</%s%s>' % (prefix, self.name)
-
-        pretty_print = self._should_pretty_print(indent_level)
-        space = ''
-        indent_space = ''
-        if indent_level is not None:
-            indent_space = (' ' * (indent_level - 1))
-        if pretty_print:
-            space = indent_space
-            indent_contents = indent_level + 1
-        else:
-            indent_contents = None
-        contents = self.decode_contents(
-            indent_contents, eventual_encoding, formatter)
-
-        if self.hidden:
-            # This is the 'document root' object.
-            s = contents
-        else:
-            s = []
-            attribute_string = ''
-            if attrs:
-                attribute_string = ' ' + ' '.join(attrs)
-            if indent_level is not None:
-                # Even if this particular tag is not pretty-printed,
-                # we should indent up to the start of the tag.
-                s.append(indent_space)
-            s.append('<%s%s%s%s>' % (
-                    prefix, self.name, attribute_string, close))
-            if pretty_print:
-                s.append("\n")
-            s.append(contents)
-            if pretty_print and contents and contents[-1] != "\n":
-                s.append("\n")
-            if pretty_print and closeTag:
-                s.append(space)
-            s.append(closeTag)
-            if indent_level is not None and closeTag and self.next_sibling:
-                # Even if this particular tag is not pretty-printed,
-                # we're now done with the tag, and we should add a
-                # newline if appropriate.
-                s.append("\n")
-            s = ''.join(s)
-        return s
+        return ''.join(self._serialize(
+            None, indent_level, eventual_encoding, formatter))
 
     def prettify(self, encoding=None, formatter="minimal"):
         if encoding is None:
@@ -1110,29 +1122,230 @@ class Tag(PageElement):
            document contains a <META> tag that mentions the document's
            encoding.
         """
+        return ''.join(self._serialize(
+            None, indent_level, eventual_encoding, formatter,
+            contents_only=True))
+
+    def write_to(self, fp, pretty_print=False, formatter="minimal",
+                 encoding=None, errors="xmlcharrefreplace"):
+        """Writes this tag to a file, a chunk at a time.
+
+        The output is the same as that of prettify() (if `pretty_print`)
+        or decode(), without ever holding all of it in memory. With an
+        `encoding`, `fp` should be a binary file and the output is
+        encoded as encode() would; otherwise `fp` takes strings.
+        """
+        if encoding is None:
+            write = fp.write
+            eventual_encoding = DEFAULT_OUTPUT_ENCODING
+        else:
+            encoder = codecs.getincrementalencoder(encoding)(errors)
+            def write(s):
+                fp.write(encoder.encode(s))
+            eventual_encoding = encoding
+        self._write_to(write, pretty_print, eventual_encoding, formatter)
+        if encoding is not None:
+            fp.write(encoder.encode('', True))
+
+    def _write_to(self, write, pretty_print, eventual_encoding, formatter):
+        if pretty_print:
+            indent_level = True
+        else:
+            indent_level = None
+        self._serialize(write, indent_level, eventual_encoding, formatter)
+
+    # Pieces of output gathered before they're passed on to write_to's file
+    SERIALIZE_CHUNK_SIZE = 4096
+
+    # Formatters that always give the same output for the same string
+    # (outside <script> and <style> tags).
+    PURE_FORMATTERS = (
+        EntitySubstitution.substitute_xml,
+        EntitySubstitution.substitute_html,
+        HTMLAwareEntitySubstitution.substitute_xml,
+        HTMLAwareEntitySubstitution.substitute_html,
+        )
+
+    def _serialize(self, write, indent_level, eventual_encoding, formatter,
+                   contents_only=False):
+        """Renders this tag (or just its contents) as decode() would.
+
+        Rather than recursing, this walks the tree with a stack of open
+        tags, so deep trees neither hit the recursion limit nor copy
+        each tag's output into its parent's. The output is gathered as
+        a list of non-empty pieces, which is returned; if `write` is
+        given, the pieces are passed to it in chunks instead.
+        """
         # First off, turn a string formatter into a function. This
         # will stop the lookup from happening over and over again.
-        if not isinstance(formatter, collections.Callable):
+        if not callable(formatter):
             formatter = self._formatter_for_name(formatter)
+        is_xml = self._is_xml
+        preformatted_tags = HTMLAwareEntitySubstitution.preformatted_tags
+        if formatter in self.PURE_FORMATTERS:
+            # Each distinct attribute only needs formatting once.
+            attribute_cache = {}
+        else:
+            attribute_cache = None
+        chunk_size = self.SERIALIZE_CHUNK_SIZE
+        pieces = []
+        append = pieces.append
+        # Pieces already written out, and the last of them, so a tag can
+        # tell whether (and how) its contents ended.
+        flushed = [0, '']
+        stack = []
+
+        def flush():
+            if pieces:
+                write(''.join(pieces))
+                flushed[0] += len(pieces)
+                flushed[1] = pieces[-1]
+                del pieces[:]
+
+        def push(tag, indent_contents, closing):
+            name = tag.name
+            if indent_contents is not None and name != 'pre':
+                # Strings in a pretty-printed tag go on lines of their own.
+                lead = ' ' * (indent_contents - 1)
+            else:
+                lead = None
+            stack.append((tag, iter(tag.contents), indent_contents,
+                          bool(indent_contents) and name != 'pre',
+                          lead, closing))
+
+        def open_tag(tag, indent_level):
+            pretty_print = (
+                indent_level is not None and
+                (tag.name not in preformatted_tags or is_xml))
+            if pretty_print:
+                indent_contents = indent_level + 1
+            else:
+                indent_contents = None
+            if tag.hidden:
+                # This is the 'document root' object: only its contents
+                # are shown.
+                push(tag, indent_contents, None)
+                return
+
+            attrs = []
+            if tag.attrs:
+                for key, val in sorted(tag.attrs.items()):
+                    if val is None:
+                        decoded = key
+                    else:
+                        if isinstance(val, list) or isinstance(val, tuple):
+                            val = ' '.join(val)
+                        elif not isinstance(val, str):
+                            val = str(val)
+                        elif (
+                            isinstance(val, AttributeValueWithCharsetSubstitution)
+                            and eventual_encoding is not None):
+                            val = val.encode(eventual_encoding)
+
+                        cache_key = None
+                        if attribute_cache is not None and type(val) is str:
+                            cache_key = (key, val)
+                            decoded = attribute_cache.get(cache_key)
+                            if decoded is not None:
+                                attrs.append(decoded)
+                                continue
+                        text = tag.format_string(val, formatter)
+                        decoded = (
+                            str(key) + '='
+                            + EntitySubstitution.quoted_attribute_value(text))
+                        if cache_key is not None:
+                            attribute_cache[cache_key] = decoded
+                    attrs.append(decoded)
+            close = ''
+            closeTag = ''
+
+            prefix = ''
+            if tag.prefix:
+                prefix = tag.prefix + ":"
+
+            if tag.is_empty_element:
+                close = '/'
+            else:
+                closeTag = '</%s%s>' % (prefix, tag.name)
 
-        pretty_print = (indent_level is not None)
-        s = []
-        for c in self:
-            text = None
-            if isinstance(c, NavigableString):
-                text = c.output_ready(formatter)
-            elif isinstance(c, Tag):
-                s.append(c.decode(indent_level, eventual_encoding,
-                                  formatter))
-            if text and indent_level and not self.name == 'pre':
-                text = text.strip()
-            if text:
-                if pretty_print and not self.name == 'pre':
-                    s.append(" " * (indent_level - 1))
-                s.append(text)
-                if pretty_print and not self.name == 'pre':
-                    s.append("\n")
-        return ''.join(s)
+            indent_space = ''
+            if indent_level is not None:
+                # Even if this particular tag is not pretty-printed,
+                # we should indent up to the start of the tag.
+                indent_space = (' ' * (indent_level - 1))
+                if indent_space:
+                    append(indent_space)
+            attribute_string = ''
+            if attrs:
+                attribute_string = ' ' + ' '.join(attrs)
+            append('<%s%s%s%s>' % (prefix, tag.name, attribute_string, close))
+            if pretty_print:
+                append("\n")
+            push(tag, indent_contents,
+                 (pretty_print, indent_space, closeTag, indent_level,
+                  flushed[0] + len(pieces)))
+
+        def close_tag(tag, closing):
+            pretty_print, space, closeTag, indent_level, mark = closing
+            if pretty_print and flushed[0] + len(pieces) > mark:
+                last = pieces[-1] if pieces else flushed[1]
+                if last[-1] != "\n":
+                    append("\n")
+            if pretty_print and closeTag and space:
+                append(space)
+            if closeTag:
+                append(closeTag)
+            if indent_level is not None and closeTag and tag.next_sibling:
+                # Even if this particular tag is not pretty-printed,
+                # we're now done with the tag, and we should add a
+                # newline if appropriate.
+                append("\n")
+
+        if contents_only:
+            push(self, indent_level, None)
+        else:
+            open_tag(self, indent_level)
+        while stack:
+            if write is not None and len(pieces) >= chunk_size:
+                flush()
+            tag, children, indent_level, strip, lead, closing = stack[-1]
+            for c in children:
+                if isinstance(c, NavigableString):
+                    if type(c) is NavigableString:
+                        # What output_ready() does, without the calls.
+                        if formatter is None:
+                            text = c
+                        else:
+                            text = formatter(c)
+                    else:
+                        text = c.output_ready(formatter)
+                    if text and strip:
+                        text = text.strip()
+                    if text:
+                        if lead is not None:
+                            if lead:
+                                append(lead)
+                            append(text)
+                            append("\n")
+                        else:
+                            append(text)
+                elif isinstance(c, Tag):
+                    if type(c).decode is not Tag.decode:
+                        # A subclass with its own idea of how to render.
+                        text = c.decode(indent_level, eventual_encoding,
+                                        formatter)
+                        if text:
+                            append(text)
+                        continue
+                    open_tag(c, indent_level)
+                    break
+            else:
+                stack.pop()
+                if closing is not None:
+                    close_tag(tag, closing)
+        if write is not None:
+            flush()
+        return pieces
 
     def encode_contents(
         self, indent_level=None, encoding=DEFAULT_OUTPUT_ENCODING,
@@ -1172,8 +1385,18 @@ class Tag(PageElement):
         string, a list of strings, a regular expression object, or a
         callable that takes a string and returns whether or not the
         string matches for some custom definition of 'matches'. The
-        same is true of the tag name."""
-
+        same is true of the tag name.
+
+        If the tree has an index (see BeautifulSoup(indexed=True)),
+        recursive searches by tag name, id or a single class go
+        straight to the tags that might match."""
+
+        if recursive:
+            index = self._tree_index()
+            if index is not None:
+                found = index.find_all(self, name, attrs, text, limit, **kwargs)
+                if found is not None:
+                    return found
         generator = self.descendants
         if not recursive:
             generator = self.children
@@ -1199,204 +1422,14 @@ class Tag(PageElement):
 
     # CSS selector code
 
-    _selector_combinators = ['>', '+', '~']
-    _select_debug = False
-    def select(self, selector, _candidate_generator=None):
-        """Perform a CSS selection operation on the current element."""
-        tokens = selector.split()
-        current_context = [self]
-
-        if tokens[-1] in self._selector_combinators:
-            raise ValueError(
-                'Final combinator "%s" is missing an argument.' % tokens[-1])
-        if self._select_debug:
-            print('Running CSS selector "%s"' % selector)
-        for index, token in enumerate(tokens):
-            if self._select_debug:
-                print(' Considering token "%s"' % token)
-            recursive_candidate_generator = None
-            tag_name = None
-            if tokens[index-1] in self._selector_combinators:
-                # This token was consumed by the previous combinator. Skip it.
-                if self._select_debug:
-                    print('  Token was consumed by the previous combinator.')
-                continue
-            # Each operation corresponds to a checker function, a rule
-            # for determining whether a candidate matches the
-            # selector. Candidates are generated by the active
-            # iterator.
-            checker = None
-
-            m = self.attribselect_re.match(token)
-            if m is not None:
-                # Attribute selector
-                tag_name, attribute, operator, value = m.groups()
-                checker = self._attribute_checker(operator, attribute, value)
-
-            elif '#' in token:
-                # ID selector
-                tag_name, tag_id = token.split('#', 1)
-                def id_matches(tag):
-                    return tag.get('id', None) == tag_id
-                checker = id_matches
-
-            elif '.' in token:
-                # Class selector
-                tag_name, klass = token.split('.', 1)
-                classes = set(klass.split('.'))
-                def classes_match(candidate):
-                    return classes.issubset(candidate.get('class', []))
-                checker = classes_match
-
-            elif ':' in token:
-                # Pseudo-class
-                tag_name, pseudo = token.split(':', 1)
-                if tag_name == '':
-                    raise ValueError(
-                        "A pseudo-class must be prefixed with a tag name.")
-                pseudo_attributes = re.match('([a-zA-Z\d-]+)\(([a-zA-Z\d]+)\)', pseudo)
-                found = []
-                if pseudo_attributes is not None:
-                    pseudo_type, pseudo_value = pseudo_attributes.groups()
-                    if pseudo_type == 'nth-of-type':
-                        try:
-                            pseudo_value = int(pseudo_value)
-                        except:
-                            raise NotImplementedError(
-                                'Only numeric values are currently supported for the nth-of-type pseudo-class.')
-                        if pseudo_value < 1:
-                            raise ValueError(
-                                'nth-of-type pseudo-class value must be at least 1.')
-                        class Counter(object):
-                            def __init__(self, destination):
-                                self.count = 0
-                                self.destination = destination
-
-                            def nth_child_of_type(self, tag):
-                                self.count += 1
-                                if self.count == self.destination:
-                                    return True
-                                if self.count > self.destination:
-                                    # Stop the generator that's sending us
-                                    # these things.
-                                    raise StopIteration()
-                                return False
-                        checker = Counter(pseudo_value).nth_child_of_type
-                    else:
-                        raise NotImplementedError(
-                            'Only the following pseudo-classes are implemented: nth-of-type.')
-
-            elif token == '*':
-                # Star selector -- matches everything
-                pass
-            elif token == '>':
-                # Run the next token as a CSS selector against the
-                # direct children of each tag in the current context.
-                recursive_candidate_generator = lambda tag: tag.children
-            elif token == '~':
-                # Run the next token as a CSS selector against the
-                # siblings of each tag in the current context.
-                recursive_candidate_generator = lambda tag: tag.next_siblings
-            elif token == '+':
-                # For each tag in the current context, run the next
-                # token as a CSS selector against the tag's next
-                # sibling that's a tag.
-                def next_tag_sibling(tag):
-                    yield tag.find_next_sibling(True)
-                recursive_candidate_generator = next_tag_sibling
-
-            elif self.tag_name_re.match(token):
-                # Just a tag name.
-                tag_name = token
-            else:
-                raise ValueError(
-                    'Unsupported or invalid CSS selector: "%s"' % token)
+    def select(self, selector):
+        """Perform a CSS selection operation on the current element.
 
-            if recursive_candidate_generator:
-                # This happens when the selector looks like  "> foo".
-                #
-                # The generator calls select() recursively on every
-                # member of the current context, passing in a different
-                # candidate generator and a different selector.
-                #
-                # In the case of "> foo", the candidate generator is
-                # one that yields a tag's direct children (">"), and
-                # the selector is "foo".
-                next_token = tokens[index+1]
-                def recursive_select(tag):
-                    if self._select_debug:
-                        print('    Calling select("%s") recursively on %s %s' % (next_token, tag.name, tag.attrs))
-                        print('-' * 40)
-                    for i in tag.select(next_token, recursive_candidate_generator):
-                        if self._select_debug:
-                            print('(Recursive select picked up candidate %s %s)' % (i.name, i.attrs))
-                        yield i
-                    if self._select_debug:
-                        print('-' * 40)
-                _use_candidate_generator = recursive_select
-            elif _candidate_generator is None:
-                # By default, a tag's candidates are all of its
-                # children. If tag_name is defined, only yield tags
-                # with that name.
-                if self._select_debug:
-                    if tag_name:
-                        check = "[any]"
-                    else:
-                        check = tag_name
-                    print('   Default candidate generator, tag name="%s"' % check)
-                if self._select_debug:
-                    # This is redundant with later code, but it stops
-                    # a bunch of bogus tags from cluttering up the
-                    # debug log.
-                    def default_candidate_generator(tag):
-                        for child in tag.descendants:
-                            if not isinstance(child, Tag):
-                                continue
-                            if tag_name and not child.name == tag_name:
-                                continue
-                            yield child
-                    _use_candidate_generator = default_candidate_generator
-                else:
-                    _use_candidate_generator = lambda tag: tag.descendants
-            else:
-                _use_candidate_generator = _candidate_generator
-
-            new_context = []
-            new_context_ids = set([])
-            for tag in current_context:
-                if self._select_debug:
-                    print("    Running candidate generator on %s %s" % (
-                        tag.name, repr(tag.attrs)))
-                for candidate in _use_candidate_generator(tag):
-                    if not isinstance(candidate, Tag):
-                        continue
-                    if tag_name and candidate.name != tag_name:
-                        continue
-                    if checker is not None:
-                        try:
-                            result = checker(candidate)
-                        except StopIteration:
-                            # The checker has decided we should no longer
-                            # run the generator.
-                            break
-                    if checker is None or result:
-                        if self._select_debug:
-                            print("     SUCCESS %s %s" % (candidate.name, repr(candidate.attrs)))
-                        if id(candidate) not in new_context_ids:
-                            # If a tag matches a selector more than once,
-                            # don't include it in the context more than once.
-                            new_context.append(candidate)
-                            new_context_ids.add(id(candidate))
-                    elif self._select_debug:
-                        print("     FAILURE %s %s" % (candidate.name, repr(candidate.attrs)))
-
-            current_context = new_context
-
-        if self._select_debug:
-            print("Final verdict:")
-            for i in current_context:
-                print(" %s %s" % (i.name, i.attrs))
-        return current_context
+        Returns the tags beneath this one that match the selector, in
+        document order. Selectors are compiled once and cached (see
+        compile_selector).
+        """
+        return compile_selector(selector).select(self)
 
     # Old names for backwards compatibility
     def childGenerator(self):
@@ -1444,11 +1477,112 @@ class SoupStrainer(object):
 
         self.attrs = normalized_attrs
         self.text = self._normalize_search_value(text)
+        self._compile()
+
+    def _compile(self):
+        # Work out once how each criterion applies, rather than again
+        # for every element searched. tag_matches(tag) does what
+        # search_tag(tag) does, and text_matches(s) what
+        # _matches(s, self.text) does.
+        self.text_matches = self._matcher(self.text)
+
+        name = self.name
+        if not name or name is True:
+            name_matches = None
+        elif callable(name):
+            name_matches = name
+        elif isinstance(name, str):
+            name_matches = lambda tag: tag.name == name
+        else:
+            value_matches = self._matcher(name)
+            name_matches = lambda tag: value_matches(tag.name)
+
+        attr_matchers = [(attr, self._matcher(match_against))
+                         for attr, match_against in self.attrs.items()]
+        self._attr_matchers = attr_matchers
+        text = self.text
+        text_matches = self.text_matches
+        if not attr_matchers and not text:
+            self.tag_matches = name_matches or (lambda tag: True)
+            return
+
+        def tag_matches(tag):
+            if name_matches is not None and not name_matches(tag):
+                return False
+            attrs = tag.attrs
+            for attr, matches in attr_matchers:
+                if not matches(attrs.get(attr)):
+                    return False
+            if text and not text_matches(tag.string):
+                return False
+            return True
+        self.tag_matches = tag_matches
+
+    def _matcher(self, match_against):
+        """A function of a markup value that does what
+        _matches(value, match_against) does, for any value but a Tag."""
+        normalize = self._normalize_search_value
+        if match_against is True:
+            scalar_matches = lambda value: value is not None
+        elif callable(match_against):
+            scalar_matches = match_against
+        elif isinstance(match_against, str):
+            match_empty = not match_against
+            def scalar_matches(value):
+                if value is None:
+                    return match_empty
+                if not isinstance(value, str):
+                    value = normalize(value)
+                return value == match_against
+        elif hasattr(match_against, 'match'):
+            search = match_against.search
+            def scalar_matches(value):
+                if value is None:
+                    return False
+                if not isinstance(value, str):
+                    value = normalize(value)
+                return search(value)
+        elif hasattr(match_against, '__iter__'):
+            match_empty = not match_against
+            try:
+                choices = frozenset(match_against)
+            except TypeError:
+                choices = match_against
+            def scalar_matches(value):
+                if value is None:
+                    return match_empty
+                if not isinstance(value, str):
+                    value = normalize(value)
+                try:
+                    return value in choices
+                except TypeError:
+                    return value in match_against
+        else:
+            # None and False match only a missing value.
+            scalar_matches = lambda value: value is None
+
+        # Multi-valued attributes like 'class' match if any value
+        # does, except that "foo bar" only matches the literal value
+        # "foo bar" (see _matches).
+        if isinstance(match_against, str) and ' ' in match_against:
+            whole_value = whitespace_re.split(match_against)
+        else:
+            whole_value = None
+        def matches(value):
+            if isinstance(value, (list, tuple)):
+                if whole_value is not None:
+                    return whole_value == value
+                for item in value:
+                    if matches(item):
+                        return True
+                return False
+            return scalar_matches(value)
+        return matches
 
     def _normalize_search_value(self, value):
         # Leave it alone if it's a Unicode string, a callable, a
         # regular expression, a boolean, or None.
-        if (isinstance(value, str) or isinstance(value, collections.Callable) or hasattr(value, 'match')
+        if (isinstance(value, str) or callable(value) or hasattr(value, 'match')
             or isinstance(value, bool) or value is None):
             return value
 
@@ -1482,25 +1616,25 @@ class SoupStrainer(object):
             return "%s|%s" % (self.name, self.attrs)
 
     def search_tag(self, markup_name=None, markup_attrs={}):
-        found = None
-        markup = None
         if isinstance(markup_name, Tag):
-            markup = markup_name
-            markup_attrs = markup
-        call_function_with_tag_data = (
-            isinstance(self.name, collections.Callable)
-            and not isinstance(markup_name, Tag))
+            if self.tag_matches(markup_name):
+                return markup_name
+            return None
+
+        # Otherwise this is a tag that hasn't been created yet (see
+        # BeautifulSoup(parse_only=...)): its name and attributes.
+        found = None
+        call_function_with_tag_data = callable(self.name)
 
         if ((not self.name)
             or call_function_with_tag_data
-            or (markup and self._matches(markup, self.name))
-            or (not markup and self._matches(markup_name, self.name))):
+            or self._matches(markup_name, self.name)):
             if call_function_with_tag_data:
                 match = self.name(markup_name, markup_attrs)
             else:
                 match = True
                 markup_attr_map = None
-                for attr, match_against in list(self.attrs.items()):
+                for attr, matches in self._attr_matchers:
                     if not markup_attr_map:
                         if hasattr(markup_attrs, 'get'):
                             markup_attr_map = markup_attrs
@@ -1508,15 +1642,11 @@ class SoupStrainer(object):
                             markup_attr_map = {}
                             for k, v in markup_attrs:
                                 markup_attr_map[k] = v
-                    attr_value = markup_attr_map.get(attr)
-                    if not self._matches(attr_value, match_against):
+                    if not matches(markup_attr_map.get(attr)):
                         match = False
                         break
             if match:
-                if markup:
-                    found = markup
-                else:
-                    found = markup_name
+                found = markup_name
         if found and self.text and not self._matches(found.string, self.text):
             found = None
         return found
@@ -1541,7 +1671,7 @@ class SoupStrainer(object):
         # If it's text, make sure the text matches.
         elif isinstance(markup, NavigableString) or \
                  isinstance(markup, str):
-            if not self.name and not self.attrs and self._matches(markup, self.text):
+            if not self.name and not self.attrs and self.text_matches(markup):
                 found = markup
         else:
             raise Exception(
@@ -1574,7 +1704,7 @@ class SoupStrainer(object):
             # True matches any non-None value.
             return markup is not None
 
-        if isinstance(match_against, collections.Callable):
+        if callable(match_against):
             return match_against(markup)
 
         # Custom callables take the tag as an argument, but all
@@ -1609,3 +1739,486 @@ class ResultSet(list):
     def __init__(self, source, result=()):
         super(ResultSet, self).__init__(result)
         self.source = source
+
+
+class TreeIndex(object):
+    """An index of the tags in a tree by name, id and class, in document
+    order, so that searches can go straight to the tags that might
+    match instead of looking at every element.
+
+    The index is built the first time it's used, and again the first
+    time it's used after the tree changes. Changes made by insert(),
+    extract() (and everything built on them) and by setting or
+    deleting tag[key] are noticed. Changes made by assigning to a
+    tag's .name or .attrs directly aren't: call invalidate() after
+    making them.
+    """
+
+    # Every TreeIndex in use. Until there is one, changes to trees
+    # don't need to be tracked at all.
+    instances = weakref.WeakSet()
+
+    def __init__(self, root):
+        self.root = root
+        self.invalidate()
+        TreeIndex.instances.add(self)
+
+    def invalidate(self):
+        """Discard the index, so it's built again the next time it's used."""
+        self._positions = None
+        self._by_name = self._by_id = self._by_class = None
+
+    def _build(self):
+        # Every element is numbered by its position in the document
+        # (the root being 0), so the tags beneath a tag are those
+        # numbered after it, up to and including its last descendant.
+        positions = {}
+        by_name = {}
+        by_id = {}
+        by_class = {}
+        position = 0
+        for element in self.root.descendants:
+            position += 1
+            positions[id(element)] = position
+            if not isinstance(element, Tag):
+                continue
+            self._add(by_name, element.name, position, element)
+            attrs = element.attrs
+            if 'id' in attrs:
+                self._add(by_id, attrs['id'], position, element)
+            if 'class' in attrs:
+                classes = attrs['class']
+                if isinstance(classes, str):
+                    classes = whitespace_re.split(classes)
+                for klass in classes:
+                    self._add(by_class, klass, position, element)
+        positions[id(self.root)] = 0
+        self._positions = positions
+        self._by_name = by_name
+        self._by_id = by_id
+        self._by_class = by_class
+
+    def _add(self, table, key, position, tag):
+        if not isinstance(key, str):
+            return
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = ([], [])
+        entry[0].append(position)
+        entry[1].append(tag)
+
+    def candidates(self, tag, name=None, tag_id=None, classes=()):
+        """The tags beneath `tag`, in document order, that have the given
+        name, id and classes according to the index, or None if none of
+        them is given.
+
+        Only the fewest tags listed under any one of these are returned:
+        they still have to be checked against the others.
+        """
+        if self._positions is None:
+            self._build()
+        start = self._positions[id(tag)]
+        end = self._positions[id(tag._last_descendant())]
+        keys = [(self._by_name, name), (self._by_id, tag_id)]
+        keys.extend((self._by_class, klass) for klass in classes)
+        best = None
+        for table, key in keys:
+            if not key:
+                continue
+            entry = table.get(key)
+            if entry is None:
+                return []
+            positions, tags = entry
+            low = bisect_right(positions, start)
+            high = bisect_right(positions, end, low)
+            if best is None or high - low < best[2] - best[1]:
+                best = (tags, low, high)
+        if best is None:
+            return None
+        tags, low, high = best
+        return (tags[i] for i in range(low, high))
+
+    def find_all(self, tag, name, attrs, text, limit, **kwargs):
+        """The results of tag.find_all() with these arguments, found
+        with the index, or None if the search isn't by tag name, id or
+        a single class."""
+        if isinstance(name, SoupStrainer):
+            strainer = name
+        else:
+            strainer = SoupStrainer(name, attrs, text, **kwargs)
+        if strainer.text is not None or strainer.__class__ is not SoupStrainer:
+            return None
+        name = strainer.name
+        tag_id = strainer.attrs.get('id')
+        klass = strainer.attrs.get('class')
+        classes = ()
+        if isinstance(klass, str) and not whitespace_re.search(klass):
+            classes = (klass,)
+        candidates = self.candidates(
+            tag, name if isinstance(name, str) else None,
+            tag_id if isinstance(tag_id, str) else None, classes)
+        if candidates is None:
+            return None
+        results = ResultSet(strainer)
+        for candidate in candidates:
+            if strainer.tag_matches(candidate):
+                results.append(candidate)
+                if limit and len(results) >= limit:
+                    break
+        return results
+
+
+# CSS selectors. A selector is compiled once into a Selector: one list
+# of steps per comma-separated group, each a compound selector (a tag
+# name with any ids, classes, attributes and pseudo-classes) and the
+# combinator joining it to the compound on its left. Tags are matched
+# right to left: the candidates for a group's last compound are found
+# (with the tree's index, if it has one), and only those are checked
+# against the compounds before it.
+
+# Compiled selectors kept, by selector string.
+SELECTOR_CACHE_SIZE = 256
+
+_selector_token_re = re.compile(r"""
+    \s*(?P<combinator>[>+~,])\s*   # Combinator or group separator
+  | (?P<descendant>\s+)          # Descendant combinator
+  | (?P<type>[\w-]+|\*)
+  | \#(?P<id>[\w-]+)
+  | \.(?P<class>[\w-]+)
+  | \[\s*(?P<attribute>[\w:-]+)\s*
+      (?:(?P<operator>[~|^$*]?=)\s*
+         (?:"(?P<double_quoted>[^"]*)"|'(?P<single_quoted>[^']*)'|(?P<value>[^\]\s]*))
+      \s*)?\]
+  | :(?P<pseudo>[\w-]+)(?:\(\s*(?P<argument>[^)]*?)\s*\))?
+""", re.VERBOSE)
+
+_nth_re = re.compile(r"^(?:(?P<a>[+-]?\d*)n\s*(?:(?P<sign>[+-])\s*(?P<b>\d+))?|(?P<number>[+-]?\d+))$")
+
+
+def _attribute_checker(operator, attribute, value=''):
+    """Create a function that performs a CSS selector operation.
+
+    Takes an operator, attribute and optional value. Returns a
+    function that will return True for elements that match that
+    combination.
+    """
+    if operator == '=':
+        # string representation of `attribute` is equal to `value`
+        return lambda el: el._attr_value_as_string(attribute) == value
+    elif operator == '~=':
+        # space-separated list representation of `attribute`
+        # contains `value`
+        def _includes_value(element):
+            attribute_value = element.get(attribute, [])
+            if not isinstance(attribute_value, list):
+                attribute_value = attribute_value.split()
+            return value in attribute_value
+        return _includes_value
+    elif operator == '^=':
+        # string representation of `attribute` starts with `value`
+        return lambda el: el._attr_value_as_string(
+            attribute, '').startswith(value)
+    elif operator == '$=':
+        # string represenation of `attribute` ends with `value`
+        return lambda el: el._attr_value_as_string(
+            attribute, '').endswith(value)
+    elif operator == '*=':
+        # string representation of `attribute` contains `value`
+        return lambda el: value in el._attr_value_as_string(attribute, '')
+    elif operator == '|=':
+        # string representation of `attribute` is either exactly
+        # `value` or starts with `value` and then a dash.
+        def _is_or_starts_with_dash(element):
+            attribute_value = element._attr_value_as_string(attribute, '')
+            return (attribute_value == value or attribute_value.startswith(
+                    value + '-'))
+        return _is_or_starts_with_dash
+    else:
+        return lambda el: el.has_attr(attribute)
+
+
+def _position_of_type(tag, positions):
+    """The position of `tag` (counting from 1) among its siblings with
+    the same name.
+
+    `positions` holds the positions of the children of every parent
+    looked at so far, by id, so each parent's children are counted
+    once however many of them are checked. It must only be kept for
+    as long as the tree doesn't change: one select() call.
+    """
+    parent = tag.parent
+    if parent is None:
+        return 1
+    by_child = positions.get(id(parent))
+    if by_child is None:
+        by_child = positions[id(parent)] = {}
+        counts = {}
+        for child in parent.contents:
+            if isinstance(child, Tag):
+                count = counts.get(child.name, 0) + 1
+                counts[child.name] = count
+                by_child[id(child)] = count
+    return by_child[id(tag)]
+
+
+def _nth_of_type_checker(argument):
+    """Create a function that checks whether a tag is the an+b'th tag
+    with its name among its siblings, for the nth-of-type argument
+    `argument` ("3", "odd", "2n+1" and so on). The function takes the
+    tag and a dict of positions (see _position_of_type)."""
+    argument = argument.strip().lower()
+    if argument == 'odd':
+        a, b = 2, 1
+    elif argument == 'even':
+        a, b = 2, 0
+    else:
+        m = _nth_re.match(argument)
+        if m is None:
+            raise ValueError(
+                'Invalid argument for the nth-of-type pseudo-class: "%s"'
+                % argument)
+        if m.group('number') is not None:
+            a, b = 0, int(m.group('number'))
+            if b < 1:
+                raise ValueError(
+                    'nth-of-type pseudo-class value must be at least 1.')
+        else:
+            a = m.group('a')
+            a = {'': 1, '+': 1, '-': -1}.get(a, None) or int(a)
+            b = int(m.group('b') or 0)
+            if m.group('sign') == '-':
+                b = -b
+
+    def nth_of_type(tag, positions):
+        position = _position_of_type(tag, positions)
+        if a == 0:
+            return position == b
+        return (position - b) % a == 0 and (position - b) // a >= 0
+    return nth_of_type
+
+
+class _Compound(object):
+    """A compound selector: a tag name (or none, for any tag) and
+    any number of ids, classes, attribute selectors and
+    pseudo-classes, all of which a tag must match."""
+
+    def __init__(self):
+        self.name = None
+        self.ids = []
+        self.classes = set()
+        self.checkers = []
+        # Checkers that depend on a tag's position among its siblings,
+        # which also take the positions found so far.
+        self.position_checkers = []
+
+    def matches(self, tag, positions):
+        if self.name is not None and tag.name != self.name:
+            return False
+        attrs = tag.attrs
+        for tag_id in self.ids:
+            if attrs.get('id') != tag_id:
+                return False
+        if self.classes:
+            classes = attrs.get('class')
+            if classes is None:
+                return False
+            if isinstance(classes, str):
+                classes = classes.split()
+            if not self.classes.issubset(classes):
+                return False
+        for checker in self.checkers:
+            if not checker(tag):
+                return False
+        for checker in self.position_checkers:
+            if not checker(tag, positions):
+                return False
+        return True
+
+    def candidates(self, scope, index):
+        """The tags beneath `scope` that might match, in document order."""
+        tag_id = self.ids[0] if self.ids else None
+        if index is not None and (self.name or tag_id or self.classes):
+            return index.candidates(scope, self.name, tag_id, self.classes)
+        if self.name is not None:
+            name = self.name
+            return (element for element in scope.descendants
+                    if element.name == name)
+        return (element for element in scope.descendants
+                if isinstance(element, Tag))
+
+
+class Selector(object):
+    """A compiled CSS selector. See compile_selector()."""
+
+    def __init__(self, selector, groups):
+        self.selector = selector
+        # Each group is its last compound, and the (combinator,
+        # compound) steps to its left, nearest first. A compound of
+        # None is the tag select() was called on, for selectors that
+        # start with ">".
+        self.groups = groups
+
+    def __repr__(self):
+        return "<Selector %r>" % self.selector
+
+    def select(self, scope):
+        """The tags beneath `scope` that match this selector, in
+        document order."""
+        index = scope._tree_index()
+        # Positions of tags among their siblings, found as needed and
+        # kept for this call (see _position_of_type).
+        positions = {}
+        if len(self.groups) == 1:
+            compound, steps = self.groups[0]
+            return [tag for tag in compound.candidates(scope, index)
+                    if compound.matches(tag, positions)
+                    and self._matches_steps(tag, steps, 0, scope, positions)]
+        # A tag may match more than one group, and each group's tags
+        # are found in their own order, so look at every tag once.
+        return [tag for tag in scope.descendants
+                if isinstance(tag, Tag)
+                and self._matches(tag, scope, positions)]
+
+    def matches(self, tag, scope=None):
+        """Whether `tag` matches this selector, looking no higher in
+        the tree than `scope`, if it's given."""
+        return self._matches(tag, scope, {})
+
+    def _matches(self, tag, scope, positions):
+        for compound, steps in self.groups:
+            if (compound.matches(tag, positions)
+                and self._matches_steps(tag, steps, 0, scope, positions)):
+                return True
+        return False
+
+    def _matches_steps(self, tag, steps, i, scope, positions):
+        # Whether the steps from i leftwards match, starting from `tag`.
+        if i == len(steps):
+            return True
+        combinator, compound = steps[i]
+        if combinator == ' ':
+            ancestor = tag.parent
+            while ancestor is not None and ancestor is not scope:
+                if (compound.matches(ancestor, positions)
+                    and self._matches_steps(
+                        ancestor, steps, i + 1, scope, positions)):
+                    return True
+                ancestor = ancestor.parent
+            return False
+        if combinator == '>':
+            parent = tag.parent
+            if compound is None:
+                return parent is scope
+            return (parent is not None and parent is not scope
+                    and compound.matches(parent, positions)
+                    and self._matches_steps(
+                        parent, steps, i + 1, scope, positions))
+        sibling = tag.previous_sibling
+        while sibling is not None:
+            if isinstance(sibling, Tag):
+                if (compound.matches(sibling, positions)
+                    and self._matches_steps(
+                        sibling, steps, i + 1, scope, positions)):
+                    return True
+                if combinator == '+':
+                    # Only the nearest tag can be the adjacent sibling.
+                    return False
+            sibling = sibling.previous_sibling
+        return False
+
+
+@functools.lru_cache(maxsize=SELECTOR_CACHE_SIZE)
+def compile_selector(selector):
+    """Compile a CSS selector into a Selector.
+
+    Supported: type, universal, id and class selectors, attribute
+    selectors ([attr], =, ~=, ^=, $=, *= and |=), the nth-of-type
+    pseudo-class, the descendant, child (>), adjacent sibling (+) and
+    general sibling (~) combinators, and comma-separated groups. A
+    selector may start with ">", to select children of the tag it's
+    used on.
+
+    The most recently used selectors are kept compiled.
+    """
+    groups = []
+    # The current group, as alternating compounds and combinators.
+    parts = []
+    compound = None
+    position = 0
+    text = selector.strip()
+
+    def end_group():
+        if compound is None:
+            if parts:
+                raise ValueError(
+                    'Final combinator "%s" is missing an argument.'
+                    % parts[-1])
+            raise ValueError('Empty CSS selector group in "%s"' % selector)
+        parts.append(compound)
+        steps = []
+        for i in range(len(parts) - 2, 0, -2):
+            steps.append((parts[i], parts[i - 1]))
+        groups.append((parts[-1], steps))
+
+    while position < len(text):
+        m = _selector_token_re.match(text, position)
+        if m is None or m.end() == position:
+            raise ValueError(
+                'Unsupported or invalid CSS selector: "%s"' % selector)
+        position = m.end()
+        combinator = m.group('combinator')
+        if combinator is None and m.group('descendant') is not None:
+            combinator = ' '
+        if combinator == ',':
+            end_group()
+            parts = []
+            compound = None
+            continue
+        if combinator is not None:
+            if compound is None:
+                if parts or combinator != '>':
+                    raise ValueError(
+                        'Combinator "%s" is missing an argument in "%s"'
+                        % (combinator, selector))
+                # A leading ">": children of the tag select() is
+                # called on.
+                parts.append(None)
+            else:
+                parts.append(compound)
+            parts.append(combinator)
+            compound = None
+            continue
+
+        new_compound = compound is None
+        if new_compound:
+            compound = _Compound()
+        if m.group('type') is not None:
+            if not new_compound:
+                raise ValueError(
+                    'Unsupported or invalid CSS selector: "%s"' % selector)
+            if m.group('type') != '*':
+                compound.name = m.group('type')
+        elif m.group('id') is not None:
+            compound.ids.append(m.group('id'))
+        elif m.group('class') is not None:
+            compound.classes.add(m.group('class'))
+        elif m.group('attribute') is not None:
+            value = m.group('double_quoted')
+            if value is None:
+                value = m.group('single_quoted')
+            if value is None:
+                value = m.group('value') or ''
+            compound.checkers.append(_attribute_checker(
+                m.group('operator'), m.group('attribute'), value))
+        else:
+            pseudo = m.group('pseudo')
+            if pseudo != 'nth-of-type':
+                raise NotImplementedError(
+                    'Only the following pseudo-classes are implemented: nth-of-type.')
+            if m.group('argument') is None:
+                raise ValueError(
+                    'The nth-of-type pseudo-class needs an argument.')
+            compound.position_checkers.append(
+                _nth_of_type_checker(m.group('argument')))
+    end_group()
+    return Selector(selector, groups)
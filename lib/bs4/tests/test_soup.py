@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Tests of Beautiful Soup as a whole."""
 
+import io
 import logging
 import unittest
 import sys
@@ -9,7 +10,9 @@ import tempfile
 from bs4 import (
     BeautifulSoup,
     BeautifulStoneSoup,
+    StreamingSoup,
 )
+from bs4.builder import HTMLParserTreeBuilder, TreeBuilder
 from bs4.element import (
     CharsetMetaAttributeValue,
     ContentMetaAttributeValue,
@@ -18,7 +21,9 @@ from bs4.element import (
     )
 import bs4.dammit
 from bs4.dammit import (
+    EncodingDetector,
     EntitySubstitution,
+    IncrementalUnicodeDammit,
     UnicodeDammit,
 )
 from bs4.testing import (
@@ -109,6 +114,141 @@ class TestSelectiveParsing(SoupTest):
         self.assertEqual(soup.encode(), b"<b>Yes</b><b>Yes <c>Yes</c></b>")
 
 
+class TestIncrementalParsing(SoupTest):
+
+    markup = ('<html><head><title>A &amp; B</title></head><body>'
+              '<p class="x">Caf\N{LATIN SMALL LETTER E WITH ACUTE}'
+              ' <a href="/a?b=1&amp;c=2">link</a><!--note--></p>'
+              '<script>if (a < b) {}</script></body></html>')
+
+    def feed_in_pieces(self, markup, size, **kwargs):
+        parser = BeautifulSoup.incremental("html.parser", **kwargs)
+        for i in range(0, len(markup), size):
+            parser.feed(markup[i:i+size])
+        return parser.close()
+
+    def test_pieces_build_the_same_tree_as_the_whole_document(self):
+        expect = self.soup(self.markup).decode()
+        for size in (1, 2, 3, 7, 1000):
+            soup = self.feed_in_pieces(self.markup, size)
+            self.assertEqual(expect, soup.decode())
+
+    def test_bytestring_pieces_are_decoded(self):
+        data = self.markup.encode("utf8")
+        for size in (1, 5, 1000):
+            soup = self.feed_in_pieces(data, size)
+            self.assertEqual(self.soup(data).decode(), soup.decode())
+            self.assertEqual("utf-8", soup.original_encoding)
+
+    def test_declared_encoding(self):
+        markup = ('<meta charset="windows-1252"><p>\N{RIGHT SINGLE QUOTATION MARK}'
+                  '</p>')
+        soup = self.feed_in_pieces(markup.encode("windows-1252"), 3)
+        self.assertEqual("windows-1252", soup.original_encoding)
+        self.assertEqual("windows-1252", soup.declared_html_encoding)
+        self.assertEqual("\N{RIGHT SINGLE QUOTATION MARK}", soup.p.string)
+
+    def test_from_encoding(self):
+        data = "<p>\N{HEBREW LETTER ALEF}</p>".encode("iso-8859-8")
+        soup = self.feed_in_pieces(data, 2, from_encoding="iso-8859-8")
+        self.assertEqual("iso-8859-8", soup.original_encoding)
+        self.assertEqual("\N{HEBREW LETTER ALEF}", soup.p.string)
+
+    def test_tree_is_available_while_parsing(self):
+        parser = BeautifulSoup.incremental("html.parser")
+        parser.feed("<ul><li>one</li><li>tw")
+        self.assertEqual(["one"], [li.string for li in parser.soup("li")[:1]])
+        parser.feed("o</li></ul>")
+        soup = parser.close()
+        self.assertTrue(soup is parser.soup)
+        self.assertEqual(["one", "two"], [li.string for li in soup("li")])
+
+    def test_close_ends_open_tags(self):
+        parser = BeautifulSoup.incremental("html.parser")
+        parser.feed("<div><p>unfinished")
+        self.assertEqual("<div><p>unfinished</p></div>", parser.close().decode())
+
+    def test_feed_after_close(self):
+        parser = BeautifulSoup.incremental("html.parser")
+        parser.feed("<p>")
+        parser.close()
+        self.assertRaises(ValueError, parser.feed, "</p>")
+
+    def test_parse_only_and_indexed(self):
+        parser = BeautifulSoup.incremental(
+            "html.parser", parse_only=SoupStrainer("a"), indexed=True)
+        parser.feed(self.markup)
+        soup = parser.close()
+        self.assertEqual(['<a href="/a?b=1&amp;c=2">link</a>'],
+                         [str(a) for a in soup.find_all("a")])
+        self.assertTrue(soup._index is not None)
+
+
+class TestIterparse(SoupTest):
+
+    markup = ('<html><body><div id="nav"><a href="/nav">Nav</a></div>'
+              '<div id="content"><p>Intro <a href="/one">one</a>'
+              ' <a name="anchor">anchor</a></p>'
+              '<ul><li><a href="/two">two <b>bold</b></a></li></ul></div>'
+              '<a href="/footer">footer</a></body></html>')
+
+    def test_yields_matching_tags(self):
+        found = list(BeautifulSoup.iterparse(
+            self.markup, "a", "html.parser"))
+        self.assertEqual(
+            ["/nav", "/one", None, "/two", "/footer"],
+            [a.get("href") for a in found])
+        self.assertEqual('<a href="/two">two <b>bold</b></a>', found[3].decode())
+
+    def test_within(self):
+        for chunk_size in (1, 10, 65536):
+            found = BeautifulSoup.iterparse(
+                self.markup, SoupStrainer("a", href=True), "html.parser",
+                within=SoupStrainer(id="content"), chunk_size=chunk_size)
+            self.assertEqual(["/one", "/two"], [a["href"] for a in found])
+
+    def test_matches_are_detached(self):
+        for a in BeautifulSoup.iterparse(self.markup, "a", "html.parser"):
+            self.assertEqual(None, a.parent)
+            self.assertEqual(None, a.previous_element)
+            self.assertEqual(None, a.previous_sibling)
+            self.assertEqual(None, a._last_descendant().next_element)
+
+    def test_match_within_a_match_is_not_yielded_separately(self):
+        markup = "<div>1<div>2</div></div><div>3</div>"
+        found = BeautifulSoup.iterparse(markup, "div", "html.parser")
+        self.assertEqual(["<div>1<div>2</div></div>", "<div>3</div>"],
+                         [div.decode() for div in found])
+
+    def test_tags_are_yielded_as_they_close(self):
+        pieces = iter(["<p>one</p><p>tw", "o</p><p>thr", "ee"])
+        found = BeautifulSoup.iterparse(pieces, "p", "html.parser")
+        self.assertEqual("one", next(found).string)
+        self.assertEqual("two", next(found).string)
+        # The last one is only closed by the end of the document.
+        self.assertEqual("three", next(found).string)
+        self.assertRaises(StopIteration, next, found)
+
+    def test_file_of_bytes(self):
+        data = io.BytesIO(self.markup.encode("utf8"))
+        found = BeautifulSoup.iterparse(
+            data, "a", "html.parser", within="ul", chunk_size=8)
+        self.assertEqual(["/two"], [a["href"] for a in found])
+
+    def test_nothing_else_is_kept(self):
+        soup = StreamingSoup(self.markup, "html.parser", match="b")
+        self.assertEqual(["<b>bold</b>"], [b.decode() for b in soup.found])
+        self.assertEqual([], soup.contents)
+
+    def test_builder_without_incremental_parsing(self):
+        class WholeDocumentBuilder(HTMLParserTreeBuilder):
+            start_incremental = TreeBuilder.start_incremental
+        found = BeautifulSoup.iterparse(
+            iter([self.markup[:50], self.markup[50:]]), "a",
+            builder=WholeDocumentBuilder(), within="ul")
+        self.assertEqual(["/two"], [a["href"] for a in found])
+
+
 class TestEntitySubstitution(unittest.TestCase):
     """Standalone tests of the EntitySubstitution class."""
     def setUp(self):
@@ -177,6 +317,27 @@ class TestEntitySubstitution(unittest.TestCase):
         text = 'Bob\'s "bar"'
         self.assertEqual(self.sub.substitute_html(text), text)
 
+    def test_html_substitution_of_xml_and_other_characters_together(self):
+        s = "<caf\u00e9> & \u2014 &eacute;"
+        self.assertEqual(self.sub.substitute_html(s),
+                          "&lt;caf&eacute;&gt; &amp; &mdash; &amp;eacute;")
+
+    def test_html_substitution_of_unpaired_surrogate(self):
+        s = "a\ud800&b"
+        self.assertEqual(self.sub.substitute_html(s), "a\ud800&amp;b")
+
+    def test_ampersands_next_to_entities_and_brackets(self):
+        self.assertEqual(
+            self.sub.substitute_xml_containing_entities("&&lt;&#1;&#x1F;&<&>"),
+            "&amp;&lt;&#1;&#x1F;&amp;&lt;&amp;&gt;")
+
+    def test_unchanged_string(self):
+        s = "Nothing to substitute here"
+        for substitute in (self.sub.substitute_xml,
+                           self.sub.substitute_html,
+                           self.sub.substitute_xml_containing_entities):
+            self.assertEqual(s, substitute(s))
+
 
 class TestEncodingConversion(SoupTest):
     # Test Beautiful Soup's ability to decode and encode from various
@@ -391,6 +552,99 @@ class TestUnicodeDammit(unittest.TestCase):
             output = UnicodeDammit.detwingle(input)
             self.assertEqual(output, input)
 
+class TestEncodingDetectorFastPaths(unittest.TestCase):
+
+    def setUp(self):
+        self.chardet = bs4.dammit.chardet_dammit
+        self.chardet_calls = []
+        def recorder(data):
+            self.chardet_calls.append(data)
+            return None
+        bs4.dammit.chardet_dammit = recorder
+
+    def tearDown(self):
+        bs4.dammit.chardet_dammit = self.chardet
+
+    def test_valid_utf8_is_decoded_once_without_chardet(self):
+        data = "<p>Sacr\xe9 bleu! \N{SNOWMAN}</p>".encode("utf8") * 100
+        dammit = UnicodeDammit(data, is_html=True)
+        self.assertEqual("utf-8", dammit.original_encoding)
+        self.assertEqual([], self.chardet_calls)
+        self.assertTrue(dammit.unicode_markup is dammit.detector.utf8_markup)
+
+    def test_declared_encoding_comes_before_utf8(self):
+        data = b'<meta charset="iso-8859-5"><p>\xc3\xa9</p>'
+        dammit = UnicodeDammit(data, is_html=True)
+        self.assertEqual("iso-8859-5", dammit.original_encoding)
+
+    def test_chardet_sees_a_sample_from_the_first_non_ascii_byte(self):
+        size = EncodingDetector.CHARDET_SAMPLE_SIZE
+        data = b"a" * size + b"\xe9" + b"b" * size * 2
+        dammit = UnicodeDammit(data)
+        self.assertEqual("windows-1252", dammit.original_encoding)
+        [sample] = self.chardet_calls
+        self.assertEqual(size, len(sample))
+        self.assertTrue(sample.startswith(b"\xe9b"))
+
+    def test_codec_lookups_are_cached(self):
+        UnicodeDammit(b"<p>a</p>", ["no-such-codec"])
+        hits = bs4.dammit._lookup_codec.cache_info().hits
+        UnicodeDammit(b"<p>a</p>", ["no-such-codec"])
+        self.assertTrue(bs4.dammit._lookup_codec.cache_info().hits > hits)
+
+
+class TestIncrementalUnicodeDammit(unittest.TestCase):
+    """Standalone tests of IncrementalUnicodeDammit."""
+
+    def convert(self, data, size=1, **kwargs):
+        dammit = IncrementalUnicodeDammit(**kwargs)
+        pieces = [dammit.feed(data[i:i+size])
+                  for i in range(0, len(data), size)]
+        pieces.append(dammit.close())
+        return dammit, ''.join(pieces)
+
+    def test_utf8_split_between_pieces(self):
+        text = "<p>R\N{LATIN SMALL LETTER A WITH DIAERESIS}ksm\N{SNOWMAN}</p>"
+        dammit, u = self.convert(text.encode("utf8"))
+        self.assertEqual(text, u)
+        self.assertEqual("utf-8", dammit.original_encoding)
+
+    def test_encoding_is_chosen_from_the_start_of_the_document(self):
+        dammit = IncrementalUnicodeDammit()
+        self.assertEqual('', dammit.feed(b"<p>\xc3"))
+        self.assertEqual(None, dammit.original_encoding)
+        self.assertEqual("<p>\xe9" + "x" * 3000,
+                         dammit.feed(b"\xa9" + b"x" * 3000))
+        self.assertEqual("utf-8", dammit.original_encoding)
+        self.assertEqual("</p>", dammit.feed(b"</p>"))
+
+    def test_byte_order_mark(self):
+        text = "<p>\N{SNOWMAN}</p>"
+        dammit, u = self.convert(text.encode("utf-16"), 3)
+        self.assertEqual(text, u)
+        self.assertEqual("utf-16le", dammit.original_encoding)
+
+    def test_wrong_guess_switches_encoding_for_the_rest(self):
+        data = b"x" * 3000 + b"<p>\x93quoted\x94</p>"
+        dammit, u = self.convert(data, 100)
+        self.assertEqual(
+            "x" * 3000 + "<p>\N{LEFT DOUBLE QUOTATION MARK}quoted"
+            "\N{RIGHT DOUBLE QUOTATION MARK}</p>", u)
+        self.assertEqual("windows-1252", dammit.original_encoding)
+        self.assertFalse(dammit.contains_replacement_characters)
+
+    def test_last_resort_is_replacement_character(self):
+        data = b"<p>\xe9\x81\xe9</p>" * 1000
+        dammit, u = self.convert(data, 7, override_encodings=["ascii"])
+        self.assertTrue(dammit.contains_replacement_characters)
+        self.assertTrue("\ufffd" in u)
+
+    def test_empty_document(self):
+        dammit, u = self.convert(b"")
+        self.assertEqual('', u)
+        self.assertEqual(None, dammit.original_encoding)
+
+
 class TestNamedspacedAttribute(SoupTest):
 
     def test_name_may_be_none(self):
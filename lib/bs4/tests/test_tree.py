@@ -10,8 +10,10 @@ methods tested here.
 """
 
 import copy
+import io
 import pickle
 import re
+import sys
 import warnings
 from bs4 import BeautifulSoup
 from bs4.builder import (
@@ -110,6 +112,15 @@ class TestFindAll(TreeTest):
         self.assertSelects(
             soup.find_all('a', limit=0), ["1", "2", "3", "4", "5"])
 
+    def test_find_all_limit_with_attributes(self):
+        soup = self.soup('<a class="x">1</a><b class="x">2</b><a class="x">3</a>'
+                         '<a class="y">4</a><a class="x">5</a>')
+        self.assertSelects(soup.find_all('a', 'x', limit=2), ["1", "3"])
+        self.assertSelects(soup.find_all(class_='x', limit=2), ["1", "2"])
+        self.assertSelects(soup.find_all(['a', 'b'], limit=3), ["1", "2", "3"])
+        self.assertSelects(
+            soup.find_all('a', text=re.compile('[345]'), limit=2), ["3", "4"])
+
     def test_calling_a_tag_is_calling_findall(self):
         soup = self.soup("<a>1</a><b>2<a id='foo'>3</a></b>")
         self.assertSelects(soup('a', limit=1), ["1"])
@@ -396,6 +407,41 @@ class TestFindAllByAttribute(TreeTest):
 
 
 
+class TestSoupStrainerMatchers(TreeTest):
+    """SoupStrainer's compiled matchers do what _matches() does."""
+
+    def test_compiled_matchers_agree_with_matches(self):
+        criteria = [None, False, True, '', 'foo', 'foo bar', 'Foo',
+                    re.compile('^f'), re.compile('x'), ['foo', 'bar'], [],
+                    ['foo', ['bar']], lambda value: value == 'bar']
+        values = [None, '', 'foo', 'bar', 'foo bar', 'Foo', b'foo', 3,
+                  ['foo'], ['bar', 'baz'], ['foo', 'bar'], ('foo',), []]
+        strainer = SoupStrainer()
+        for criterion in criteria:
+            matches = strainer._matcher(criterion)
+            for value in values:
+                self.assertEqual(
+                    bool(matches(value)), bool(strainer._matches(value, criterion)),
+                    "%r against %r" % (value, criterion))
+
+    def test_tag_matches(self):
+        soup = self.soup('<a id="1" class="x y">foo</a><b id="2">bar</b>')
+        a, b = soup.a, soup.b
+        for strainer, expected in (
+            (SoupStrainer('a'), [a]),
+            (SoupStrainer(['a', 'b']), [a, b]),
+            (SoupStrainer(re.compile('^b')), [b]),
+            (SoupStrainer(lambda tag: tag.has_attr('class')), [a]),
+            (SoupStrainer(attrs={'id': True}), [a, b]),
+            (SoupStrainer(attrs={'class': 'y'}), [a]),
+            (SoupStrainer(attrs={'class': 'x y'}), [a]),
+            (SoupStrainer(attrs={'class': None}), [b]),
+            (SoupStrainer(True, text='bar'), [b]),
+            (SoupStrainer(id=['2', '3']), [b])):
+            self.assertEqual([tag for tag in (a, b) if strainer.search(tag)],
+                             expected, str(strainer))
+
+
 class TestIndex(TreeTest):
     """Test Tag.index"""
     def test_index(self):
@@ -720,6 +766,48 @@ class TestTagCreation(SoupTest):
 
 class TestTreeModification(SoupTest):
 
+    def assertPositionsCorrect(self, tag):
+        for i, child in enumerate(tag.contents):
+            self.assertEqual(tag.index(child), i)
+
+    def test_index_after_many_changes(self):
+        soup = self.soup("<ul>%s</ul>" % "\n".join(
+            "<li>%d</li>" % i for i in range(200)))
+        ul = soup.ul
+        items = soup.find_all('li')
+        # Remove children in order, in reverse and scattered about,
+        # checking every position along the way.
+        for item in items[:20]:
+            item.extract()
+        self.assertPositionsCorrect(ul)
+        for item in reversed(items[180:]):
+            item.decompose()
+        self.assertPositionsCorrect(ul)
+        for item in items[20:180:7]:
+            self.assertEqual(ul.index(item), ul.contents.index(item))
+            item.extract()
+        self.assertPositionsCorrect(ul)
+        # Then add some back, and unwrap others.
+        ul.insert(3, items[0])
+        ul.append(items[1])
+        for item in items[22:60:7]:
+            item.unwrap()
+        self.assertPositionsCorrect(ul)
+        for item in items[63:100:7]:
+            item.replace_with(soup.new_tag('b'))
+        self.assertPositionsCorrect(ul)
+        self.assertRaises(ValueError, ul.index, items[2])
+
+    def test_index_after_contents_changed_directly(self):
+        soup = self.soup("<p><a>1</a><b>2</b><i>3</i></p>")
+        a, b, i = soup.p.contents
+        soup.p.contents.remove(a)
+        soup.p.contents.append(a)
+        self.assertEqual(soup.p.index(b), 0)
+        self.assertEqual(soup.p.index(a), 2)
+        b.extract()
+        self.assertEqual(soup.p.contents, [i, a])
+
     def test_attribute_modification(self):
         soup = self.soup('<a id="1"></a>')
         soup.a['id'] = 2
@@ -1103,6 +1191,18 @@ class TestTreeModification(SoupTest):
 class TestElementObjects(SoupTest):
     """Test various features of element objects."""
 
+    def test_elements_have_no_instance_dict(self):
+        soup = self.soup("<a href='x'>foo<!--bar--></a>")
+        for element in (soup.a, soup.a.contents[0], soup.a.contents[1]):
+            self.assertFalse(hasattr(element, '__dict__'))
+        self.assertRaises(AttributeError, setattr, soup.a, 'foo', 1)
+
+    def test_names_and_attribute_keys_are_shared(self):
+        soup = self.soup("<p class='a'>1</p><p class='b'>2</p>")
+        first, second = soup.find_all('p')
+        self.assertTrue(first.name is second.name)
+        self.assertTrue(list(first.attrs)[0] is list(second.attrs)[0])
+
     def test_len(self):
         """The length of an element is its number of children."""
         soup = self.soup("<top>1<b>2</b>3</top>")
@@ -1484,6 +1584,86 @@ class TestEncoding(SoupTest):
         self.assertEqual(
             "\N{SNOWMAN}".encode("utf8"), soup.b.renderContents())
 
+class TestWriteTo(SoupTest):
+    """Test writing a tree to a file, and the serializer behind it."""
+
+    markup = ('<div class="a b"><p>Some <b>bold</b> &amp; plain text</p>'
+              '<pre>  kept\n  as is </pre><br/>\n<!--note--></div>')
+
+    def test_write_to_text_file_matches_decode(self):
+        soup = self.soup(self.markup)
+        fp = io.StringIO()
+        soup.write_to(fp)
+        self.assertEqual(soup.decode(), fp.getvalue())
+
+    def test_write_to_pretty_prints_like_prettify(self):
+        soup = self.soup(self.markup)
+        fp = io.StringIO()
+        soup.write_to(fp, pretty_print=True)
+        self.assertEqual(soup.prettify(), fp.getvalue())
+
+        fp = io.StringIO()
+        soup.div.write_to(fp, pretty_print=True, formatter="html")
+        self.assertEqual(soup.div.prettify(formatter="html"), fp.getvalue())
+
+    def test_write_to_binary_file_matches_encode(self):
+        soup = self.soup("<b>\N{SNOWMAN}</b>")
+        fp = io.BytesIO()
+        soup.write_to(fp, encoding="ascii")
+        self.assertEqual(soup.encode("ascii"), fp.getvalue())
+        self.assertEqual(b"<b>&#9731;</b>", fp.getvalue())
+
+        fp = io.BytesIO()
+        soup.write_to(fp, pretty_print=True, encoding="utf-16")
+        self.assertEqual(soup.prettify("utf-16"), fp.getvalue())
+
+    def test_write_to_in_small_chunks(self):
+        soup = self.soup(self.markup * 20)
+        soup.SERIALIZE_CHUNK_SIZE = 3
+        chunks = []
+        class Collector(object):
+            write = chunks.append
+        soup.write_to(Collector, pretty_print=True)
+        self.assertTrue(len(chunks) > 20)
+        self.assertEqual(soup.prettify(), ''.join(chunks))
+
+    def test_write_to_xml_document_starts_with_declaration(self):
+        soup = self.soup("<root/>")
+        soup.is_xml = True
+        fp = io.StringIO()
+        soup.write_to(fp)
+        self.assertEqual(soup.decode(), fp.getvalue())
+        self.assertTrue(fp.getvalue().startswith('<?xml version="1.0"'))
+
+    def test_deep_tree_does_not_recurse(self):
+        depth = sys.getrecursionlimit() * 2
+        soup = self.soup("<div>" * depth + "x" + "</div>" * depth)
+        self.assertEqual(
+            "<div>" * depth + "x" + "</div>" * depth, soup.decode())
+        pretty = soup.prettify()
+        self.assertEqual(depth * 2, pretty.count("\n"))
+        self.assertTrue(pretty.endswith("</div>\n</div>"))
+
+    def test_repeated_attributes_are_formatted_once(self):
+        soup = self.soup('<p class="a&amp;b">1</p><p class="a&amp;b">2</p>')
+        self.assertEqual(
+            '<p class="a&amp;b">1</p><p class="a&amp;b">2</p>', soup.decode())
+        # A formatter that isn't built in is called every time.
+        calls = []
+        def formatter(s):
+            calls.append(s)
+            return s.upper()
+        self.assertEqual(
+            '<p class="A&B">1</p><p class="A&B">2</p>',
+            soup.decode(formatter=formatter))
+        self.assertEqual(["a&b", "1", "a&b", "2"], calls)
+
+    def test_decode_contents_of_pretty_printed_tag(self):
+        soup = self.soup("<p>  one <b> two </b> three  </p>")
+        self.assertEqual(
+            "one\n<b>\n two\n</b>\nthree\n",
+            soup.p.decode_contents(indent_level=1))
+
 class TestNavigableStringSubclasses(SoupTest):
 
     def test_cdata(self):
@@ -1827,3 +2007,152 @@ class TestSoupSelector(TreeTest):
 
     def test_sibling_combinator_wont_select_same_tag_twice(self):
         self.assertSelects('p[lang] ~ p', ['lang-en-gb', 'lang-en-us', 'lang-fr'])
+
+    def test_selector_groups(self):
+        self.assertSelects('h1, h2', ['header1', 'header2', 'header3'])
+        self.assertSelects('#p1,#bob , .s1 > a', ['p1', 'bob', 's1a1', 's1a2'])
+        # A tag matching more than one group is only selected once, and
+        # tags are in document order.
+        els = self.soup.select('h2, #header1, [id^="header"]')
+        self.assertEqual([el['id'] for el in els],
+                         ['header1', 'header2', 'header3'])
+        self.assertRaises(ValueError, self.soup.select, 'h1,,h2')
+        self.assertRaises(ValueError, self.soup.select, 'h1,')
+
+    def test_combinators_without_whitespace(self):
+        self.assertSelects('.s1>a', ['s1a1', 's1a2'])
+        self.assertSelects('#p1+h2', ['header2'])
+        self.assertSelects('#p1~h2', ['header2', 'header3'])
+
+    def test_attribute_value_quoting(self):
+        self.assertSelectMultiple(
+            ("[rel='friend met']", ['bob']),
+            ('[rel="friend met"]', ['bob']),
+            ('[rel=me]', ['me']),
+            ('a[ rel ~= "met" ]', ['bob']),
+            ('a[href][rel]', ['bob', 'me']),
+        )
+
+    def test_nth_of_type_expressions(self):
+        for selector, strings in (
+            ('#inner > p:nth-of-type(odd)', ['Some text', 'Another']),
+            ('#inner > p:nth-of-type(2n+1)', ['Some text', 'Another']),
+            ('#inner > p:nth-of-type(even)', ['Some more text']),
+            ('#inner > p:nth-of-type(n+2)', ['Some more text', 'Another']),
+            ('#inner > p:nth-of-type(-n+2)', ['Some text', 'Some more text']),
+            ('#main > :nth-of-type(4)', ['French'])):
+            self.assertEqual(
+                [el.string for el in self.soup.select(selector)], strings)
+        self.assertRaises(ValueError, self.soup.select, 'p:nth-of-type(x)')
+        self.assertRaises(
+            NotImplementedError, self.soup.select, 'p:first-child')
+
+    def test_nth_of_type_among_many_siblings(self):
+        soup = BeautifulSoup(
+            "<ul>" + "<b>x</b>".join(
+                "<li>%d</li>" % i for i in range(2000)) + "</ul>")
+        self.assertEqual(
+            [li.string for li in soup.select('li:nth-of-type(1999)')],
+            ['1998'])
+        self.assertEqual(
+            len(soup.select('ul > li:nth-of-type(odd)')), 1000)
+        self.assertEqual(
+            [b.string for b in soup.select('li:nth-of-type(3) + b')],
+            ['x'])
+        # Positions are found afresh for each call.
+        soup.ul.li.extract()
+        self.assertEqual(
+            [li.string for li in soup.select('li:nth-of-type(1999)')],
+            ['1999'])
+
+    def test_leading_child_combinator(self):
+        inner = self.soup.find(id='inner')
+        self.assertSelectsIDs(inner.select('> h2'), ['header2', 'header3'])
+        self.assertSelectsIDs(inner.select('> span > a'), ['s1a1', 's1a2'])
+        self.assertRaises(ValueError, inner.select, '+ h2')
+
+    def test_compiled_selectors_are_cached(self):
+        from bs4.element import compile_selector
+        self.assertTrue(compile_selector('div > p.x') is compile_selector('div > p.x'))
+        self.assertTrue(compile_selector('div > p.x').matches(
+            self.soup.new_tag('p', **{'class': 'x'})) is False)
+        self.assertTrue(compile_selector('p.onep').matches(
+            self.soup.find(id='p1')))
+
+
+class TestIndexedSoupSelector(TestSoupSelector):
+    """The CSS selector tests again, on a tree with an index."""
+
+    def setUp(self):
+        self.soup = BeautifulSoup(self.HTML, indexed=True)
+
+
+class TestTreeIndex(TreeTest):
+    """Test searching a tree with an index."""
+
+    def setUp(self):
+        super(TestTreeIndex, self).setUp()
+        self.tree = self.soup("""<div id="outer" class="box wide">
+                                 <a id="a1" class="link">1</a>
+                                 <p><a id="a2">2</a><b class="link">3</b></p>
+                                 </div>
+                                 <a id="a3" class="link external">4</a>""",
+                              indexed=True)
+
+    def test_find_all_by_name(self):
+        self.assertSelectsIDs(self.tree.find_all('a'), ['a1', 'a2', 'a3'])
+        self.assertSelectsIDs(self.tree.div.find_all('a'), ['a1', 'a2'])
+        self.assertSelectsIDs(self.tree.p.find_all('a'), ['a2'])
+
+    def test_find_by_id(self):
+        self.assertEqual(self.tree.find(id='a2').string, '2')
+        self.assertEqual(self.tree.p.find(id='a1'), None)
+        self.assertEqual(self.tree.find(id='nonexistent'), None)
+
+    def test_find_all_by_class(self):
+        self.assertSelects(self.tree.find_all(class_='link'), ['1', '3', '4'])
+        self.assertSelects(self.tree.find_all('a', 'link'), ['1', '4'])
+        self.assertSelects(self.tree.find_all(class_='link', limit=2), ['1', '3'])
+        # Searches by more than one class at once don't use the index,
+        # but still work.
+        self.assertSelects(
+            self.tree.find_all(class_='link external'), ['4'])
+
+    def test_index_sees_changes_to_the_tree(self):
+        self.tree.find(id='a2').extract()
+        self.assertSelectsIDs(self.tree.find_all('a'), ['a1', 'a3'])
+
+        new_tag = self.tree.new_tag('a', id='a4')
+        self.tree.p.append(new_tag)
+        self.assertEqual(self.tree.find(id='a4'), new_tag)
+        self.assertSelectsIDs(self.tree.div.find_all('a'), ['a1', 'a4'])
+
+        self.tree.find(id='a1').replace_with(self.tree.new_tag('i'))
+        self.assertSelectsIDs(self.tree.find_all('a'), ['a4', 'a3'])
+
+        self.tree.p.unwrap()
+        self.assertSelectsIDs(self.tree.div.find_all('a'), ['a4'])
+
+    def test_index_sees_changes_to_attributes(self):
+        self.tree.find(id='a3')['id'] = 'a5'
+        self.assertEqual(self.tree.find(id='a3'), None)
+        self.assertEqual(self.tree.find(id='a5').string, '4')
+        del self.tree.div['class']
+        self.assertEqual(self.tree.find_all(class_='box'), [])
+
+    def test_reindex_after_changing_a_name(self):
+        self.tree.b.name = 'a'
+        self.tree.reindex()
+        self.assertSelects(self.tree.find_all('a'), ['1', '2', '3', '4'])
+
+    def test_moving_a_tag_between_trees(self):
+        other = self.soup("<section></section>", indexed=True)
+        self.assertEqual(other.find_all('a'), [])
+        other.section.append(self.tree.find(id='a3'))
+        self.assertSelectsIDs(other.find_all('a'), ['a3'])
+        self.assertSelectsIDs(self.tree.find_all('a'), ['a1', 'a2'])
+
+    def test_unindexed_queries(self):
+        self.assertSelects(self.tree.find_all(text='2'), ['2'])
+        self.assertSelects(self.tree.find_all(re.compile('^[ab]$')), ['1', '2', '3', '4'])
+        self.assertSelectsIDs(self.tree.select('a[href]'), [])
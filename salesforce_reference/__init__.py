@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Make the vendored libraries in lib/ (currently just bs4) importable from
+# every module in this package
+LIB_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), os.pardir, "lib"))
+if LIB_PATH not in sys.path:
+    sys.path.append(LIB_PATH)
@@ -0,0 +1,171 @@
+"""
+Build or refresh a Salesforce Reference index without Sublime Text:
+
+    python -m salesforce_reference build INDEX_PATH [options]
+    python -m salesforce_reference refresh INDEX_PATH [options]
+
+`build` retrieves every selected doc type and writes a new index. `refresh`
+retrieves the selected doc types into an existing index, keeping the entries
+of doc types that aren't selected (or that fail to retrieve). Point the
+editor at the result with the `indexPath` setting. As in the editor, a
+--doc-version or --locale is added to the index's file name (e.g.
+index-244.0-ja-jp.json), so INDEX_PATH is the same as the `indexPath`
+setting. With --search-index, the text of every page is also indexed for
+content search.
+
+The index is locked while it is being built or refreshed, so this can run
+alongside Sublime Text instances (or other runs) using the same index: they
+wait for the lock rather than retrieving the same documentation at once.
+
+Run from the root of the package, e.g. in CI or from cron, to pre-warm an
+index shared by a team.
+"""
+import argparse
+import concurrent.futures
+import sys
+import threading
+import time
+
+from .cache import SalesforceReferenceCache
+from .crawler import MemberCrawler, RateLimiter
+from .instrumentation import recorder
+from .retrieve import DEFAULT_LOCALE, LOCALES, DocTypeEnum, retrieve_doc_types
+from .search import SearchIndex, SearchIndexer, search_targets
+from .store import SharedIndex, dump_index, index_entries
+from .versions import versioned_path
+
+
+def requests_per_second(value):
+    try:
+        return RateLimiter(value).rate
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_args(argv):
+    doc_type_names = [doc_type.name.lower() for doc_type in DocTypeEnum.get_all()]
+    parser = argparse.ArgumentParser(prog="python -m salesforce_reference",
+                                     description="Build or refresh a Salesforce Reference index")
+    parser.add_argument("mode", choices=["build", "refresh"],
+                        help="build a new index, or refresh doc types in an existing one")
+    parser.add_argument("index_path",
+                        help="path of the index file to write, as in the indexPath setting; "
+                             "any --doc-version and --locale are added to the file name")
+    parser.add_argument("-d", "--doc-type", action="append", choices=doc_type_names,
+                        help="doc type to retrieve; repeat for several (default: all)")
+    parser.add_argument("--doc-version", default=None,
+                        help="Salesforce release to index, e.g. 244.0 (default: the latest)")
+    parser.add_argument("--locale", default=DEFAULT_LOCALE, choices=LOCALES,
+                        help="language of the documentation to index (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of doc types to retrieve in parallel (default: all at once)")
+    parser.add_argument("--crawl-members", action="store_true",
+                        help="also crawl class pages for member entries (see the memberCrawler setting)")
+    parser.add_argument("--crawl-state", default=None,
+                        help="where to keep member crawl progress (default: next to the index)")
+    parser.add_argument("--requests-per-second", type=requests_per_second, default=4,
+                        help="rate limit for member crawling and content indexing")
+    parser.add_argument("--search-index", default=None,
+                        help="also bring the content search index at this path up to date")
+    parser.add_argument("--search-processes", type=int, default=None,
+                        help="processes extracting page text for the search index (default: one per CPU)")
+    parser.add_argument("--timings", action="store_true",
+                        help="print a per-phase timing report when done")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    doc_types = [DocTypeEnum.get_by_name(name.upper()) for name in (args.doc_type or [])] or DocTypeEnum.get_all()
+    doc_types = [doc_type.variant(args.doc_version, args.locale) for doc_type in doc_types]
+    shared_index = SharedIndex(versioned_path(args.index_path, args.doc_version, args.locale))
+    shared_index.lock.acquire()
+    try:
+        return_code = build(args, doc_types, shared_index)
+    finally:
+        shared_index.lock.release()
+    if args.timings:
+        print("")
+        print(recorder.report())
+    return return_code
+
+
+def build(args, doc_types, shared_index):
+    """Retrieve `doc_types` and publish them to the (locked) shared index"""
+    cache = SalesforceReferenceCache()
+    cache_lock = threading.Lock()
+
+    previous = shared_index.load() if args.mode == "refresh" else None
+    if args.mode == "refresh" and previous is None:
+        print("No readable index at %s; building a new one" % shared_index.path)
+
+    started = time.time()
+    strategies = retrieve_doc_types(doc_types, cache, cache_lock, args.jobs)
+    for strategy in strategies:
+        if strategy.error:
+            print("%-16s FAILED: %s" % (strategy.doc_type, strategy.error))
+        else:
+            print("%-16s %6d entries" % (strategy.doc_type, len(cache.entries_by_doc_type.get(strategy.doc_type, []))))
+
+    if args.crawl_members:
+        rate_limiter = RateLimiter(args.requests_per_second)
+        for strategy in strategies:
+            if strategy.error or not strategy.crawl_targets:
+                continue
+            crawler = MemberCrawler(
+                cache,
+                cache_lock,
+                strategy.doc_type,
+                strategy.crawl_targets,
+                strategy.source.toc_url,
+                strategy.toc_meta,
+                args.crawl_state or "%s.members-%s.json" % (shared_index.path, strategy.doc_type.lower()),
+                rate_limiter
+            )
+            crawler.run()
+            print("%-16s %6d entries after crawling %d pages (%d failed)" % (
+                strategy.doc_type, len(cache.entries_by_doc_type.get(strategy.doc_type, [])),
+                crawler.pages_fetched, crawler.pages_failed))
+
+    # Carry over doc types that weren't retrieved (or failed) from the previous index
+    doc_type_meta = {strategy.doc_type: strategy.toc_meta for strategy in strategies if not strategy.error}
+    if previous is not None:
+        kept = [name for name in previous["doc_types"] if name not in doc_type_meta]
+        cache.extend(index_entries(previous, kept))
+        for name in kept:
+            doc_type_meta[name] = previous["doc_types"][name].get("meta")
+
+    shared_index.publish(dump_index(cache, doc_type_meta))
+    print("Wrote %d entries to %s in %.2fs (generation %d)" % (
+        len(cache), shared_index.path, time.time() - started, shared_index.generation))
+    search_failed = args.search_index and not build_search_index(args, cache, doc_type_meta)
+    return 1 if search_failed or any(strategy.error for strategy in strategies) else 0
+
+
+def build_search_index(args, cache, doc_type_meta):
+    """
+    Bring the content search index up to date with the pages in `cache`.
+    Pages are fetched on threads, and their text extracted in a process
+    pool. Returns False if any pages couldn't be indexed
+    """
+    started = time.time()
+    search_index = SearchIndex.load(args.search_index)
+    targets = {}
+    for name, entries in cache.entries_by_doc_type.items():
+        meta = doc_type_meta.get(name) or {}
+        doc_type = DocTypeEnum.get_by_name(name).variant(args.doc_version, args.locale)
+        page_targets = search_targets(name, entries, doc_type.toc_url, meta)
+        if page_targets:
+            targets[name] = (meta.get("version"), page_targets)
+    with concurrent.futures.ProcessPoolExecutor(args.search_processes) as executor:
+        indexer = SearchIndexer(search_index, args.search_index, targets,
+                                RateLimiter(args.requests_per_second), executor=executor)
+        indexer.run()
+    print("Search index: %d pages in %s in %.2fs (%d fetched, %d indexed, %d failed)" % (
+        len(search_index), args.search_index, time.time() - started,
+        indexer.pages_fetched, indexer.pages_indexed, indexer.pages_failed))
+    return indexer.pages_failed == 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
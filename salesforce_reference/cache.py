@@ -1,7 +1,33 @@
 import collections
+import collections.abc
+import sys
+import threading
+import weakref
 from functools import total_ordering
+from .instrumentation import recorder
 
-class SalesforceReferenceCache(collections.MutableSequence,collections.MutableSet):
+# Every cache shares one instance of each distinct entry, so the indexes of
+# several documentation versions (which mostly list the same pages) cost
+# little more than one. Entries are only kept here while a cache holds them
+_shared_entries = weakref.WeakValueDictionary()
+_shared_entries_lock = threading.Lock()
+
+def shared_entry(entry):
+    """
+    The canonical instance of an entry equal to `entry` in title, url and
+    doc type - `entry` itself, with its strings interned, if it is the first
+    """
+    identity = (entry.title, entry.url, entry.doc_type)
+    with _shared_entries_lock:
+        shared = _shared_entries.get(identity)
+        if shared is None:
+            entry.title = sys.intern(entry.title)
+            entry.url = sys.intern(entry.url)
+            entry.doc_type = sys.intern(entry.doc_type)
+            shared = _shared_entries[identity] = entry
+        return shared
+
+class SalesforceReferenceCache(collections.abc.MutableSequence,collections.abc.MutableSet):
     """
     A cache of SalesforceReferenceEntry objects, sorted by Title. This order
     will be maintained throughout append operations
@@ -10,7 +36,8 @@ class SalesforceReferenceCache(collections.MutableSequence,collections.MutableSe
         self.__entries = list(data)
         self.__entries_by_doc_type = {}
         self.__titles_by_doc_type = {}
-        self.__maintain_cache()
+        self.__listeners = []
+        self.__rebuild_indexes()
 
     # Properties for quick access to cached info
 
@@ -30,6 +57,15 @@ class SalesforceReferenceCache(collections.MutableSequence,collections.MutableSe
     def entries_by_doc_type(self):
         return self.__entries_by_doc_type
 
+    def add_listener(self, listener):
+        """
+        Register `listener(cache, doc_types)` to be called after the cache
+        changes, with the set of doc type names whose entries changed
+        """
+        self.__listeners.append(listener)
+    def remove_listener(self, listener):
+        self.__listeners.remove(listener)
+
     def __getitem__(self, key):
         return self.__entries[key]
     def __setitem__(self, key, item):
@@ -47,7 +83,51 @@ class SalesforceReferenceCache(collections.MutableSequence,collections.MutableSe
         if item not in self.__entries:
             self.__entries.insert(key,item)
             self.__maintain_cache()
-    def __maintain_cache(self):
+    def extend(self, items):
+        """
+        Add many entries at once, rebuilding the sorted indexes only once
+        rather than once per entry as repeated `append` calls would
+        """
+        existing = set(entry.key for entry in self.__entries)
+        changed_doc_types = set()
+        for item in items:
+            if item.key not in existing:
+                existing.add(item.key)
+                self.__entries.append(shared_entry(item))
+                changed_doc_types.add(item.doc_type)
+        if changed_doc_types:
+            self.__maintain_cache(changed_doc_types)
+    def replace_doc_types(self, items_by_doc_type):
+        """
+        Replace every entry of each doc type in `items_by_doc_type` (a dict of
+        doc type name -> entries, e.g. a newer copy loaded from disk) with the
+        given entries, rebuilding the indexes once
+        """
+        if not items_by_doc_type:
+            return
+        unique = {}
+        for items in items_by_doc_type.values():
+            for item in items:
+                if item.key not in unique:
+                    unique[item.key] = shared_entry(item)
+        self.__entries[:] = [entry for entry in self.__entries if entry.doc_type not in items_by_doc_type]
+        self.__entries.extend(unique.values())
+        self.__maintain_cache(set(items_by_doc_type))
+    def clear(self):
+        """Remove every entry, rebuilding the indexes once"""
+        if self.__entries:
+            del self.__entries[:]
+            self.__maintain_cache()
+    def __maintain_cache(self, changed_doc_types=None):
+        previous_doc_types = set(self.__entries_by_doc_type)
+        with recorder.phase("index rebuild") as record:
+            record.count = len(self.__entries)
+            self.__rebuild_indexes()
+        if changed_doc_types is None:
+            changed_doc_types = previous_doc_types | set(self.__entries_by_doc_type)
+        for listener in self.__listeners:
+            listener(self, changed_doc_types)
+    def __rebuild_indexes(self):
         self.__entries.sort()
         self.__index_entries_by_doc_type()
         self.__index_titles_by_doc_type()
@@ -94,6 +174,10 @@ class SalesforceReferenceCacheEntry(object):
         self.title = title
         self.url = url
         self.doc_type = doc_type
+    @property
+    def key(self):
+        """Case-insensitive identity of this entry, as used by __eq__"""
+        return (self.title.lower(), self.doc_type.lower())
     """required functions for use with sort() and sorted()"""
     """the total_ordering annotation supplies remaining comparison functions"""
     def __eq__(self, other):
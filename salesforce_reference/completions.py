@@ -0,0 +1,115 @@
+import bisect
+import re
+
+# Apex ToC titles end with the kind of thing they document, e.g. "String Class"
+APEX_TITLE_RE = re.compile(r"^([A-Za-z_][\w.]*) (Class|Interface|Enum|Namespace|Exception)$")
+# Apex member titles added by the crawler, e.g. "String.abbreviate(maxWidth)"
+APEX_MEMBER_TITLE_RE = re.compile(r"^([A-Za-z_]\w*)\.([A-Za-z_]\w*)\(")
+# Visualforce component titles are tag names, e.g. "apex:pageBlock"
+VISUALFORCE_TITLE_RE = re.compile(r"^(\w+):(\w+)$")
+# A namespace typed immediately before the completion prefix, e.g. "<apex:"
+NAMESPACE_BEFORE_PREFIX_RE = re.compile(r"(\w+):$")
+
+
+class Completion(object):
+    """A name to offer as a completion, with a label for its kind"""
+    def __init__(self, name, kind, namespace=None):
+        self.name = name
+        self.kind = kind
+        self.namespace = namespace
+
+    def as_completion(self, namespace_typed):
+        """
+        The [trigger, contents] pair Sublime expects. Namespaced names (i.e.
+        Visualforce tags) insert the namespace too, unless it was already
+        typed before the prefix
+        """
+        if self.namespace is None or namespace_typed:
+            contents = self.name
+        else:
+            contents = self.namespace + ":" + self.name
+        return [contents + "\t" + self.kind, contents]
+
+
+def apex_completions(entries):
+    for entry in entries:
+        match = APEX_TITLE_RE.match(entry.title)
+        if match:
+            yield Completion(match.group(1), "Apex " + match.group(2))
+            continue
+        match = APEX_MEMBER_TITLE_RE.match(entry.title)
+        if match:
+            yield Completion(match.group(2), match.group(1) + " method")
+
+
+def visualforce_completions(entries):
+    for entry in entries:
+        match = VISUALFORCE_TITLE_RE.match(entry.title)
+        if match:
+            yield Completion(match.group(2), "Visualforce", match.group(1))
+
+
+# Doc types that completions are offered for, and how to derive completions
+# from their cache entries
+EXTRACTORS = {
+    "APEX": apex_completions,
+    "VISUALFORCE": visualforce_completions,
+}
+
+
+class CompletionIndex(object):
+    """
+    A prefix index over names derived from cached ToC titles.
+
+    Each doc type has its own pair of parallel sorted arrays (lowercased
+    names, and Completion objects), so a doc type loading or refreshing only
+    rebuilds its own arrays. A query is a bisect into each requested doc
+    type's array followed by a scan of the matching run - logarithmic in the
+    index size plus linear in the number of results returned.
+    """
+    def __init__(self):
+        self.__by_doc_type = {}
+
+    def update_doc_type(self, doc_type, entries):
+        """Replace the completions for `doc_type` with ones derived from `entries`"""
+        extractor = EXTRACTORS.get(doc_type)
+        if extractor is None:
+            return
+        unique = {}
+        for completion in extractor(entries):
+            unique.setdefault((completion.name.lower(), completion.namespace or "", completion.kind), completion)
+        ordered = sorted(unique.items())
+        # Assigned as a single tuple so concurrent queries see old or new, never a mix
+        self.__by_doc_type[doc_type] = ([key[0] for key, completion in ordered],
+                                        [completion for key, completion in ordered])
+
+    def on_cache_changed(self, cache, doc_types):
+        """SalesforceReferenceCache listener keeping the index in step with the cache"""
+        for doc_type in doc_types:
+            self.update_doc_type(doc_type, cache.entries_by_doc_type.get(doc_type, []))
+
+    def complete(self, prefix, doc_types, text_before_prefix="", limit=200):
+        """
+        Completions for `prefix` from the given doc type names, as a list of
+        [trigger, contents] pairs. `text_before_prefix` is the text on the
+        line before the prefix, used to spot an already-typed namespace
+        """
+        lowered = prefix.lower()
+        match = NAMESPACE_BEFORE_PREFIX_RE.search(text_before_prefix)
+        namespace_typed = match.group(1) if match else None
+        results = []
+        for doc_type in doc_types:
+            index = self.__by_doc_type.get(doc_type)
+            if index is None:
+                continue
+            keys, completions = index
+            position = bisect.bisect_left(keys, lowered)
+            while position < len(keys) and keys[position].startswith(lowered) and len(results) < limit:
+                completion = completions[position]
+                if completion.namespace is None or namespace_typed is None or completion.namespace == namespace_typed:
+                    results.append(completion.as_completion(namespace_typed))
+                position += 1
+        return results
+
+    def __len__(self):
+        return sum(len(keys) for keys, completions in self.__by_doc_type.values())
@@ -0,0 +1,269 @@
+import http.client
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import gzip
+import zlib
+from .instrumentation import recorder
+from .progress import tracker
+
+# Errors that indicate a pooled keep-alive connection was closed by the server
+# while it sat idle. A request that fails with one of these on a reused
+# connection is retried once on a fresh connection
+STALE_CONNECTION_ERRORS = (
+    http.client.BadStatusLine,
+    http.client.CannotSendRequest,
+    http.client.ResponseNotReady,
+    ConnectionError,
+)
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+# Response bodies are read in chunks of this size, reporting each to the
+# progress tracker
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class PooledConnection(object):
+    """
+    A single http.client connection tracked by a ConnectionPool, along with
+    the time it was last returned to the pool
+    """
+    def __init__(self, key, connection, target_prefix=""):
+        self.key = key
+        self.connection = connection
+        self.target_prefix = target_prefix
+        self.last_used = time.time()
+        self.reused = False
+
+    def set_timeout(self, timeout):
+        self.connection.timeout = timeout
+        if self.connection.sock is not None:
+            self.connection.sock.settimeout(timeout)
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of persistent (keep-alive) HTTP and HTTPS connections,
+    keyed by (scheme, host, port).
+
+    Every retrieval against developer.salesforce.com goes to the same host, so
+    keeping connections open saves a TCP connect and TLS handshake per request
+    after the first. The pool holds at most `max_per_host` connections per
+    host (requests beyond that wait for a connection to be released), and
+    connections idle for longer than `idle_timeout` seconds are closed rather
+    than reused.
+
+    :param max_per_host:
+        maximum number of simultaneous connections to any one host
+    :param idle_timeout:
+        seconds after which an idle connection is discarded instead of reused
+    :param timeout:
+        socket timeout, in seconds, for new connections
+    :param ssl_context:
+        an optional ssl.SSLContext for HTTPS connections (e.g. to trust a
+        self-signed certificate on a local stub server)
+    """
+    def __init__(self, max_per_host=4, idle_timeout=30, timeout=30, ssl_context=None):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.__lock = threading.Lock()
+        self.__idle = {}
+        self.__slots = {}
+
+    def request(self, url, headers=None, method="GET", body=None, timeout=None):
+        """
+        Perform a request, following redirects, and return a tuple of
+        (status, response headers, body bytes). The body is transparently
+        decompressed if the server sent it gzip/deflate encoded. `timeout`
+        overrides the pool's socket timeout for this request.
+
+        Raises urllib.error.HTTPError for non-2xx responses, mirroring
+        urllib.request.urlopen
+        """
+        request_headers = {"Accept-Encoding": "gzip, deflate"}
+        if headers:
+            request_headers.update(headers)
+        for redirect_count in range(MAX_REDIRECTS + 1):
+            status, response_headers, data = self.__request_once(url, request_headers, method, body, timeout)
+            if status in REDIRECT_STATUSES and response_headers.get("Location"):
+                url = urllib.parse.urljoin(url, response_headers.get("Location"))
+                if status == 303:
+                    method, body = "GET", None
+                continue
+            break
+        if not 200 <= status < 300:
+            raise urllib.error.HTTPError(url, status, http.client.responses.get(status, ""), response_headers, None)
+        return status, response_headers, self.__decode_content(response_headers, data)
+
+    def fetch(self, url, headers=None, timeout=None):
+        """Convenience wrapper around `request` returning only the body bytes"""
+        return self.request(url, headers, timeout=timeout)[2]
+
+    def close_idle(self, max_idle=None):
+        """
+        Close pooled connections that have been idle for longer than
+        `max_idle` seconds (defaults to the pool's idle_timeout). Pass 0 to
+        close every idle connection
+        """
+        if max_idle is None:
+            max_idle = self.idle_timeout
+        cutoff = time.time() - max_idle
+        expired = []
+        with self.__lock:
+            for key, connections in self.__idle.items():
+                keep = [c for c in connections if c.last_used > cutoff]
+                expired.extend(c for c in connections if c.last_used <= cutoff)
+                self.__idle[key] = keep
+        for pooled in expired:
+            pooled.close()
+
+    def close_all(self):
+        """Close every idle connection. In-flight connections close on release"""
+        self.close_idle(0)
+
+    def idle_count(self, key=None):
+        with self.__lock:
+            if key is not None:
+                return len(self.__idle.get(key, []))
+            return sum(len(connections) for connections in self.__idle.values())
+
+    def __request_once(self, url, headers, method, body, timeout):
+        parsed = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(("", "", parsed.path or "/", parsed.query, ""))
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        pooled = self.__acquire(key, parsed)
+        try:
+            pooled.set_timeout(timeout or self.timeout)
+            with recorder.phase("download") as record:
+                try:
+                    response = self.__send(pooled, method, path, body, headers)
+                except STALE_CONNECTION_ERRORS:
+                    if not pooled.reused:
+                        raise
+                    # Server dropped the idle connection; retry once on a new one
+                    pooled.close()
+                    pooled = self.__connect(key, parsed)
+                    pooled.set_timeout(timeout or self.timeout)
+                    response = self.__send(pooled, method, path, body, headers)
+                data = self.__read_body(response)
+                record.count = len(data)
+            status = response.status
+            response_headers = response.msg
+            if response.will_close:
+                pooled.close()
+                pooled = None
+        except Exception:
+            pooled.close()
+            self.__release(key, None)
+            raise
+        self.__release(key, pooled)
+        return status, response_headers, data
+
+    def __read_body(self, response):
+        chunks = []
+        while True:
+            chunk = response.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+            tracker.report_bytes(len(chunk))
+
+    def __send(self, pooled, method, path, body, headers):
+        pooled.connection.request(method, pooled.target_prefix + path, body, headers)
+        return pooled.connection.getresponse()
+
+    def __acquire(self, key, parsed):
+        with self.__lock:
+            slots = self.__slots.get(key)
+            if slots is None:
+                slots = self.__slots[key] = threading.BoundedSemaphore(self.max_per_host)
+        slots.acquire()
+        cutoff = time.time() - self.idle_timeout
+        expired = []
+        pooled = None
+        with self.__lock:
+            connections = self.__idle.get(key, [])
+            while connections:
+                candidate = connections.pop()
+                if candidate.last_used > cutoff:
+                    pooled = candidate
+                    break
+                expired.append(candidate)
+        for stale in expired:
+            stale.close()
+        if pooled is not None:
+            pooled.reused = True
+            return pooled
+        try:
+            return self.__connect(key, parsed)
+        except Exception:
+            slots.release()
+            raise
+
+    def __release(self, key, pooled):
+        if pooled is not None:
+            pooled.last_used = time.time()
+            with self.__lock:
+                self.__idle.setdefault(key, []).append(pooled)
+        self.__slots[key].release()
+
+    def __connect(self, key, parsed):
+        scheme, host, port = key
+        target_prefix = ""
+        proxy = self.__proxy_for(scheme, host)
+        if scheme == "https":
+            if proxy:
+                connection = http.client.HTTPSConnection(proxy.hostname, proxy.port or 80, timeout=self.timeout, context=self.ssl_context)
+                connection.set_tunnel(host, port or 443)
+            else:
+                connection = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+        elif scheme == "http":
+            if proxy:
+                connection = http.client.HTTPConnection(proxy.hostname, proxy.port or 80, timeout=self.timeout)
+                # Plain HTTP proxies expect the absolute URL as the request target
+                target_prefix = "http://" + parsed.netloc
+            else:
+                connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        else:
+            raise ValueError("Unsupported URL scheme for ConnectionPool: %s" % scheme)
+        with recorder.phase("connect"):
+            connection.connect()
+        return PooledConnection(key, connection, target_prefix)
+
+    def __proxy_for(self, scheme, host):
+        proxy = urllib.request.getproxies().get(scheme)
+        if not proxy or urllib.request.proxy_bypass(host):
+            return None
+        if "://" not in proxy:
+            proxy = "http://" + proxy
+        return urllib.parse.urlsplit(proxy)
+
+    def __decode_content(self, headers, data):
+        encoding = (headers.get("Content-Encoding") or "").lower()
+        if encoding not in ("gzip", "deflate"):
+            return data
+        with recorder.phase("decode") as record:
+            if encoding == "gzip":
+                data = gzip.decompress(data)
+            else:
+                try:
+                    data = zlib.decompress(data)
+                except zlib.error:
+                    data = zlib.decompress(data, -zlib.MAX_WBITS)
+            record.count = len(data)
+        return data
+
+
+# Pool shared by every retrieval strategy and page fetcher in the plugin
+shared_pool = ConnectionPool()
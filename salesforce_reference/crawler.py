@@ -0,0 +1,247 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import traceback
+import urllib.parse
+from bs4 import BeautifulSoup
+from .cache import SalesforceReferenceCacheEntry
+from .instrumentation import recorder
+from .policy import shared_policy
+from .progress import tracker
+
+# Path of page content JSON, relative to the host serving the ToC. Filled in
+# with the deliverable, page, locale and version
+CONTENT_PATH = "/docs/get_document_content/%s/%s/%s/%s"
+
+# Headings of topics that group members, rather than document one
+SECTION_HEADING_RE = re.compile(r"\b(Methods|Properties|Constructors|Fields|Enum Values|Usage|Example|Examples)$")
+HEADING_TAG_RE = re.compile(r"^h[1-6]$")
+WHITESPACE_RE = re.compile(r"\s+")
+PADDED_PARENTHESES_RE = re.compile(r"(?<=\()\s+|\s+(?=\))")
+KIND_SUFFIX_RE = re.compile(r" (Class|Interface|Enum|Namespace|Exception)$")
+
+
+class RateLimiter(object):
+    """
+    A token bucket shared between threads: at most `rate` acquisitions per
+    second on average, with bursts of up to `burst`
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self.__rate
+
+    @rate.setter
+    def rate(self, rate):
+        rate = float(rate)
+        if not 0 < rate < float("inf"):
+            raise ValueError("the rate limit must be a positive number of requests per second, not %r" % rate)
+        self.__rate = rate
+
+    def acquire(self):
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+                self.__updated = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.rate
+            time.sleep(wait)
+
+
+def extract_members(html):
+    """
+    Find the member topics (methods, properties, enum values, ...) in a class
+    page's content, returning a list of (heading, anchor id) pairs.
+
+    Salesforce class pages are a tree of nested `topic` divs, each with an id
+    and a helpHead heading. The outermost topic is the class itself, and
+    topics headed e.g. "String Methods" just group the members below them
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    members = []
+    for topic in soup.find_all("div", id=True, class_="topic"):
+        if topic.find_parent("div", class_="topic") is None:
+            continue
+        heading = topic.find(HEADING_TAG_RE)
+        if heading is None:
+            continue
+        text = PADDED_PARENTHESES_RE.sub("", WHITESPACE_RE.sub(" ", heading.get_text()).strip())
+        if not text or SECTION_HEADING_RE.search(text):
+            continue
+        members.append((text, topic["id"]))
+    return members
+
+
+def member_title(class_title, heading):
+    """e.g. ("String Class", "abbreviate(maxWidth)") -> "String.abbreviate(maxWidth)" """
+    class_name = KIND_SUFFIX_RE.sub("", class_title)
+    if heading.startswith(class_name):
+        return heading
+    return class_name + "." + heading
+
+
+class MemberCrawler(threading.Thread):
+    """
+    Fetches the content of each class page listed in the ToC, and adds an
+    entry for every member found on it, deep-linked to the member's anchor.
+
+    Requests run in parallel on up to `max_concurrency` threads, and are
+    spaced by `rate_limiter` (shared by every crawler, so crawling several
+    doc types can't multiply the load on Salesforce).
+
+    Progress is saved to `state_path`, keyed by the documentation version, so
+    an interrupted crawl resumes where it left off, and a refresh against an
+    unchanged version needs no requests at all. Pages whose content is
+    unchanged across versions are not re-parsed.
+
+    :param class_entries:
+        the SalesforceReferenceCacheEntry for each class page to crawl
+    :param toc_url:
+        URL of the ToC the class pages came from
+    :param toc_meta:
+        dict with the "deliverable", "locale" and "version" of that ToC, used
+        to build page content URLs
+    """
+    # How many pages' members to add to the cache at once. Each addition
+    # re-sorts the cache, so adding page by page would be quadratic
+    INGEST_BATCH_SIZE = 50
+
+    def __init__(self, cache, cache_lock, doc_type, class_entries, toc_url, toc_meta, state_path,
+                 rate_limiter, max_concurrency=4, policy=shared_policy):
+        self.cache = cache
+        self.cache_lock = cache_lock
+        self.doc_type = doc_type
+        self.class_entries = class_entries
+        self.content_url = urllib.parse.urljoin(toc_url, CONTENT_PATH)
+        self.toc_meta = toc_meta
+        self.state_path = state_path
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max_concurrency
+        self.policy = policy
+        self.pages_fetched = 0
+        self.pages_failed = 0
+        self.progress = None
+        self.__state_lock = threading.Lock()
+        self.__pending = []
+        threading.Thread.__init__(self)
+
+    def run(self):
+        with recorder.doc_type(self.doc_type), recorder.phase("member crawl") as record:
+            try:
+                self.crawl()
+            except Exception:
+                print("SublimeSalesforceReference: member crawl for %s failed:" % self.doc_type)
+                print(traceback.format_exc())
+            record.count = self.pages_fetched
+
+    def crawl(self):
+        state = self.load_state()
+        previous_pages = state.get("pages", {})
+        same_version = state.get("version") == self.toc_meta.get("version")
+        self.state = {"version": self.toc_meta.get("version"), "pages": {}}
+
+        to_fetch = []
+        for entry in self.unique_class_entries():
+            page = entry.url.split("#")[0]
+            previous = previous_pages.get(page)
+            if previous is not None and same_version:
+                self.state["pages"][page] = previous
+                self.queue_members(entry, page, previous["members"])
+            else:
+                to_fetch.append((entry, page, previous))
+        self.flush()
+        if not to_fetch:
+            return
+
+        self.progress = tracker.start_job("%s members" % self.doc_type.title(), len(to_fetch), "pages")
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                for i, done in enumerate(concurrent.futures.as_completed(
+                        [executor.submit(self.crawl_page, *target) for target in to_fetch])):
+                    done.result()
+                    self.progress.step_done()
+                    if (i + 1) % self.INGEST_BATCH_SIZE == 0:
+                        self.flush()
+                        self.save_state()
+            self.flush()
+            self.save_state()
+        finally:
+            self.progress.finish()
+
+    def crawl_page(self, entry, page, previous):
+        url = self.content_url % (self.toc_meta["deliverable"], page, self.toc_meta["locale"], self.toc_meta["version"])
+        self.rate_limiter.acquire()
+        try:
+            with tracker.bound(self.progress):
+                content = json.loads(self.policy.fetch(url, {"User-Agent": "Mozilla/5.0"}).decode("utf-8"))["content"]
+            content_hash = hashlib.sha1(content.encode("utf-8")).hexdigest()
+            if previous is not None and previous.get("hash") == content_hash:
+                members = previous["members"]
+            else:
+                members = extract_members(content)
+        except Exception:
+            # Left out of the saved state, so the next crawl retries it. One
+            # page that can't be fetched or parsed doesn't stop the others
+            with self.__state_lock:
+                self.pages_failed += 1
+            print("SublimeSalesforceReference: could not crawl %s: %s" % (url, traceback.format_exc().splitlines()[-1]))
+            return
+        with self.__state_lock:
+            self.pages_fetched += 1
+            self.state["pages"][page] = {"hash": content_hash, "members": members}
+        self.queue_members(entry, page, members)
+
+    def unique_class_entries(self):
+        seen = set()
+        for entry in self.class_entries:
+            page = entry.url.split("#")[0]
+            if page not in seen:
+                seen.add(page)
+                yield entry
+
+    def queue_members(self, entry, page, members):
+        with self.__state_lock:
+            self.__pending.extend(
+                SalesforceReferenceCacheEntry(member_title(entry.title, heading), page + "#" + anchor, self.doc_type)
+                for heading, anchor in members
+            )
+
+    def flush(self):
+        with self.__state_lock:
+            pending, self.__pending = self.__pending, []
+        if pending:
+            with self.cache_lock:
+                self.cache.extend(pending)
+            if self.progress is not None:
+                self.progress.add_entries(len(pending))
+
+    def load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as state_file:
+                return json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_state(self):
+        with self.__state_lock:
+            serialized = json.dumps(self.state)
+        directory = os.path.dirname(self.state_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as state_file:
+            state_file.write(serialized)
+        os.replace(temp_path, self.state_path)
@@ -0,0 +1,170 @@
+import collections
+import contextlib
+import threading
+import time
+
+# Order in which phases appear in reports. Phases not listed here (if any are
+# added later) are reported after these, alphabetically
+PHASE_ORDER = [
+    "connect",
+    "download",
+    "decode",
+    "json parse",
+    "toc walk",
+    "cache ingest",
+    "index load",
+    "index rebuild",
+    "panel open",
+    "page cache load",
+    "page render",
+    "search index load",
+    "search index update",
+    "content search",
+    "member crawl",
+    "total",
+    "startup wait",
+    "time to ready",
+]
+
+
+class PhaseRecord(object):
+    """
+    A single timed phase. `count` is an optional phase-specific quantity,
+    e.g. bytes downloaded or entries ingested
+    """
+    def __init__(self, doc_type, phase, started, duration=0.0, count=None):
+        self.doc_type = doc_type
+        self.phase = phase
+        self.started = started
+        self.duration = duration
+        self.count = count
+
+    def __str__(self):
+        text = "%s/%s: %.1fms" % (self.doc_type or "-", self.phase, self.duration * 1000)
+        if self.count is not None:
+            text += " (%s)" % self.count
+        return text
+    def __repr__(self):
+        return str(self)
+
+
+class Instrumentation(object):
+    """
+    Lightweight timing/counter instrumentation for retrieval phases.
+
+    Records are retained in a ring buffer of `capacity` entries, so memory use
+    is bounded no matter how long Sublime stays open. The doc type a phase is
+    attributed to is tracked per thread (see `doc_type`), so low level code
+    like the connection pool and the cache can time phases without knowing
+    which strategy invoked it.
+    """
+    def __init__(self, capacity=500):
+        self.log_to_console = False
+        self.__records = collections.deque(maxlen=capacity)
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    @property
+    def current_doc_type(self):
+        return getattr(self.__local, "doc_type", None)
+
+    @contextlib.contextmanager
+    def doc_type(self, name):
+        """Attribute all phases timed on this thread within the block to `name`"""
+        previous = self.current_doc_type
+        self.__local.doc_type = name
+        try:
+            yield
+        finally:
+            self.__local.doc_type = previous
+
+    @contextlib.contextmanager
+    def phase(self, name, doc_type=None):
+        """
+        Time the enclosed block as phase `name`. Yields the PhaseRecord, so the
+        block can set `record.count`. The record is kept even if the block
+        raises, so failed phases still show up in reports
+        """
+        record = PhaseRecord(doc_type or self.current_doc_type, name, time.time())
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.duration = time.perf_counter() - start
+            self.add(record)
+
+    def record(self, name, duration, count=None, doc_type=None):
+        """Record an already-measured phase"""
+        self.add(PhaseRecord(doc_type or self.current_doc_type, name, time.time() - duration, duration, count))
+
+    def add(self, record):
+        with self.__lock:
+            self.__records.append(record)
+        if self.log_to_console:
+            print("SublimeSalesforceReference: [perf] " + str(record))
+
+    def records(self):
+        with self.__lock:
+            return list(self.__records)
+
+    def clear(self):
+        with self.__lock:
+            self.__records.clear()
+
+    def summary(self):
+        """
+        Aggregate retained records by (doc_type, phase), returning a dict of
+        (doc_type, phase) -> {"n", "total", "max", "last", "count"}
+        """
+        aggregated = collections.OrderedDict()
+        for record in self.records():
+            stats = aggregated.setdefault((record.doc_type or "-", record.phase),
+                                          {"n": 0, "total": 0.0, "max": 0.0, "last": 0.0, "count": 0})
+            stats["n"] += 1
+            stats["total"] += record.duration
+            stats["max"] = max(stats["max"], record.duration)
+            stats["last"] = record.duration
+            if record.count is not None:
+                stats["count"] += record.count
+        return aggregated
+
+    def report(self):
+        """A human readable, fixed-width report of the aggregated records"""
+        summary = self.summary()
+        if not summary:
+            return "No retrieval activity has been recorded yet.\n"
+        def sort_key(key):
+            doc_type, phase = key
+            phase_rank = PHASE_ORDER.index(phase) if phase in PHASE_ORDER else len(PHASE_ORDER)
+            return (doc_type, phase_rank, phase)
+        lines = [
+            "%-16s %-14s %6s %11s %11s %11s %11s %12s" %
+                ("Doc Type", "Phase", "Runs", "Last (ms)", "Mean (ms)", "Max (ms)", "Total (ms)", "Count"),
+            "-" * 99,
+        ]
+        previous_doc_type = None
+        for key in sorted(summary, key=sort_key):
+            doc_type, phase = key
+            stats = summary[key]
+            if previous_doc_type is not None and doc_type != previous_doc_type:
+                lines.append("")
+            previous_doc_type = doc_type
+            lines.append("%-16s %-14s %6d %11.1f %11.1f %11.1f %11.1f %12s" % (
+                doc_type,
+                phase,
+                stats["n"],
+                stats["last"] * 1000,
+                stats["total"] / stats["n"] * 1000,
+                stats["max"] * 1000,
+                stats["total"] * 1000,
+                stats["count"] or "",
+            ))
+        records = self.records()
+        lines.append("")
+        lines.append("%d records retained (oldest from %s)" % (
+            len(records), time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(records[0].started))))
+        return "\n".join(lines) + "\n"
+
+
+# Recorder shared by the whole plugin
+recorder = Instrumentation()
@@ -0,0 +1,276 @@
+import collections
+import hashlib
+import html
+import json
+import os
+import re
+import threading
+import urllib.parse
+from bs4 import BeautifulSoup, NavigableString
+from bs4.element import PreformattedString
+from .crawler import CONTENT_PATH
+from .instrumentation import recorder
+from .policy import shared_policy
+
+# Bump whenever render_page's output changes, so pages rendered by an older
+# version are rendered again (from their cached content, without fetching)
+RENDERER_VERSION = 2
+
+# Tags Sublime Text's minihtml can show, which are kept as they are (less
+# their attributes, other than links' href)
+KEPT_TAGS = set(["a", "b", "br", "code", "div", "em", "h1", "h2", "h3", "h4", "h5", "h6",
+                 "i", "li", "ol", "p", "pre", "span", "strong", "u", "ul"])
+# Tags minihtml can't show, replaced by the nearest tag it can
+RENAMED_TAGS = {"dl": "div", "dt": "b", "dd": "div", "table": "div", "tr": "div",
+                "th": "b", "td": "span", "tt": "code", "samp": "code", "var": "i",
+                "cite": "i", "kbd": "code", "blockquote": "div", "section": "div",
+                "article": "div", "header": "div", "footer": "div", "figure": "div",
+                "figcaption": "i", "caption": "b"}
+# Tags dropped along with everything in them
+DROPPED_TAGS = ["script", "style", "noscript", "iframe", "form", "button", "input",
+                "select", "textarea", "svg", "img", "object", "embed", "head", "title"]
+# Tags that never have content, though html.parser nests whatever follows
+# them inside them
+VOID_TAGS = ["area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+             "param", "source", "track", "wbr"]
+WHITESPACE_RE = re.compile(r"\s+")
+HREF_RE = re.compile(r'<a href="([^"]*)"')
+
+
+def render_page(page, fragment=""):
+    """
+    Reduce a page's content to the subset of HTML that Sublime Text's minihtml
+    can show: headings, paragraphs, lists, code and links, without scripts,
+    images, styling or attributes. Tables become one line per row. Links are
+    left as they are in the page, usually relative (see absolute_links).
+
+    :param fragment:
+        the id of the element to render, for an entry linking to part of a
+        page (e.g. a method); the whole page if empty or not found
+    """
+    soup = BeautifulSoup(page, "html.parser")
+    root = soup
+    if fragment:
+        root = soup.find(id=fragment) or soup
+    for tag in root.find_all(VOID_TAGS):
+        while tag.contents:
+            tag.insert_after(tag.contents[-1].extract())
+    for tag in root.find_all(DROPPED_TAGS):
+        tag.decompose()
+    # Comments, the doctype, CDATA sections and processing instructions
+    # aren't content, and would be shown as text once unwrapped
+    for text in root.find_all(text=lambda text: isinstance(text, PreformattedString)):
+        text.extract()
+    tags = root.find_all(True)
+    if root is not soup:
+        # The fragment's own element is shown as a div, whatever it was
+        root.name = "div"
+        root.attrs = {}
+    for tag in tags:
+        name = RENAMED_TAGS.get(tag.name, tag.name)
+        if name not in KEPT_TAGS:
+            tag.unwrap()
+            continue
+        if tag.name in ("td", "th") and tag.next_sibling is not None:
+            # Table cells, which would otherwise run together
+            tag.append(NavigableString(" "))
+        href = tag.get("href") if name == "a" else None
+        tag.name = name
+        tag.attrs = {}
+        if href and not href.startswith("javascript:"):
+            tag["href"] = href
+    # minihtml collapses whitespace much as a browser does, but costs less to
+    # lay out without it
+    for text in root.find_all(text=True):
+        if type(text) is NavigableString and text.find_parent("pre") is None:
+            text.replace_with(WHITESPACE_RE.sub(" ", text))
+    return root.decode()
+
+
+def absolute_links(rendered, page_url):
+    """
+    `rendered` (from render_page) with its links made absolute against
+    `page_url`, the page's URL in the documentation. Rendered pages are
+    cached with their links relative, so one rendering serves every
+    documentation version with the same content
+    """
+    return HREF_RE.sub(lambda match: '<a href="%s"' % html.escape(
+        urllib.parse.urljoin(page_url, html.unescape(match.group(1)))), rendered)
+
+
+def command_links(page_html):
+    """
+    `page_html` with its links (absolute, see absolute_links) turned into
+    subl: links that run Sublime Text's open_url command. An HTML sheet,
+    unlike a phantom, has no handler of its own for following links
+    """
+    return HREF_RE.sub(lambda match: '<a href="%s"' % html.escape(
+        "subl:open_url " + json.dumps({"url": html.unescape(match.group(1))})), page_html)
+
+
+class PageCache(object):
+    """
+    Rendered documentation pages, so reopening a page costs neither a
+    request nor a parse.
+
+    The most recently used `max_pages` rendered pages are kept in memory.
+    Every page is also kept in `directory`, in two parts: which content each
+    page URL last had (by hash), and each distinct content both raw and
+    rendered. A page whose content is unchanged in a new documentation
+    version (a new URL) is fetched, but not rendered again. The least
+    recently used content is removed once the directory holds more than
+    `max_disk_bytes`.
+
+    Without a `directory`, pages are only cached in memory.
+    """
+    def __init__(self, directory=None, max_pages=50, max_disk_bytes=50 * 1024 * 1024):
+        self.directory = directory
+        self.max_pages = max_pages
+        self.max_disk_bytes = max_disk_bytes
+        self.__memory = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, url, fragment=""):
+        """The rendered page at `url` (and `fragment`), or None if it isn't cached"""
+        key = (url, fragment)
+        with self.__lock:
+            rendered = self.__memory.get(key)
+            if rendered is not None:
+                self.__memory.move_to_end(key)
+                return rendered
+        with recorder.phase("page cache load"):
+            record = self.__read(self.__url_path(url))
+            if record is None:
+                return None
+            content_hash = record.get("hash")
+            content = self.__read(self.__content_path(content_hash))
+            if content is None:
+                return None
+            rendered = self.__rendered(fragment, content_hash, content)
+        self.__remember(key, rendered)
+        return rendered
+
+    def put(self, url, raw, fragment=""):
+        """Cache `raw`, the content of the page at `url`, returning it rendered"""
+        content_hash = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        content = self.__read(self.__content_path(content_hash)) or {"raw": raw}
+        rendered = self.__rendered(fragment, content_hash, content)
+        self.__write(self.__url_path(url), {"url": url, "hash": content_hash})
+        self.__remember((url, fragment), rendered)
+        self.prune(keep=(self.__url_path(url), self.__content_path(content_hash)))
+        return rendered
+
+    def content(self, url):
+        """The raw content of the page at `url`, if it's cached on disk, otherwise None"""
+        record = self.__read(self.__url_path(url))
+        if record is None:
+            return None
+        content = self.__read(self.__content_path(record.get("hash")))
+        return content.get("raw") if content is not None else None
+
+    def clear(self):
+        with self.__lock:
+            self.__memory.clear()
+
+    def prune(self, keep=()):
+        """
+        Remove the least recently used pages on disk (other than the files in
+        `keep`) until within max_disk_bytes
+        """
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            if path in keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def __rendered(self, fragment, content_hash, content):
+        # Render the content if it hasn't been yet for this fragment, or was
+        # rendered by an older renderer, saving the result
+        rendered = content.get("rendered") if content.get("renderer") == RENDERER_VERSION else None
+        rendered = dict(rendered or {})
+        if fragment not in rendered:
+            with recorder.phase("page render") as record:
+                record.count = len(content["raw"])
+                rendered[fragment] = render_page(content["raw"], fragment)
+            self.__write(self.__content_path(content_hash),
+                         {"renderer": RENDERER_VERSION, "raw": content["raw"], "rendered": rendered})
+        return rendered[fragment]
+
+    def __remember(self, key, rendered):
+        with self.__lock:
+            self.__memory[key] = rendered
+            self.__memory.move_to_end(key)
+            while len(self.__memory) > self.max_pages:
+                self.__memory.popitem(last=False)
+
+    def __url_path(self, url):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, "url-%s.json" % hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+    def __content_path(self, content_hash):
+        if self.directory is None or not content_hash:
+            return None
+        return os.path.join(self.directory, "content-%s.json" % content_hash)
+
+    def __read(self, path):
+        if path is None:
+            return None
+        try:
+            with open(path, encoding="utf-8") as cached_file:
+                record = json.load(cached_file)
+            # Reading a page counts as using it, for pruning
+            os.utime(path, None)
+            return record
+        except (IOError, OSError, ValueError):
+            return None
+
+    def __write(self, path, record):
+        if path is None:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        temp_path = "%s.%d.tmp" % (path, threading.get_ident())
+        with open(temp_path, "w", encoding="utf-8") as cached_file:
+            json.dump(record, cached_file)
+        os.replace(temp_path, path)
+
+
+def content_url(toc_url, toc_meta, page):
+    """
+    URL of the content of `page` (an entry's URL, without any #fragment), in
+    the documentation a ToC came from, or None if the ToC's metadata doesn't
+    say where that is
+    """
+    if not toc_meta or not all(toc_meta.get(key) for key in ("deliverable", "locale", "version")):
+        return None
+    return urllib.parse.urljoin(toc_url, CONTENT_PATH) % (
+        toc_meta["deliverable"], page, toc_meta["locale"], toc_meta["version"])
+
+
+def load_page(cache, url, fragment="", policy=shared_policy):
+    """
+    The rendered page at content URL `url` (see content_url), from `cache`
+    if it's there, otherwise fetched, rendered and added to the cache
+    """
+    rendered = cache.get(url, fragment)
+    if rendered is not None:
+        return rendered
+    raw = json.loads(policy.fetch(url, {"User-Agent": "Mozilla/5.0"}).decode("utf-8"))["content"]
+    return cache.put(url, raw, fragment)
@@ -0,0 +1,151 @@
+import http.client
+import random
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+from .connection import shared_pool
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request to a host whose circuit is open"""
+    def __init__(self, host, retry_in):
+        Exception.__init__(self,
+            "Not contacting %s: too many recent failures. Will try again in %ds" % (host, retry_in))
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker(object):
+    """
+    Per-host circuit breaker. After `failure_threshold` consecutive failures
+    against a host the circuit opens, and requests to that host fail
+    immediately with CircuitOpenError for `reset_timeout` seconds. After that
+    a single trial request is let through (half-open): success closes the
+    circuit, failure re-opens it for another `reset_timeout`
+    """
+    def __init__(self, failure_threshold=3, reset_timeout=60, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.__lock = threading.Lock()
+        self.__failures = {}
+        self.__opened_at = {}
+        self.__trial_in_progress = set()
+
+    def before_request(self, host):
+        """Raise CircuitOpenError if requests to `host` should not be made"""
+        with self.__lock:
+            opened_at = self.__opened_at.get(host)
+            if opened_at is None:
+                return
+            elapsed = self.clock() - opened_at
+            if elapsed < self.reset_timeout or host in self.__trial_in_progress:
+                raise CircuitOpenError(host, max(1, int(self.reset_timeout - elapsed)))
+            self.__trial_in_progress.add(host)
+
+    def record_success(self, host):
+        with self.__lock:
+            self.__failures.pop(host, None)
+            self.__opened_at.pop(host, None)
+            self.__trial_in_progress.discard(host)
+
+    def record_failure(self, host):
+        with self.__lock:
+            failures = self.__failures.get(host, 0) + 1
+            self.__failures[host] = failures
+            if failures >= self.failure_threshold or host in self.__trial_in_progress:
+                self.__opened_at[host] = self.clock()
+            self.__trial_in_progress.discard(host)
+
+    def record_neutral(self, host):
+        """
+        Record an answer that says nothing about the host's health (e.g. a
+        404): ends a half-open trial, but leaves the failure count alone
+        """
+        with self.__lock:
+            self.__trial_in_progress.discard(host)
+
+    def is_open(self, host):
+        with self.__lock:
+            opened_at = self.__opened_at.get(host)
+            return opened_at is not None and self.clock() - opened_at < self.reset_timeout
+
+
+class RetryPolicy(object):
+    """
+    Bounded retries with full-jitter exponential backoff: attempt n (from 0)
+    waits a random time between 0 and min(max_delay, base_delay * 2^n)
+
+    :param max_attempts:
+        total attempts, including the first
+    :param timeout:
+        socket timeout, in seconds, applied to each attempt
+    """
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8, timeout=20):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def is_retryable(self, error):
+        """
+        Server errors, rate limiting and network failures are worth retrying;
+        other HTTP errors (e.g. a 404 for a moved document) and TLS failures
+        such as a certificate that doesn't verify are not
+        """
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code >= 500 or error.code == 429
+        if isinstance(error, urllib.error.URLError):
+            error = error.reason
+        if isinstance(error, ssl.SSLError):
+            return False
+        return isinstance(error, (
+            socket.timeout,
+            socket.gaierror,
+            ConnectionError,
+            http.client.HTTPException,
+        ))
+
+
+class RetrievalPolicy(object):
+    """
+    Fetches URLs through a ConnectionPool, applying a RetryPolicy and a
+    CircuitBreaker. Errors that survive the retries are raised to the caller
+    """
+    def __init__(self, pool, retry=None, breaker=None, sleep=time.sleep):
+        self.pool = pool
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.sleep = sleep
+
+    def fetch(self, url, headers=None):
+        host = urllib.parse.urlsplit(url).hostname
+        attempt = 0
+        while True:
+            self.breaker.before_request(host)
+            try:
+                data = self.pool.fetch(url, headers, timeout=self.retry.timeout)
+            except Exception as e:
+                # Only failures that say something about the host's health
+                # count towards opening the circuit
+                if self.retry.is_retryable(e):
+                    self.breaker.record_failure(host)
+                else:
+                    self.breaker.record_neutral(host)
+                attempt += 1
+                if attempt >= self.retry.max_attempts or not self.retry.is_retryable(e) or self.breaker.is_open(host):
+                    raise
+                self.sleep(self.retry.delay(attempt - 1))
+                continue
+            self.breaker.record_success(host)
+            return data
+
+
+# Policy shared by every retrieval strategy and page fetcher in the plugin
+shared_policy = RetrievalPolicy(shared_pool)
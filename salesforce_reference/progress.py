@@ -0,0 +1,193 @@
+import contextlib
+import threading
+
+
+class ProgressJob(object):
+    """
+    One unit of background work shown in the status bar, e.g. retrieving a
+    set of doc types. Work in progress pushes what it has done - steps
+    completed out of `total` (counted in `unit`s), bytes downloaded and
+    entries added - and the tracker redraws only when something changes.
+    """
+    def __init__(self, tracker, label, total=0, unit="doc types", done_message=""):
+        self.tracker = tracker
+        self.label = label
+        self.total = total
+        self.unit = unit
+        self.done_message = done_message
+        self.done = 0
+        self.bytes = 0
+        self.entries = 0
+        self.finished = False
+
+    def add_bytes(self, count):
+        self.tracker.update(self, "bytes", count)
+
+    def add_entries(self, count):
+        self.tracker.update(self, "entries", count)
+
+    def step_done(self, count=1):
+        self.tracker.update(self, "done", count)
+
+    def finish(self):
+        self.tracker.finish(self)
+
+
+class ProgressTracker(object):
+    """
+    Shows the progress of every running ProgressJob in one status bar
+    indicator.
+
+    Nothing polls: an update marks the indicator dirty and, unless a redraw is
+    already scheduled, schedules one `coalesce_ms` later, so a burst of
+    updates (say, every chunk of a download) costs one redraw. While jobs
+    are running but quiet, the indicator is redrawn every `keepalive_ms` so
+    the status message doesn't time out; once the last job finishes, nothing
+    is scheduled at all.
+
+    `show(text)` and `schedule(callback, delay_ms)` are supplied by the
+    editor (sublime.status_message and sublime.set_timeout). Until they are,
+    jobs still count progress but nothing is displayed, as when running from
+    the command line.
+
+    The job a thread is working for can be bound to the thread (see `bound`),
+    so low level code like the connection pool can report progress without
+    knowing which job it is working for.
+    """
+    INDICATOR_SIZE = 8
+
+    def __init__(self, coalesce_ms=100, keepalive_ms=2000):
+        self.coalesce_ms = coalesce_ms
+        self.keepalive_ms = keepalive_ms
+        self.show = None
+        self.schedule = None
+        self.__jobs = []
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__redraw_scheduled = False
+        self.__keepalive_token = 0
+        self.__frame = 0
+
+    def start_job(self, label, total=0, unit="doc types", done_message=""):
+        job = ProgressJob(self, label, total, unit, done_message)
+        with self.__lock:
+            self.__jobs.append(job)
+        self.changed()
+        return job
+
+    @property
+    def jobs(self):
+        with self.__lock:
+            return list(self.__jobs)
+
+    @property
+    def current_job(self):
+        return getattr(self.__local, "job", None)
+
+    @contextlib.contextmanager
+    def bound(self, job):
+        """Report progress made on this thread within the block to `job` (which may be None)"""
+        previous = self.current_job
+        self.__local.job = job
+        try:
+            yield
+        finally:
+            self.__local.job = previous
+
+    def report_bytes(self, count):
+        job = self.current_job
+        if job is not None:
+            job.add_bytes(count)
+
+    def report_entries(self, count):
+        job = self.current_job
+        if job is not None:
+            job.add_entries(count)
+
+    def update(self, job, field, count):
+        with self.__lock:
+            setattr(job, field, getattr(job, field) + count)
+        self.changed()
+
+    def finish(self, job):
+        with self.__lock:
+            if job.finished:
+                return
+            job.finished = True
+        self.changed()
+
+    def changed(self):
+        if self.schedule is None:
+            return
+        with self.__lock:
+            if self.__redraw_scheduled:
+                return
+            self.__redraw_scheduled = True
+        self.schedule(self.redraw, self.coalesce_ms)
+
+    def redraw(self):
+        with self.__lock:
+            self.__redraw_scheduled = False
+            finished = [job for job in self.__jobs if job.finished]
+            self.__jobs = [job for job in self.__jobs if not job.finished]
+            running = list(self.__jobs)
+            self.__keepalive_token += 1
+            token = self.__keepalive_token
+            self.__frame += 1
+            text = self.status_text(running, self.__frame) if running else None
+        if self.show is None:
+            return
+        if text is None:
+            self.show(finished[-1].done_message if finished else "")
+            return
+        self.show(text)
+        self.schedule(lambda: self.keepalive(token), self.keepalive_ms)
+
+    def keepalive(self, token):
+        with self.__lock:
+            if token != self.__keepalive_token or self.__redraw_scheduled:
+                return
+            self.__redraw_scheduled = True
+        self.redraw()
+
+    @classmethod
+    def status_text(cls, jobs, frame):
+        """
+        One line summarising `jobs`, e.g.
+        "Salesforce Reference [ =      ] Apex, Visualforce: 1/2 doc types, 1.3 MiB, 850 entries"
+        """
+        # The indicator bounces along with each redraw, so it only moves
+        # while progress is actually being made
+        position = frame % (2 * (cls.INDICATOR_SIZE - 1))
+        if position >= cls.INDICATOR_SIZE:
+            position = 2 * (cls.INDICATOR_SIZE - 1) - position
+        indicator = "[%s=%s]" % (" " * position, " " * (cls.INDICATOR_SIZE - 1 - position))
+
+        steps = {}
+        for job in jobs:
+            done, total = steps.get(job.unit, (0, 0))
+            steps[job.unit] = (done + job.done, total + job.total)
+        details = ["%d/%d %s" % (done, total, unit) for unit, (done, total) in sorted(steps.items()) if total]
+        downloaded = sum(job.bytes for job in jobs)
+        if downloaded:
+            details.append(format_bytes(downloaded))
+        entries = sum(job.entries for job in jobs)
+        if entries:
+            details.append("%d entries" % entries)
+
+        text = "Salesforce Reference %s %s" % (indicator, ", ".join(job.label for job in jobs))
+        if details:
+            text += ": " + ", ".join(details)
+        return text
+
+
+def format_bytes(count):
+    if count < 1024:
+        return "%d B" % count
+    if count < 1024 * 1024:
+        return "%.0f KiB" % (count / 1024.0)
+    return "%.1f MiB" % (count / (1024.0 * 1024.0))
+
+
+# Tracker shared by the whole plugin
+tracker = ProgressTracker()
@@ -1,7 +1,11 @@
 import threading
-import urllib.request
 import re
+import time
+import concurrent.futures
 from .cache import SalesforceReferenceCacheEntry
+from .policy import shared_policy, CircuitOpenError
+from .instrumentation import recorder
+from .progress import tracker
 # Import BeautifulSoup (scraping library) and html.parser
 #  - Necessary, because as at 2015-06-02 Salesforce no longer uses an XML file
 #    for generating Table of Contents, so we have to scrape a ToC out of the
@@ -13,9 +17,8 @@ from .cache import SalesforceReferenceCacheEntry
 #    supports)
 #  - NB: bs4 was rebuilt (using 2to3) for Python3; we'd need to include a
 #    Python2 build if we ever support ST2
+#  - NB: lib/ is added to sys.path in salesforce_reference/__init__.py
 import sys, traceback
-import os
-sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.path.normpath("lib")))
 from bs4 import BeautifulSoup
 import json
 import html.parser
@@ -25,7 +28,8 @@ class DocRetrievalStrategy(threading.Thread):
         """
         :param window:
             An instance of :class:`sublime.Window` that represents the Sublime
-            Text window to show the available package list in.
+            Text window to show the available package list in, or None when
+            running outside Sublime Text. Strategies must not depend on it
         :cache
             an instance of SalesforceReferenceCache
         :cache_lock
@@ -38,6 +42,16 @@ class DocRetrievalStrategy(threading.Thread):
         self.cache = cache
         self.cache_lock = cache_lock
         self.done_callback = done_callback
+        self.error = None
+        # Set by strategies whose pages can be crawled for member entries (see
+        # salesforce_reference.crawler), once the ToC has been retrieved
+        self.toc_meta = None
+        self.crawl_targets = None
+        # ProgressJob that downloads and ingestion are reported to, if any
+        self.progress = None
+        # The DocType to retrieve, when it differs from the strategy's own
+        # (e.g. one pinned to a documentation version)
+        self.source = None
         threading.Thread.__init__(self)
 
     @property
@@ -56,18 +70,60 @@ class DocRetrievalStrategy(threading.Thread):
                 "of required documentation, and cache population "
             )
 
+    def retrieve_toc_json(self, doc_type):
+        """
+        Download and parse the JSON ToC for the given DocType (or `source`, if
+        set) over the shared keep-alive connection pool, retrying transient
+        failures
+        """
+        doc_type = self.source or doc_type
+        raw_document = shared_policy.fetch(doc_type.toc_url, {"User-Agent": "Mozilla/5.0"})
+        with recorder.phase("decode"):
+            sf_document = raw_document.decode("utf-8")
+        with recorder.phase("json parse"):
+            sf_json = json.loads(sf_document)
+        self.toc_meta = {
+            "deliverable": sf_json.get("deliverable"),
+            "locale": sf_json.get("language", {}).get("locale"),
+            "version": sf_json.get("version", {}).get("doc_version"),
+            # When this copy of the ToC was retrieved, to tell when it's due
+            # a refresh
+            "retrieved": time.time(),
+        }
+        return sf_json
+
+    def ingest(self, entries):
+        """Add a batch of SalesforceReferenceCacheEntry objects to the cache"""
+        with recorder.phase("cache ingest") as record:
+            record.count = len(entries)
+            with self.cache_lock:
+                self.cache.extend(entries)
+        tracker.report_entries(len(entries))
+
     def logRetrievalException(self):
+        """
+        Log the exception being handled, and record it in `self.error`.
+        Nothing is added to the cache, so the doc type is retried the next
+        time it is requested
+        """
+        self.error = sys.exc_info()[1]
         print("######### Sublime Salesforce Reference Error #########")
+        if isinstance(self.error, CircuitOpenError):
+            print("Skipped retrieving %s doc: %s" % (self.doc_type, self.error))
+            return
         print("Fatal error in Sublime Salesforce Reference while retrieving doc. Please report this on https://github.com/Oblongmana/sublime-salesforce-reference/issues. Error info follows:")
         print(traceback.format_exc())
-        with self.cache_lock:
-            self.cache.append(
-                SalesforceReferenceCacheEntry(
-                    'Error retrieving doc. Press Cmd/Ctrl+` for details, and report the error on github',
-                    '',
-                    self.doc_type
-                )
-            )
+
+    def error_entry(self):
+        """
+        A placeholder entry describing `self.error`, for display in the quick
+        panel only - it must never be added to the cache
+        """
+        return SalesforceReferenceCacheEntry(
+            'Error retrieving %s doc. Press Cmd/Ctrl+` for details, and report the error on github' % self.doc_type.lower(),
+            '',
+            self.doc_type
+        )
 
 class ApexDocJsonTocBasedStrategy(DocRetrievalStrategy):
     def __init__(self, window, cache, cache_lock, done_callback):
@@ -78,23 +134,27 @@ class ApexDocJsonTocBasedStrategy(DocRetrievalStrategy):
         return DocTypeEnum.APEX.name
 
     def run(self):
-        try:
-            sf_document = urllib.request.urlopen(urllib.request.Request(DocTypeEnum.APEX.toc_url,None,{"User-Agent": "Mozilla/5.0"})).read().decode("utf-8")
-            sf_json = json.loads(sf_document)
-            sf_toc = sf_json["toc"]
-            dev_guide_toc = next(filter(lambda x: "id" in x and x["id"] == "apex_dev_guide", sf_toc))
-            reference_toc = filter(lambda x: "id" in x and x["id"] == "apex_reference", dev_guide_toc["children"])
-            for toc_entry in getAllTocLeafParents(next(reference_toc),None):
-                with self.cache_lock:
-                    self.cache.append(
+        with recorder.doc_type(self.doc_type), tracker.bound(self.progress), recorder.phase("total"):
+            try:
+                sf_json = self.retrieve_toc_json(DocTypeEnum.APEX)
+                with recorder.phase("toc walk") as record:
+                    sf_toc = sf_json["toc"]
+                    dev_guide_toc = next(filter(lambda x: "id" in x and x["id"] == "apex_dev_guide", sf_toc))
+                    reference_toc = filter(lambda x: "id" in x and x["id"] == "apex_reference", dev_guide_toc["children"])
+                    entries = [
                         SalesforceReferenceCacheEntry(
                             toc_entry["text"],
                             toc_entry["a_attr"]["href"],
                             DocTypeEnum.APEX.name
                         )
-                    )
-        except Exception as e:
-            self.logRetrievalException();
+                        for toc_entry in getAllTocLeafParents(next(reference_toc),None)
+                    ]
+                    record.count = len(entries)
+                self.ingest(entries)
+                # Each leaf parent is a class (or interface, etc.) page
+                self.crawl_targets = entries
+            except Exception as e:
+                self.logRetrievalException();
 
         self.done_callback()
 
@@ -107,23 +167,25 @@ class VisualforceDocJsonTocBasedStrategy(DocRetrievalStrategy):
         return DocTypeEnum.VISUALFORCE.name
 
     def run(self):
-        try:
-            # TODO: basically a replica of Apex, but with diff DocTypeEnum and "id" being searched for. Could use DRYing
-            sf_document = urllib.request.urlopen(urllib.request.Request(DocTypeEnum.VISUALFORCE.toc_url,None,{"User-Agent": "Mozilla/5.0"})).read().decode("utf-8")
-            sf_json = json.loads(sf_document)
-            sf_toc = sf_json["toc"]
-            reference_toc = filter(lambda x: "id" in x and x["id"] == "pages_compref", sf_toc)
-            for toc_entry in getAllTocLeaves(next(reference_toc)):
-                with self.cache_lock:
-                    self.cache.append(
+        with recorder.doc_type(self.doc_type), tracker.bound(self.progress), recorder.phase("total"):
+            try:
+                # TODO: basically a replica of Apex, but with diff DocTypeEnum and "id" being searched for. Could use DRYing
+                sf_json = self.retrieve_toc_json(DocTypeEnum.VISUALFORCE)
+                with recorder.phase("toc walk") as record:
+                    sf_toc = sf_json["toc"]
+                    reference_toc = filter(lambda x: "id" in x and x["id"] == "pages_compref", sf_toc)
+                    entries = [
                         SalesforceReferenceCacheEntry(
                             toc_entry["text"],
                             toc_entry["a_attr"]["href"],
                             DocTypeEnum.VISUALFORCE.name
                         )
-                    )
-        except Exception as e:
-            self.logRetrievalException();
+                        for toc_entry in getAllTocLeaves(next(reference_toc))
+                    ]
+                    record.count = len(entries)
+                self.ingest(entries)
+            except Exception as e:
+                self.logRetrievalException();
 
         self.done_callback()
 
@@ -136,23 +198,25 @@ class ServiceConsoleDocJsonTocBasedStrategy(DocRetrievalStrategy):
         return DocTypeEnum.SERVICECONSOLE.name
 
     def run(self):
-        try:
-            # TODO: has similarities to Apex/VF, but with diff DocTypeEnum, "text" being searched for (whereas others search on "id"), and the fact there are multiple "root" nodes for the ToC (one for each "Methods for" section). Could use DRYing maybe? Possibly not
-            sf_document = urllib.request.urlopen(urllib.request.Request(DocTypeEnum.SERVICECONSOLE.toc_url,None,{"User-Agent": "Mozilla/5.0"})).read().decode("utf-8")
-            sf_json = json.loads(sf_document)
-            sf_toc = sf_json["toc"]
-            for methods_toc in filter(lambda x: "id" in x and x["text"].startswith("Methods for"), sf_toc):
-                for toc_entry in getAllTocLeaves(methods_toc):
-                    with self.cache_lock:
-                        self.cache.append(
-                            SalesforceReferenceCacheEntry(
-                                toc_entry["text"],
-                                toc_entry["a_attr"]["href"],
-                                DocTypeEnum.SERVICECONSOLE.name
-                            )
+        with recorder.doc_type(self.doc_type), tracker.bound(self.progress), recorder.phase("total"):
+            try:
+                # TODO: has similarities to Apex/VF, but with diff DocTypeEnum, "text" being searched for (whereas others search on "id"), and the fact there are multiple "root" nodes for the ToC (one for each "Methods for" section). Could use DRYing maybe? Possibly not
+                sf_json = self.retrieve_toc_json(DocTypeEnum.SERVICECONSOLE)
+                with recorder.phase("toc walk") as record:
+                    sf_toc = sf_json["toc"]
+                    entries = [
+                        SalesforceReferenceCacheEntry(
+                            toc_entry["text"],
+                            toc_entry["a_attr"]["href"],
+                            DocTypeEnum.SERVICECONSOLE.name
                         )
-        except Exception as e:
-            self.logRetrievalException();
+                        for methods_toc in filter(lambda x: "id" in x and x["text"].startswith("Methods for"), sf_toc)
+                        for toc_entry in getAllTocLeaves(methods_toc)
+                    ]
+                    record.count = len(entries)
+                self.ingest(entries)
+            except Exception as e:
+                self.logRetrievalException();
 
         self.done_callback()
 
@@ -172,16 +236,73 @@ def getAllTocLeaves(toc):
     except KeyError:
         yield toc
 
+def create_strategy(doc_type, window, cache, cache_lock, done_callback):
+    """An instance of `doc_type`'s preferred strategy, set up to retrieve `doc_type` itself"""
+    strategy = doc_type.preferred_strategy(window, cache, cache_lock, done_callback)
+    strategy.source = doc_type
+    return strategy
+
+def retrieve_doc_types(doc_types, cache, cache_lock, max_parallel=None):
+    """
+    Run the preferred strategy for each of `doc_types` (DocType instances),
+    without needing Sublime Text, running at most `max_parallel` at once.
+    Returns the strategies, whose `error` attribute is set for any that failed
+    """
+    strategies = [create_strategy(doc_type, None, cache, cache_lock, lambda: None) for doc_type in doc_types]
+    if strategies:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel or len(strategies)) as executor:
+            list(executor.map(lambda strategy: strategy.run(), strategies))
+    return strategies
+
+# The atlas id in documentation URLs: a locale, then for a specific release
+# its version, e.g. "atlas.en-us.apexcode.meta" for the latest English
+# documentation, or "atlas.ja-jp.244.0.apexcode.meta"
+ATLAS_RE = re.compile(r"/atlas\.[a-z]{2}-[a-z]{2}\.(?:\d+\.\d+\.)?")
+
+DEFAULT_LOCALE = "en-us"
+# Locales Salesforce publishes developer documentation in
+LOCALES = ["en-us", "ja-jp", "de-de", "fr-fr", "es-mx", "it-it", "ko-kr", "pt-br", "zh-cn", "zh-tw"]
+
 class DocType:
-    def __init__(self, name, doc_base_url, toc_url, preferred_strategy):
+    def __init__(self, name, doc_base_url, toc_url, preferred_strategy, version=None, locale=DEFAULT_LOCALE):
         self.__name = name
         self.__doc_base_url = doc_base_url
         self.__toc_url = toc_url
         self.__preferred_strategy = preferred_strategy
+        self.__version = version
+        self.__locale = locale
+    def for_version(self, version):
+        """
+        This doc type, pinned to a documentation release (e.g. "244.0", as it
+        appears in versioned documentation URLs), or the latest release if
+        `version` is None
+        """
+        return self.variant(version, self.__locale)
+    def for_locale(self, locale):
+        """This doc type, in the given locale (e.g. "ja-jp")"""
+        return self.variant(self.__version, locale)
+    def variant(self, version, locale):
+        if version == self.__version and locale == self.__locale:
+            return self
+        atlas = "/atlas.%s.%s" % (locale, version + "." if version else "")
+        return DocType(
+            self.__name,
+            ATLAS_RE.sub(lambda match: atlas, self.__doc_base_url, count=1),
+            ATLAS_RE.sub(lambda match: atlas, self.__toc_url, count=1),
+            self.__preferred_strategy,
+            version,
+            locale
+        )
     @property
     def name(self):
         return self.__name
     @property
+    def version(self):
+        return self.__version
+    @property
+    def locale(self):
+        return self.__locale
+    @property
     def doc_base_url(self):
         return self.__doc_base_url
     @property
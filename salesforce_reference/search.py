@@ -0,0 +1,496 @@
+import array
+import concurrent.futures
+import hashlib
+import json
+import math
+import os
+import re
+import struct
+import threading
+import traceback
+import zlib
+from bs4 import BeautifulSoup
+from .instrumentation import recorder
+from .pages import DROPPED_TAGS, content_url
+from .policy import shared_policy
+from .progress import tracker
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Score added per query term found in a page's title, times the term's idf
+TITLE_WEIGHT = 2.0
+# Score multiplier for pages containing the query as a phrase
+PHRASE_BOOST = 1.5
+# Characters of page text shown around the match in a snippet
+SNIPPET_BEFORE = 50
+SNIPPET_AFTER = 110
+
+INDEX_MAGIC = b"SFRS"
+INDEX_FORMAT = 1
+
+
+def tokenize(text):
+    """Lower cased words of `text`, in order"""
+    return [match.group().lower() for match in TOKEN_RE.finditer(text)]
+
+
+def extract_text(page):
+    """
+    The readable text of a page's content, without scripts and the like, and
+    with whitespace collapsed. A module level function so it can run in a
+    process pool
+    """
+    soup = BeautifulSoup(page, "html.parser")
+    for tag in soup.find_all(DROPPED_TAGS):
+        tag.decompose()
+    return WHITESPACE_RE.sub(" ", soup.get_text(" ")).strip()
+
+
+def snippet(text, position):
+    """The part of `text` around its `position`th token, for showing a match"""
+    start = 0
+    for i, match in enumerate(TOKEN_RE.finditer(text)):
+        if i == position:
+            start = match.start()
+            break
+    begin = max(0, start - SNIPPET_BEFORE)
+    end = min(len(text), start + SNIPPET_AFTER)
+    # Don't cut words in half
+    if begin > 0:
+        space = text.find(" ", begin, start)
+        begin = space + 1 if space != -1 else begin
+    if end < len(text):
+        space = text.rfind(" ", start, end)
+        end = space if space > start else end
+    return ("..." if begin > 0 else "") + text[begin:end] + ("..." if end < len(text) else "")
+
+
+class SearchDocument(object):
+    """A page in a SearchIndex"""
+    __slots__ = ("doc_type", "page", "title", "title_tokens", "hash", "text", "length")
+
+    def __init__(self, doc_type, page, title, content_hash, text, length):
+        self.doc_type = doc_type
+        self.page = page
+        self.hash = content_hash
+        self.text = text
+        self.length = length
+        self.retitle(title)
+
+    def retitle(self, title):
+        self.title = title
+        self.title_tokens = frozenset(tokenize(title))
+
+
+class SearchResult(object):
+    """A page matching a search, with its score and a snippet of the match"""
+    def __init__(self, doc_type, page, title, score, snippet):
+        self.doc_type = doc_type
+        self.page = page
+        self.title = title
+        self.score = score
+        self.snippet = snippet
+
+    def __repr__(self):
+        return str({"doc_type": self.doc_type, "page": self.page, "title": self.title, "score": self.score})
+
+
+class SearchIndex(object):
+    """
+    An inverted index of page text: for each word, the pages containing it
+    and the positions of the word in each, for ranking (BM25, plus a boost
+    for matches in the title or of the whole query as a phrase) and for
+    finding a snippet to show.
+
+    Pages are added and removed one at a time, touching only the postings of
+    their own words, so the index can be kept up to date as pages change
+    rather than rebuilt. `doc_type_versions` records the documentation
+    version each doc type's pages were last indexed from (see SearchIndexer).
+
+    On disk, postings are delta and varint encoded, then compressed (see
+    `save`).
+    """
+    def __init__(self):
+        self.doc_type_versions = {}
+        self.__documents = {}
+        self.__ids = {}
+        self.__postings = {}
+        self.__next_id = 0
+        self.__total_length = 0
+        self.__lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.__documents)
+
+    def document(self, doc_type, page):
+        with self.__lock:
+            doc_id = self.__ids.get((doc_type, page))
+            return self.__documents[doc_id] if doc_id is not None else None
+
+    def pages(self, doc_type):
+        """The pages of `doc_type` in the index"""
+        with self.__lock:
+            return set(page for indexed_doc_type, page in self.__ids if indexed_doc_type == doc_type)
+
+    def add(self, doc_type, page, title, text, content_hash=None):
+        """
+        Index (or re-index) a page. Returns False, without re-indexing, if the
+        page is already indexed with the same content hash
+        """
+        if content_hash is None:
+            content_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        with self.__lock:
+            existing = self.document(doc_type, page)
+            if existing is not None and existing.hash == content_hash:
+                existing.retitle(title)
+                return False
+        tokens = tokenize(text)
+        positions = {}
+        for position, token in enumerate(tokens):
+            positions.setdefault(token, array.array("I")).append(position)
+        with self.__lock:
+            self.remove(doc_type, page)
+            doc_id = self.__next_id
+            self.__next_id += 1
+            self.__documents[doc_id] = SearchDocument(doc_type, page, title, content_hash, text, len(tokens))
+            self.__ids[(doc_type, page)] = doc_id
+            self.__total_length += len(tokens)
+            for token, token_positions in positions.items():
+                self.__postings.setdefault(token, {})[doc_id] = token_positions
+        return True
+
+    def remove(self, doc_type, page):
+        with self.__lock:
+            doc_id = self.__ids.pop((doc_type, page), None)
+            if doc_id is None:
+                return
+            document = self.__documents.pop(doc_id)
+            self.__total_length -= document.length
+            for token in set(tokenize(document.text)):
+                postings = self.__postings.get(token)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self.__postings[token]
+
+    def search(self, query, limit=50, doc_types=None):
+        """
+        The `limit` best matching pages for `query`, best first, as
+        SearchResults. Pages containing every word of the query are ranked
+        first; if there are none, pages containing any of them.
+
+        :param doc_types:
+            if given, only pages of these doc types are searched
+        """
+        with recorder.phase("content search") as record, self.__lock:
+            terms = []
+            postings = []
+            matching = []
+            for token in tokenize(query):
+                term_postings = self.__postings.get(token)
+                if term_postings is None or token in terms:
+                    continue
+                doc_ids = set(term_postings)
+                if doc_types is not None:
+                    doc_ids = set(doc_id for doc_id in doc_ids if self.__documents[doc_id].doc_type in doc_types)
+                if doc_ids:
+                    terms.append(token)
+                    postings.append(term_postings)
+                    matching.append(doc_ids)
+            if not terms:
+                return []
+            candidates = set.intersection(*matching) or set.union(*matching)
+
+            count = len(self.__documents)
+            average_length = float(self.__total_length) / count if count else 1.0
+            idfs = [math.log(1 + (count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+                    for term_postings in postings]
+            scored = []
+            for doc_id in candidates:
+                document = self.__documents[doc_id]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * document.length / average_length)
+                score = 0.0
+                for term, term_postings, idf in zip(terms, postings, idfs):
+                    positions = term_postings.get(doc_id)
+                    if positions is not None:
+                        frequency = len(positions)
+                        score += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+                    if term in document.title_tokens:
+                        score += TITLE_WEIGHT * idf
+                phrase_at = self.__phrase_position(doc_id, postings)
+                if phrase_at is not None:
+                    score *= PHRASE_BOOST
+                scored.append((score, doc_id, phrase_at))
+            scored.sort(key=lambda scored_doc: (-scored_doc[0], self.__documents[scored_doc[1]].title))
+
+            results = []
+            for score, doc_id, phrase_at in scored[:limit]:
+                document = self.__documents[doc_id]
+                position = phrase_at
+                if position is None:
+                    # Show the first occurrence of the rarest term on the page
+                    found = [(idf, term_postings[doc_id][0]) for term_postings, idf in zip(postings, idfs)
+                             if doc_id in term_postings]
+                    position = max(found)[1]
+                results.append(SearchResult(document.doc_type, document.page, document.title, score,
+                                            snippet(document.text, position)))
+            record.count = len(results)
+            return results
+
+    def __phrase_position(self, doc_id, postings):
+        # Position of the first occurrence of the query terms in order, or None
+        if len(postings) < 2 or not all(doc_id in term_postings for term_postings in postings):
+            return None
+        following = [set(term_postings[doc_id]) for term_postings in postings[1:]]
+        for start in postings[0][doc_id]:
+            if all(start + offset + 1 in positions for offset, positions in enumerate(following)):
+                return start
+        return None
+
+    def save(self, path):
+        """
+        Write the index to `path`, atomically. The file is INDEX_MAGIC, then
+        the format and the lengths of two zlib compressed sections: the pages
+        (as JSON), and the postings. Postings are, for each term, the term,
+        then for each page containing it the page's id (as the difference
+        from the previous page's), the number of positions, and each position
+        (as the difference from the previous one), all as varints
+        """
+        with self.__lock:
+            ids = sorted(self.__documents)
+            renumbered = dict((doc_id, new_id) for new_id, doc_id in enumerate(ids))
+            documents = [self.__documents[doc_id] for doc_id in ids]
+            header = json.dumps({
+                "doc_type_versions": self.doc_type_versions,
+                "documents": [[document.doc_type, document.page, document.title, document.hash, document.text]
+                              for document in documents],
+            }).encode("utf-8")
+            encoded = bytearray()
+            for term in sorted(self.__postings):
+                term_bytes = term.encode("utf-8")
+                write_varint(encoded, len(term_bytes))
+                encoded.extend(term_bytes)
+                term_postings = self.__postings[term]
+                write_varint(encoded, len(term_postings))
+                previous_id = 0
+                for new_id, positions in sorted((renumbered[doc_id], positions)
+                                                for doc_id, positions in term_postings.items()):
+                    write_varint(encoded, new_id - previous_id)
+                    previous_id = new_id
+                    write_varint(encoded, len(positions))
+                    previous_position = 0
+                    for position in positions:
+                        write_varint(encoded, position - previous_position)
+                        previous_position = position
+        header = zlib.compress(header)
+        encoded = zlib.compress(bytes(encoded))
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = "%s.%d.tmp" % (path, threading.get_ident())
+        with open(temp_path, "wb") as index_file:
+            index_file.write(INDEX_MAGIC + struct.pack(">BII", INDEX_FORMAT, len(header), len(encoded)))
+            index_file.write(header)
+            index_file.write(encoded)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """The index saved at `path`, or an empty one if there isn't a readable one there"""
+        index = cls()
+        try:
+            with open(path, "rb") as index_file:
+                data = index_file.read()
+        except (IOError, OSError):
+            return index
+        prefix_length = len(INDEX_MAGIC) + struct.calcsize(">BII")
+        if data[:len(INDEX_MAGIC)] != INDEX_MAGIC or len(data) < prefix_length:
+            return index
+        index_format, header_length, postings_length = struct.unpack(">BII", data[len(INDEX_MAGIC):prefix_length])
+        if index_format != INDEX_FORMAT:
+            return index
+        with recorder.phase("search index load") as record:
+            try:
+                header = json.loads(zlib.decompress(data[prefix_length:prefix_length + header_length]).decode("utf-8"))
+                encoded = zlib.decompress(data[prefix_length + header_length:prefix_length + header_length + postings_length])
+                index.__load(header, encoded)
+            except (zlib.error, ValueError, IndexError, KeyError, TypeError):
+                return cls()
+            record.count = len(index)
+        return index
+
+    def __load(self, header, encoded):
+        self.doc_type_versions = header.get("doc_type_versions", {})
+        for doc_id, (doc_type, page, title, content_hash, text) in enumerate(header["documents"]):
+            self.__documents[doc_id] = SearchDocument(doc_type, page, title, content_hash, text, 0)
+            self.__ids[(doc_type, page)] = doc_id
+        self.__next_id = len(self.__documents)
+        offset = 0
+        while offset < len(encoded):
+            term_length, offset = read_varint(encoded, offset)
+            term = encoded[offset:offset + term_length].decode("utf-8")
+            offset += term_length
+            page_count, offset = read_varint(encoded, offset)
+            term_postings = self.__postings[term] = {}
+            doc_id = 0
+            for i in range(page_count):
+                delta, offset = read_varint(encoded, offset)
+                doc_id += delta
+                position_count, offset = read_varint(encoded, offset)
+                positions = term_postings[doc_id] = array.array("I")
+                position = 0
+                for j in range(position_count):
+                    delta, offset = read_varint(encoded, offset)
+                    position += delta
+                    positions.append(position)
+                self.__documents[doc_id].length += position_count
+        self.__total_length = sum(document.length for document in self.__documents.values())
+
+
+def write_varint(buffer, number):
+    while number >= 0x80:
+        buffer.append((number & 0x7f) | 0x80)
+        number >>= 7
+    buffer.append(number)
+
+
+def read_varint(data, offset):
+    number = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+def search_targets(doc_type, entries, toc_url, toc_meta):
+    """
+    The pages of `entries` (a doc type's cache entries) to index, as a list
+    of (doc type, page, title, content URL): one per page, titled by the
+    entry for the page itself rather than for a member on it. Empty if the
+    ToC's metadata doesn't say where page content is
+    """
+    titles = {}
+    for entry in entries:
+        page, _, fragment = entry.url.partition("#")
+        if page and (page not in titles or not fragment):
+            titles[page] = entry.title
+    targets = []
+    for page, title in sorted(titles.items()):
+        page_content_url = content_url(toc_url, toc_meta, page)
+        if page_content_url is None:
+            return []
+        targets.append((doc_type, page, title, page_content_url))
+    return targets
+
+
+class SearchIndexer(threading.Thread):
+    """
+    Brings a SearchIndex up to date with the pages of one or more doc types,
+    saving it to `index_path` as it goes.
+
+    The index is updated incrementally: pages no longer listed are removed,
+    and pages already indexed from the same documentation version aren't
+    fetched at all. Other pages are fetched (or read from `page_cache`, if
+    they've been viewed) and only re-indexed if their content has changed.
+
+    Requests are spaced by `rate_limiter`, like the member crawler's. Text is
+    extracted on the fetching threads, or in `executor` (e.g. a process
+    pool) if one is given.
+
+    :param targets:
+        dict of doc type name -> (documentation version, list of targets from
+        search_targets)
+    """
+    SAVE_EVERY = 50
+
+    def __init__(self, index, index_path, targets, rate_limiter, max_concurrency=4,
+                 policy=shared_policy, page_cache=None, executor=None):
+        self.index = index
+        self.index_path = index_path
+        self.targets = targets
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max_concurrency
+        self.policy = policy
+        self.page_cache = page_cache
+        self.executor = executor
+        self.pages_fetched = 0
+        self.pages_indexed = 0
+        self.pages_failed = 0
+        self.progress = None
+        self.__lock = threading.Lock()
+        self.__failed_doc_types = set()
+        threading.Thread.__init__(self)
+
+    def run(self):
+        with recorder.phase("search index update") as record:
+            try:
+                self.update()
+            except Exception:
+                print("SublimeSalesforceReference: search index update failed:")
+                print(traceback.format_exc())
+            record.count = self.pages_indexed
+
+    def update(self):
+        to_fetch = []
+        for doc_type, (version, targets) in sorted(self.targets.items()):
+            listed = set(page for target_doc_type, page, title, page_content_url in targets)
+            for page in self.index.pages(doc_type) - listed:
+                self.index.remove(doc_type, page)
+            same_version = version is not None and self.index.doc_type_versions.get(doc_type) == version
+            for target in targets:
+                if not (same_version and self.index.document(target[0], target[1]) is not None):
+                    to_fetch.append(target)
+        if to_fetch:
+            self.progress = tracker.start_job("Search index", len(to_fetch), "pages")
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                    for i, done in enumerate(concurrent.futures.as_completed(
+                            [executor.submit(self.index_page, *target) for target in to_fetch])):
+                        done.result()
+                        self.progress.step_done()
+                        if (i + 1) % self.SAVE_EVERY == 0:
+                            self.index.save(self.index_path)
+            finally:
+                self.progress.finish()
+        for doc_type, (version, targets) in self.targets.items():
+            if doc_type not in self.__failed_doc_types:
+                self.index.doc_type_versions[doc_type] = version
+        self.index.save(self.index_path)
+
+    def index_page(self, doc_type, page, title, page_content_url):
+        try:
+            raw = self.page_cache.content(page_content_url) if self.page_cache is not None else None
+            if raw is None:
+                self.rate_limiter.acquire()
+                with tracker.bound(self.progress):
+                    raw = json.loads(self.policy.fetch(page_content_url, {"User-Agent": "Mozilla/5.0"}).decode("utf-8"))["content"]
+                with self.__lock:
+                    self.pages_fetched += 1
+            content_hash = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+            existing = self.index.document(doc_type, page)
+            if existing is not None and existing.hash == content_hash:
+                with self.__lock:
+                    existing.retitle(title)
+                return
+            if self.executor is not None:
+                text = self.executor.submit(extract_text, raw).result()
+            else:
+                text = extract_text(raw)
+            self.index.add(doc_type, page, title, text, content_hash)
+            with self.__lock:
+                self.pages_indexed += 1
+        except Exception:
+            # The doc type's version isn't recorded, so the next update retries it
+            with self.__lock:
+                self.pages_failed += 1
+                self.__failed_doc_types.add(doc_type)
+            print("SublimeSalesforceReference: could not index %s: %s" % (
+                page_content_url, traceback.format_exc().splitlines()[-1]))
@@ -0,0 +1,92 @@
+import threading
+import time
+import traceback
+from .instrumentation import recorder
+
+
+class StartupScheduler(threading.Thread):
+    """
+    Warms the cache after Sublime Text starts, without competing with the
+    editor's own startup work.
+
+    `prepare()` runs first, straight away (it should only do local work,
+    e.g. loading an index from disk), and returns the doc types still to be
+    retrieved. Each of those is then passed to `retrieve(doc_type)` one at a
+    time, but only once the editor has been idle (see `activity`) for
+    `idle_delay` seconds, and at least `spacing` seconds after the previous
+    retrieval finished. `start_now` (e.g. on first use of a command) drops
+    the waits for whatever is left.
+
+    Time-to-ready is recorded with the instrumentation recorder: "startup
+    wait" for the time spent deferring, and "time to ready" per doc type and
+    overall, measured from when the scheduler was created.
+    """
+    def __init__(self, prepare, retrieve, idle_delay=3.0, spacing=2.0, clock=time.monotonic):
+        self.prepare = prepare
+        self.retrieve = retrieve
+        self.idle_delay = idle_delay
+        self.spacing = spacing
+        self.clock = clock
+        self.created = clock()
+        self.ready = None
+        self.__last_activity = self.created
+        self.__last_retrieval = None
+        self.__urgent = False
+        self.__cancelled = False
+        self.__wakeup = threading.Condition()
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    def activity(self):
+        """The editor is in use: restart the idle countdown. Cheap enough to call on every keystroke"""
+        self.__last_activity = self.clock()
+
+    def start_now(self):
+        """Stop deferring: retrieve whatever is left without waiting"""
+        with self.__wakeup:
+            self.__urgent = True
+            self.__wakeup.notify()
+
+    def cancel(self):
+        """Give up on whatever hasn't been retrieved yet"""
+        with self.__wakeup:
+            self.__cancelled = True
+            self.__wakeup.notify()
+
+    @property
+    def pending(self):
+        return self.is_alive() and self.ready is None
+
+    def run(self):
+        try:
+            doc_types = self.prepare()
+            waited = 0.0
+            for doc_type in doc_types:
+                waited += self.wait_until_idle()
+                if self.__cancelled:
+                    return
+                self.retrieve(doc_type)
+                self.__last_retrieval = self.clock()
+                recorder.record("time to ready", self.__last_retrieval - self.created, doc_type=doc_type.name)
+            self.ready = self.clock()
+            recorder.record("startup wait", waited, count=len(doc_types))
+            recorder.record("time to ready", self.ready - self.created, count=len(doc_types))
+            print("SublimeSalesforceReference: Startup caching finished %.1fs after loading "
+                  "(%.1fs of it waiting for the editor to be idle)" % (self.ready - self.created, waited))
+        except Exception:
+            print("SublimeSalesforceReference: startup caching failed:")
+            print(traceback.format_exc())
+
+    def wait_until_idle(self):
+        """Block until the next retrieval may start, returning how long that took"""
+        started = self.clock()
+        with self.__wakeup:
+            while not (self.__urgent or self.__cancelled):
+                now = self.clock()
+                remaining = self.__last_activity + self.idle_delay - now
+                if self.__last_retrieval is not None:
+                    remaining = max(remaining, self.__last_retrieval + self.spacing - now)
+                if remaining <= 0:
+                    break
+                self.__wakeup.wait(remaining)
+        return self.clock() - started
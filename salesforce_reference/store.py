@@ -0,0 +1,245 @@
+import json
+import os
+import threading
+import time
+from .cache import SalesforceReferenceCacheEntry
+from .instrumentation import recorder
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Bump when the layout of the index file changes incompatibly
+INDEX_FORMAT = 2
+
+# An index file is two lines: a small JSON header, then the JSON body. The
+# header lets readers check the generation without parsing the body
+
+
+def dump_index(cache, doc_type_meta=None):
+    """
+    Serializable form of the cache: entries grouped by doc type, with any
+    metadata known about each doc type's ToC (e.g. its documentation version)
+
+    :param doc_type_meta:
+        dict of doc type name -> dict of metadata, as in
+        DocRetrievalStrategy.toc_meta. Doc types with metadata but no entries
+        (retrieved, but empty) are included, with no entries
+    """
+    doc_type_meta = doc_type_meta or {}
+    entries_by_doc_type = cache.entries_by_doc_type
+    return {
+        "doc_types": {
+            doc_type: {
+                "meta": doc_type_meta.get(doc_type) or {},
+                "entries": [[entry.title, entry.url] for entry in entries_by_doc_type.get(doc_type, [])],
+            }
+            for doc_type in set(entries_by_doc_type) | set(doc_type_meta)
+        },
+    }
+
+
+def write_index(path, index, generation=1):
+    """
+    Write a dumped index to `path`. The file is written alongside and renamed
+    into place, so readers never see a partially written index
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    header = {"format": INDEX_FORMAT, "generation": generation, "generated": time.time()}
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, "w", encoding="utf-8") as index_file:
+        index_file.write(json.dumps(header) + "\n")
+        json.dump(index, index_file, separators=(",", ":"))
+    os.replace(temp_path, path)
+
+
+def read_index_header(path):
+    """The header of the index at `path`, or None if it is missing or an unknown format"""
+    try:
+        with open(path, encoding="utf-8") as index_file:
+            header = json.loads(index_file.readline())
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(header, dict) or header.get("format") != INDEX_FORMAT:
+        return None
+    return header
+
+
+def read_index(path):
+    """
+    The index stored at `path`, or None if it is missing, unreadable or an
+    unknown format. The header is available as the index's "header" key
+    """
+    try:
+        with open(path, encoding="utf-8") as index_file:
+            header = json.loads(index_file.readline())
+            if not isinstance(header, dict) or header.get("format") != INDEX_FORMAT:
+                return None
+            index = json.loads(index_file.read())
+    except (IOError, OSError, ValueError):
+        return None
+    index["header"] = header
+    return index
+
+
+def index_entries(index, doc_types=None):
+    """SalesforceReferenceCacheEntry objects for the (given) doc types in a read index"""
+    entries = []
+    for doc_type, stored in index.get("doc_types", {}).items():
+        if doc_types is None or doc_type in doc_types:
+            entries.extend(SalesforceReferenceCacheEntry(title, url, doc_type) for title, url in stored["entries"])
+    return entries
+
+
+class IndexLock(object):
+    """
+    An advisory, cross-process lock on an index file, held on a `.lock` file
+    next to it. Only processes that write the index take the lock; readers
+    never need it, because the index is replaced with an atomic rename.
+
+    The lock is held by one thread at a time: threads of the same process
+    take turns for it before locking the file, and only the thread holding
+    it can release it.
+    """
+    def __init__(self, index_path):
+        self.path = index_path + ".lock"
+        self.__file = None
+        self.__owner = None
+        self.__thread_lock = threading.Lock()
+
+    @property
+    def held(self):
+        """Whether the calling thread holds the lock"""
+        return self.__owner == threading.get_ident()
+
+    def acquire(self, timeout=None):
+        """
+        Try to take the lock, waiting up to `timeout` seconds (forever if
+        None, not at all if 0). Returns whether the lock was taken
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        if not self.__thread_lock.acquire(timeout=-1 if timeout is None else max(timeout, 0)):
+            return False
+        try:
+            lock_file = self.__lock_file(deadline)
+        except BaseException:
+            self.__thread_lock.release()
+            raise
+        if lock_file is None:
+            self.__thread_lock.release()
+            return False
+        self.__file = lock_file
+        self.__owner = threading.get_ident()
+        return True
+
+    def release(self):
+        """Release the lock, if the calling thread holds it"""
+        if not self.held:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.__file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.__file.seek(0)
+                msvcrt.locking(self.__file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.__file.close()
+            self.__file = None
+            self.__owner = None
+            self.__thread_lock.release()
+
+    def __lock_file(self, deadline):
+        # The lock file, locked against other processes, or None if that
+        # couldn't be done by `deadline`
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        lock_file = open(self.path, "a+")
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                return lock_file
+            except (IOError, OSError):
+                if deadline is not None and time.time() >= deadline:
+                    lock_file.close()
+                    return None
+                time.sleep(0.05)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SharedIndex(object):
+    """
+    An index file shared by several processes (Sublime Text instances, plugin
+    reloads, the command line builder), of which at most one refreshes it at
+    a time.
+
+    Each publish bumps the generation in the file's header. A reader checks
+    for a new generation with a stat() and, only if the file has changed on
+    disk, by reading the one-line header - the body is parsed only when the
+    generation is new.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = IndexLock(path)
+        self.generation = None
+        self.__stat_key = None
+
+    def __current_stat_key(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def changed(self):
+        """Whether the file holds a generation other than the one last loaded"""
+        stat_key = self.__current_stat_key()
+        if stat_key is None or stat_key == self.__stat_key:
+            return False
+        header = read_index_header(self.path)
+        if header is None:
+            return False
+        if header.get("generation") == self.generation:
+            self.__stat_key = stat_key
+            return False
+        return True
+
+    def load(self):
+        """Read the index, recording its generation as loaded. None if unreadable"""
+        stat_key = self.__current_stat_key()
+        with recorder.phase("index load") as record:
+            index = read_index(self.path)
+            if index is not None:
+                record.count = sum(len(stored["entries"]) for stored in index["doc_types"].values())
+        if index is None:
+            return None
+        self.generation = index["header"].get("generation")
+        self.__stat_key = stat_key
+        return index
+
+    def publish(self, index):
+        """
+        Write `index` as the next generation. The calling thread must hold
+        `lock`, so two writers can't both read generation N and publish N + 1
+        """
+        if not self.lock.held:
+            raise RuntimeError("SharedIndex.publish requires the index lock to be held")
+        header = read_index_header(self.path)
+        generation = (header.get("generation") or 0) + 1 if header else 1
+        write_index(self.path, index, generation)
+        self.generation = generation
+        self.__stat_key = self.__current_stat_key()
@@ -0,0 +1,148 @@
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+# Uses count half as much for every HALF_LIFE seconds that have passed since
+HALF_LIFE = 14 * 24 * 60 * 60
+
+
+class UsageStats(object):
+    """
+    Persisted frequency/recency ("frecency") statistics for opened pages, and
+    a ranking of those pages kept up to date incrementally.
+
+    Each use of a page at time t adds 2^(t / HALF_LIFE) to the page's score.
+    Because every score grows against the same clock, comparing two scores
+    gives the same answer as comparing their decayed values at any later
+    time - so recording a use only ever moves the page that was used, and the
+    ranking never needs re-sorting. Scores are stored as log2 values to keep
+    them in floating point range.
+
+    :param max_entries:
+        the number of pages tracked; the lowest ranked pages are forgotten
+        beyond this
+    """
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self.path = None
+        self.__lock = threading.Lock()
+        self.__scores = {}
+        self.__counts = {}
+        # Keys ordered best first, and their negated scores (ascending) for bisect
+        self.__ranking = []
+        self.__negated_scores = []
+
+    @staticmethod
+    def key_for(entry):
+        return entry.doc_type + " " + entry.url
+
+    @property
+    def ranking(self):
+        """Keys of every tracked page, best first"""
+        return list(self.__ranking)
+
+    def count(self, entry):
+        return self.__counts.get(self.key_for(entry), 0)
+
+    def record(self, entry, when=None):
+        """Record a use of `entry`, moving it to its new place in the ranking"""
+        key = self.key_for(entry)
+        use_score = (when if when is not None else time.time()) / HALF_LIFE
+        with self.__lock:
+            old_score = self.__scores.get(key)
+            if old_score is None:
+                new_score = use_score
+            else:
+                self.__remove_from_ranking(key, old_score)
+                new_score = self.__log2_add(old_score, use_score)
+            self.__scores[key] = new_score
+            self.__counts[key] = self.__counts.get(key, 0) + 1
+            self.__insert_into_ranking(key, new_score)
+            while len(self.__ranking) > self.max_entries:
+                forgotten = self.__ranking.pop()
+                self.__negated_scores.pop()
+                del self.__scores[forgotten]
+                del self.__counts[forgotten]
+
+    def rank(self, entries):
+        """
+        Return `entries` (already in alphabetical order) with tracked pages
+        moved to the front, best first. This is a single pass over `entries`
+        plus a walk of the precomputed ranking - nothing is sorted
+        """
+        with self.__lock:
+            scores = self.__scores
+            used = {}
+            unused = []
+            for entry in entries:
+                key = self.key_for(entry)
+                if key in scores:
+                    used[key] = entry
+                else:
+                    unused.append(entry)
+            if not used:
+                return unused
+            return [used[key] for key in self.__ranking if key in used] + unused
+
+    def load(self, path):
+        """Load statistics from `path` (if it exists), and save to it from now on"""
+        self.path = path
+        try:
+            with open(path, encoding="utf-8") as stats_file:
+                stored = json.load(stats_file)
+        except (IOError, OSError, ValueError):
+            return
+        # A file of the wrong shape (edited by hand, or from another version)
+        # is ignored as a missing one would be
+        scores = {}
+        counts = {}
+        try:
+            for key, (score, count) in stored.get("pages", {}).items():
+                scores[str(key)] = float(score)
+                counts[str(key)] = int(count)
+        except (AttributeError, TypeError, ValueError):
+            scores = {}
+            counts = {}
+        with self.__lock:
+            self.__scores = scores
+            self.__counts = counts
+            self.__ranking = []
+            self.__negated_scores = []
+            for key in sorted(self.__scores, key=lambda key: -self.__scores[key]):
+                self.__ranking.append(key)
+                self.__negated_scores.append(-self.__scores[key])
+
+    def save(self):
+        """Write statistics to `path` atomically, so a crash can't corrupt them"""
+        if self.path is None:
+            return
+        with self.__lock:
+            stored = {"version": 1, "pages": {key: [self.__scores[key], self.__counts[key]] for key in self.__ranking}}
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(temp_path, "w", encoding="utf-8") as stats_file:
+            json.dump(stored, stats_file)
+        os.replace(temp_path, self.path)
+
+    def __insert_into_ranking(self, key, score):
+        position = bisect.bisect_left(self.__negated_scores, -score)
+        self.__negated_scores.insert(position, -score)
+        self.__ranking.insert(position, key)
+
+    def __remove_from_ranking(self, key, score):
+        position = bisect.bisect_left(self.__negated_scores, -score)
+        while self.__ranking[position] != key:
+            position += 1
+        del self.__negated_scores[position]
+        del self.__ranking[position]
+
+    @staticmethod
+    def __log2_add(a, b):
+        """log2(2^a + 2^b), without overflowing"""
+        high, low = max(a, b), min(a, b)
+        return high + math.log2(1 + 2 ** (low - high))
@@ -0,0 +1,87 @@
+import os
+import threading
+from .cache import SalesforceReferenceCache
+from .completions import CompletionIndex
+from .retrieve import DEFAULT_LOCALE
+
+
+class DocVersionIndex(object):
+    """
+    Everything cached for one documentation version (None being the latest
+    release) in one locale: its reference cache, the completion index kept
+    in step with it, the shared index file it is loaded from and published
+    to, and the ToC metadata of each doc type in it.
+
+    Keeping one of these per version and locale means switching to one that
+    has already been loaded is just a matter of using a different one.
+    Entries that are the same in several versions are stored once (see
+    cache.shared_entry), so holding several versions costs little more
+    memory than holding one.
+
+    :param locale_map:
+        a LocaleMap to keep up to date with this index's entries, if any
+    """
+    def __init__(self, version, locale=DEFAULT_LOCALE, shared_index=None, locale_map=None):
+        self.version = version
+        self.locale = locale
+        self.cache = SalesforceReferenceCache()
+        self.completions = CompletionIndex()
+        self.cache.add_listener(self.completions.on_cache_changed)
+        if locale_map is not None:
+            self.cache.add_listener(locale_map.listener(locale))
+        self.shared_index = shared_index
+        self.doc_type_meta = {}
+
+
+class LocaleMap(object):
+    """
+    Maps each page to its entry in every locale loaded, so the page open in
+    one locale can be found in another with a dict lookup, rather than by
+    searching translated titles. Pages are matched by doc type and URL, as
+    page file names (and anchors) are the same in every locale.
+
+    Register `listener(locale)` on each locale's cache to keep the map up to
+    date (DocVersionIndex does this).
+    """
+    def __init__(self):
+        self.__by_page = {}
+        self.__pages = {}
+        self.__lock = threading.Lock()
+
+    def listener(self, locale):
+        def on_cache_changed(cache, doc_types):
+            for doc_type in doc_types:
+                self.update(locale, doc_type, cache.entries_by_doc_type.get(doc_type, []))
+        return on_cache_changed
+
+    def update(self, locale, doc_type, entries):
+        """Replace `locale`'s entries for `doc_type` with `entries`"""
+        pages = set((entry.doc_type, entry.url) for entry in entries)
+        with self.__lock:
+            for page in self.__pages.get((locale, doc_type), ()):
+                if page not in pages:
+                    by_locale = self.__by_page[page]
+                    by_locale.pop(locale, None)
+                    if not by_locale:
+                        del self.__by_page[page]
+            for entry in entries:
+                self.__by_page.setdefault((entry.doc_type, entry.url), {})[locale] = entry
+            self.__pages[(locale, doc_type)] = pages
+
+    def translations(self, doc_type, url):
+        """dict of locale -> entry for the page at `url`, in every locale loaded"""
+        with self.__lock:
+            return dict(self.__by_page.get((doc_type, url), {}))
+
+
+def versioned_path(path, version, locale=DEFAULT_LOCALE):
+    """
+    `path` for the latest release in the default locale; otherwise with the
+    version and/or locale added before the extension, e.g. index.json ->
+    index-244.0.json, or index-244.0-ja-jp.json
+    """
+    suffix = "".join("-" + part for part in (version, locale if locale != DEFAULT_LOCALE else None) if part)
+    if not suffix:
+        return path
+    root, extension = os.path.splitext(path)
+    return root + suffix + extension
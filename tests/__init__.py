@@ -0,0 +1,4 @@
+"""
+Tests of the plugin's salesforce_reference package, run from the root of the
+repo with `python -m unittest discover tests`
+"""
@@ -0,0 +1,197 @@
+"""Tests of the keep-alive connection pool, against a local HTTP stub"""
+import gzip
+import threading
+import time
+import unittest
+import urllib.error
+import zlib
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from salesforce_reference.connection import ConnectionPool, MAX_REDIRECTS
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path))
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        try:
+            self.respond()
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.do_GET()
+
+    def respond(self):
+        path = self.path
+        if path == "/plain":
+            self.send_body(b"plain body")
+        elif path == "/gzip":
+            self.send_body(gzip.compress(b"gzipped body"), {"Content-Encoding": "gzip"})
+        elif path == "/deflate":
+            self.send_body(zlib.compress(b"deflated body"), {"Content-Encoding": "deflate"})
+        elif path == "/raw-deflate":
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            data = compressor.compress(b"raw deflated body") + compressor.flush()
+            self.send_body(data, {"Content-Encoding": "deflate"})
+        elif path == "/redirect":
+            self.send_body(b"", {"Location": "/plain"}, status=302)
+        elif path == "/see-other":
+            self.send_body(b"", {"Location": "/plain"}, status=303)
+        elif path == "/loop":
+            self.send_body(b"", {"Location": "/loop"}, status=302)
+        elif path == "/drop":
+            # Answer as if keeping the connection alive, then close it, as a
+            # server timing out an idle keep-alive connection does
+            self.send_body(b"dropped after this")
+            self.close_connection = True
+        elif path == "/slow":
+            time.sleep(0.1)
+            self.send_body(b"slow body")
+        else:
+            self.send_body(b"", status=404)
+
+    def send_body(self, body, headers=None, status=200):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StubHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def url(self, path):
+        return "http://127.0.0.1:%d%s" % (self.server_address[1], path)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        self.pool = ConnectionPool(timeout=5)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_is_reused(self):
+        self.assertEqual(self.pool.fetch(self.server.url("/plain")), b"plain body")
+        self.assertEqual(self.pool.fetch(self.server.url("/plain")), b"plain body")
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.pool.idle_count(), 1)
+
+    def test_stale_connection_is_retried_on_a_new_one(self):
+        self.pool.fetch(self.server.url("/drop"))
+        # Give the server time to close its end of the connection
+        time.sleep(0.1)
+        self.assertEqual(self.pool.fetch(self.server.url("/plain")), b"plain body")
+        self.assertEqual(self.server.connections, 2)
+
+    def test_failure_on_a_new_connection_is_not_retried(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.pool.max_per_host = 1
+        self.assertRaises(ConnectionError, self.pool.fetch, self.server.url("/plain"))
+        # The connection slot was given back, so this fails rather than waiting
+        self.assertRaises(ConnectionError, self.pool.fetch, self.server.url("/plain"))
+
+    def test_redirect_is_followed(self):
+        self.assertEqual(self.pool.fetch(self.server.url("/redirect")), b"plain body")
+        self.assertEqual([path for method, path in self.server.requests], ["/redirect", "/plain"])
+
+    def test_see_other_redirect_becomes_get(self):
+        status, headers, body = self.pool.request(self.server.url("/see-other"), method="POST", body=b"form")
+        self.assertEqual(body, b"plain body")
+        self.assertEqual(self.server.requests, [("POST", "/see-other"), ("GET", "/plain")])
+
+    def test_redirect_loop_gives_up(self):
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            self.pool.fetch(self.server.url("/loop"))
+        self.assertEqual(raised.exception.code, 302)
+        self.assertEqual(len(self.server.requests), MAX_REDIRECTS + 1)
+
+    def test_error_status_raises_http_error(self):
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            self.pool.fetch(self.server.url("/missing"))
+        self.assertEqual(raised.exception.code, 404)
+        # The connection is still good for the next request
+        self.assertEqual(self.pool.fetch(self.server.url("/plain")), b"plain body")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_gzip_body_is_decompressed(self):
+        self.assertEqual(self.pool.fetch(self.server.url("/gzip")), b"gzipped body")
+
+    def test_deflate_body_is_decompressed(self):
+        self.assertEqual(self.pool.fetch(self.server.url("/deflate")), b"deflated body")
+
+    def test_raw_deflate_body_is_decompressed(self):
+        self.assertEqual(self.pool.fetch(self.server.url("/raw-deflate")), b"raw deflated body")
+
+    def test_idle_connection_expires(self):
+        self.pool.idle_timeout = 0.05
+        self.pool.fetch(self.server.url("/plain"))
+        time.sleep(0.1)
+        self.pool.fetch(self.server.url("/plain"))
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(self.pool.idle_count(), 1)
+
+    def test_close_idle(self):
+        self.pool.fetch(self.server.url("/plain"))
+        self.pool.close_idle(60)
+        self.assertEqual(self.pool.idle_count(), 1)
+        self.pool.close_idle(0)
+        self.assertEqual(self.pool.idle_count(), 0)
+
+    def test_connections_per_host_are_bounded(self):
+        self.pool.max_per_host = 2
+        errors = []
+        def fetch():
+            try:
+                self.pool.fetch(self.server.url("/slow"))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=fetch) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(self.server.max_in_flight, 2)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(self.pool.idle_count(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
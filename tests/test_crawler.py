@@ -0,0 +1,112 @@
+"""Tests of the member crawler, with page content served by a stub policy"""
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from salesforce_reference import crawler
+from salesforce_reference.cache import SalesforceReferenceCache, SalesforceReferenceCacheEntry
+from salesforce_reference.crawler import MemberCrawler, RateLimiter
+
+TOC_URL = "https://developer.salesforce.com/docs/get_document/atlas.en-us.apexcode.meta"
+TOC_META = {"deliverable": "apexcode", "locale": "en-us", "version": "244.0"}
+
+
+def class_page(class_name, *members):
+    topics = "".join('<div class="topic" id="%s_%s"><h3>%s</h3></div>' % (class_name, member, member)
+                     for member in members)
+    return '<div class="topic" id="%s"><h2>%s Class</h2>%s</div>' % (class_name, class_name, topics)
+
+
+class StubPolicy(object):
+    """Serves page content by page file name, as the documentation's content API does"""
+    def __init__(self, pages):
+        self.pages = pages
+        self.fetched = []
+
+    def fetch(self, url, headers=None):
+        page = url.split("/")[-3]
+        self.fetched.append(page)
+        return json.dumps({"content": self.pages[page]}).encode("utf-8")
+
+
+class MemberCrawlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.directory, "members.json")
+        self.cache = SalesforceReferenceCache()
+        self.classes = [SalesforceReferenceCacheEntry(name + " Class", name.lower() + ".htm", "APEX")
+                        for name in ("String", "Broken", "Math")]
+        self.policy = StubPolicy({
+            "string.htm": class_page("String", "length()", "trim()"),
+            "broken.htm": "not really a class page",
+            "math.htm": class_page("Math", "abs(value)"),
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def crawl(self):
+        member_crawler = MemberCrawler(self.cache, threading.Lock(), "APEX", self.classes, TOC_URL, TOC_META,
+                                       self.state_path, RateLimiter(1000), policy=self.policy)
+        member_crawler.run()
+        return member_crawler
+
+    def test_members_are_added(self):
+        member_crawler = self.crawl()
+        self.assertEqual(member_crawler.pages_fetched, 3)
+        self.assertEqual(member_crawler.pages_failed, 0)
+        self.assertEqual(sorted(entry.title for entry in self.cache.entries),
+                         ["Math.abs(value)", "String.length()", "String.trim()"])
+        self.assertEqual(self.cache.entries[0].url, "math.htm#Math_abs(value)")
+
+    def test_unchanged_version_is_not_fetched_again(self):
+        self.crawl()
+        self.policy.fetched = []
+        self.cache = SalesforceReferenceCache()
+        member_crawler = self.crawl()
+        self.assertEqual(self.policy.fetched, [])
+        self.assertEqual(member_crawler.pages_fetched, 0)
+        self.assertEqual(len(self.cache), 3)
+
+    def test_page_that_cannot_be_parsed_is_skipped(self):
+        real_extract_members = crawler.extract_members
+        def extract_members(html):
+            if "class page" in html:
+                raise ValueError("unexpected page layout")
+            return real_extract_members(html)
+        with mock.patch.object(crawler, "extract_members", extract_members), \
+                contextlib.redirect_stdout(io.StringIO()):
+            member_crawler = self.crawl()
+        self.assertEqual(member_crawler.pages_fetched, 2)
+        self.assertEqual(member_crawler.pages_failed, 1)
+        self.assertEqual(len(self.cache), 3)
+        # The page is left out of the saved state, so the next crawl retries it
+        with open(self.state_path, encoding="utf-8") as state_file:
+            self.assertEqual(sorted(json.load(state_file)["pages"]), ["math.htm", "string.htm"])
+        self.policy.fetched = []
+        self.cache = SalesforceReferenceCache()
+        self.crawl()
+        self.assertEqual(self.policy.fetched, ["broken.htm"])
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_rate_must_be_positive(self):
+        for rate in (0, -1, float("inf"), "fast"):
+            self.assertRaises(ValueError, RateLimiter, rate)
+        rate_limiter = RateLimiter(1000)
+        with self.assertRaises(ValueError):
+            rate_limiter.rate = 0
+        self.assertEqual(rate_limiter.rate, 1000)
+        rate_limiter.acquire()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+"""Tests of the command line index builder"""
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from salesforce_reference import __main__ as cli
+from salesforce_reference.store import read_index
+
+
+class MainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "index.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build(self, *args):
+        # Nothing is retrieved, so an empty index is written
+        with mock.patch.object(cli, "retrieve_doc_types", return_value=[]), \
+                contextlib.redirect_stdout(io.StringIO()):
+            return cli.main(["build", self.path] + list(args))
+
+    def test_latest_release_is_written_to_the_index_path(self):
+        self.assertEqual(self.build(), 0)
+        self.assertEqual(sorted(os.listdir(self.directory)), ["index.json", "index.json.lock"])
+
+    def test_version_and_locale_are_added_to_the_file_name(self):
+        # As the editor does with the indexPath setting
+        self.assertEqual(self.build("--doc-version", "244.0", "--locale", "ja-jp"), 0)
+        self.assertEqual(sorted(os.listdir(self.directory)), ["index-244.0-ja-jp.json", "index-244.0-ja-jp.json.lock"])
+        self.assertEqual(read_index(os.path.join(self.directory, "index-244.0-ja-jp.json"))["doc_types"], {})
+
+    def test_rate_limit_must_be_positive(self):
+        self.assertEqual(cli.parse_args(["build", self.path, "--requests-per-second", "0.5"]).requests_per_second, 0.5)
+        for rate in ("0", "-1", "fast"):
+            stderr = io.StringIO()
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(stderr):
+                cli.parse_args(["build", self.path, "--requests-per-second", rate])
+            self.assertIn("--requests-per-second", stderr.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Tests of documentation page rendering and the page cache"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from salesforce_reference import pages
+from salesforce_reference.pages import PageCache, absolute_links, command_links, load_page, render_page
+
+PAGE_URL = "https://developer.salesforce.com/docs/atlas.en-us.apexcode.meta/apexcode/apex_methods_system_string.htm"
+CONTENT_URL = "https://developer.salesforce.com/docs/get_document_content/apexcode/string.htm/en-us/244.0"
+
+
+class StubPolicy(object):
+    """Serves `content` for every URL, as the documentation's content API does"""
+    def __init__(self, content):
+        self.content = content
+        self.fetched = []
+
+    def fetch(self, url, headers=None):
+        self.fetched.append(url)
+        return json.dumps({"content": self.content}).encode("utf-8")
+
+
+class RenderPageTest(unittest.TestCase):
+
+    def test_unsupported_markup_is_reduced(self):
+        rendered = render_page('<div class="topic"><h2 id="x">String  Class</h2>'
+                               '<script>alert(1)</script><img src="a.png">'
+                               '<p>Use <a href="a.htm" target="_blank">this</a>\n  <span>instead</span></p></div>')
+        self.assertEqual(rendered, '<div><h2>String Class</h2><p>Use <a href="a.htm">this</a> <span>instead</span></p></div>')
+
+    def test_comments_and_doctype_are_not_shown(self):
+        self.assertEqual(render_page('<!DOCTYPE html><body><!-- internal note --><p>a</p>'
+                                     '<![CDATA[data]]><?xml-stylesheet href="a.css"?></body>'), "<p>a</p>")
+
+    def test_preformatted_whitespace_is_kept(self):
+        self.assertEqual(render_page("<pre>a\n    b</pre><p>c\n    d</p>"), "<pre>a\n    b</pre><p>c d</p>")
+
+    def test_fragment(self):
+        page = '<h1>String Class</h1><section id="String_trim"><h3>trim()</h3><p>Removes spaces</p></section>'
+        self.assertEqual(render_page(page, "String_trim"), "<div><h3>trim()</h3><p>Removes spaces</p></div>")
+        # Not found: the whole page
+        self.assertEqual(render_page(page, "String_length"), render_page(page))
+
+    def test_table_rows_are_lines(self):
+        rendered = render_page("<table><tr><th>Name</th><th>Type</th></tr>"
+                               "<tr><td>length</td><td>Integer</td></tr></table>")
+        self.assertEqual(rendered, "<div><div><b>Name </b><b>Type</b></div>"
+                                   "<div><span>length </span><span>Integer</span></div></div>")
+
+
+class LinksTest(unittest.TestCase):
+
+    def test_absolute_links(self):
+        rendered = '<p><a href="apex_methods_system_math.htm#abs">abs</a> <a href="/docs/a?b=1&amp;c=2">a</a></p>'
+        self.assertEqual(absolute_links(rendered, PAGE_URL),
+                         '<p><a href="https://developer.salesforce.com/docs/atlas.en-us.apexcode.meta/apexcode/'
+                         'apex_methods_system_math.htm#abs">abs</a> '
+                         '<a href="https://developer.salesforce.com/docs/a?b=1&amp;c=2">a</a></p>')
+
+    def test_command_links(self):
+        self.assertEqual(command_links('<a href="https://example.com/a?b=1&amp;c=2">a</a>'),
+                         '<a href="subl:open_url {&quot;url&quot;: &quot;https://example.com/a?b=1&amp;c=2&quot;}">a</a>')
+
+
+class PageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = PageCache(os.path.join(self.directory, "pages"))
+        self.policy = StubPolicy('<h1>String Class</h1><div id="String_trim"><p>trim()</p></div>')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reopened_without_fetching(self):
+        rendered = load_page(self.cache, CONTENT_URL, policy=self.policy)
+        self.assertEqual(rendered, "<h1>String Class</h1><div><p>trim()</p></div>")
+        self.cache.clear()
+        self.assertEqual(load_page(self.cache, CONTENT_URL, policy=self.policy), rendered)
+        self.assertEqual(load_page(PageCache(self.cache.directory), CONTENT_URL, "String_trim", policy=self.policy),
+                         "<div><p>trim()</p></div>")
+        self.assertEqual(self.policy.fetched, [CONTENT_URL])
+        self.assertEqual(self.cache.content(CONTENT_URL), self.policy.content)
+
+    def test_unchanged_content_is_not_rendered_again(self):
+        # As for a page in a new documentation version
+        with mock.patch.object(pages, "render_page", wraps=render_page) as rendered:
+            first = self.cache.put(CONTENT_URL, self.policy.content)
+            second = self.cache.put(CONTENT_URL.replace("244.0", "246.0"), self.policy.content)
+        self.assertEqual(first, second)
+        self.assertEqual(rendered.call_count, 1)
+        self.assertEqual(len([name for name in os.listdir(self.cache.directory) if name.startswith("content-")]), 1)
+
+    def test_prune_keeps_the_page_just_cached(self):
+        self.cache.max_disk_bytes = 1
+        self.cache.put(CONTENT_URL, "<p>old</p>")
+        newer_url = CONTENT_URL.replace("string.htm", "math.htm")
+        self.cache.put(newer_url, "<p>new</p>")
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+        self.cache.clear()
+        self.assertEqual(self.cache.get(newer_url), "<p>new</p>")
+        self.assertEqual(self.cache.get(CONTENT_URL), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+"""Tests of retries and the per-host circuit breaker"""
+import socket
+import ssl
+import unittest
+import urllib.error
+
+from salesforce_reference.policy import CircuitBreaker, CircuitOpenError, RetrievalPolicy, RetryPolicy
+
+URL = "https://developer.salesforce.com/docs/page.htm"
+HOST = "developer.salesforce.com"
+
+
+def http_error(code):
+    return urllib.error.HTTPError(URL, code, "", {}, None)
+
+
+class StubPool(object):
+    """Answers each fetch with the next of `results`, raising it if it's an exception"""
+    def __init__(self, *results):
+        self.results = list(results)
+        self.fetched = 0
+
+    def fetch(self, url, headers=None, timeout=None):
+        self.fetched += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_retryable_errors(self):
+        retry = RetryPolicy()
+        self.assertTrue(retry.is_retryable(http_error(503)))
+        self.assertTrue(retry.is_retryable(http_error(429)))
+        self.assertTrue(retry.is_retryable(socket.timeout()))
+        self.assertTrue(retry.is_retryable(ConnectionResetError()))
+        self.assertTrue(retry.is_retryable(urllib.error.URLError(ConnectionRefusedError())))
+        self.assertFalse(retry.is_retryable(http_error(404)))
+        self.assertFalse(retry.is_retryable(ValueError("not JSON")))
+        self.assertFalse(retry.is_retryable(FileNotFoundError()))
+
+    def test_certificate_errors_are_not_retried(self):
+        retry = RetryPolicy()
+        error = ssl.SSLCertVerificationError("certificate verify failed")
+        self.assertFalse(retry.is_retryable(error))
+        self.assertFalse(retry.is_retryable(urllib.error.URLError(error)))
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60, clock=self.clock)
+
+    def open_circuit(self):
+        self.breaker.record_failure(HOST)
+        self.breaker.record_failure(HOST)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure(HOST)
+        self.assertFalse(self.breaker.is_open(HOST))
+        self.breaker.before_request(HOST)
+        self.breaker.record_failure(HOST)
+        self.assertTrue(self.breaker.is_open(HOST))
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.breaker.before_request(HOST)
+        self.assertEqual(raised.exception.retry_in, 60)
+        self.breaker.before_request("other.example.com")
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure(HOST)
+        self.breaker.record_success(HOST)
+        self.breaker.record_failure(HOST)
+        self.assertFalse(self.breaker.is_open(HOST))
+
+    def test_neutral_answer_keeps_the_failure_count(self):
+        self.breaker.record_failure(HOST)
+        self.breaker.record_neutral(HOST)
+        self.breaker.record_failure(HOST)
+        self.assertTrue(self.breaker.is_open(HOST))
+
+    def test_half_open_trial_success_closes(self):
+        self.open_circuit()
+        self.clock.now += 60
+        self.assertFalse(self.breaker.is_open(HOST))
+        self.breaker.before_request(HOST)
+        # Only the one trial request is let through
+        self.assertRaises(CircuitOpenError, self.breaker.before_request, HOST)
+        self.breaker.record_success(HOST)
+        self.breaker.before_request(HOST)
+        self.breaker.record_failure(HOST)
+        self.assertFalse(self.breaker.is_open(HOST))
+
+    def test_half_open_trial_failure_reopens(self):
+        self.open_circuit()
+        self.clock.now += 60
+        self.breaker.before_request(HOST)
+        self.breaker.record_failure(HOST)
+        self.assertTrue(self.breaker.is_open(HOST))
+        self.assertRaises(CircuitOpenError, self.breaker.before_request, HOST)
+
+    def test_half_open_trial_neutral_answer_ends_the_trial(self):
+        self.open_circuit()
+        self.clock.now += 60
+        self.breaker.before_request(HOST)
+        self.breaker.record_neutral(HOST)
+        # Neither closed nor re-opened: the next request is another trial
+        self.breaker.before_request(HOST)
+        self.breaker.record_failure(HOST)
+        self.assertTrue(self.breaker.is_open(HOST))
+
+
+class RetrievalPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60, clock=self.clock)
+        self.sleeps = []
+
+    def policy(self, pool, max_attempts=3):
+        return RetrievalPolicy(pool, RetryPolicy(max_attempts=max_attempts), self.breaker, sleep=self.sleeps.append)
+
+    def test_retries_then_succeeds(self):
+        pool = StubPool(http_error(503), socket.timeout(), b"page")
+        self.assertEqual(self.policy(pool).fetch(URL), b"page")
+        self.assertEqual(pool.fetched, 3)
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertFalse(self.breaker.is_open(HOST))
+
+    def test_gives_up_after_max_attempts(self):
+        pool = StubPool(http_error(503), http_error(503), b"page")
+        self.assertRaises(urllib.error.HTTPError, self.policy(pool, max_attempts=2).fetch, URL)
+        self.assertEqual(pool.fetched, 2)
+
+    def test_not_found_is_not_retried(self):
+        pool = StubPool(http_error(404), b"page")
+        self.assertRaises(urllib.error.HTTPError, self.policy(pool).fetch, URL)
+        self.assertEqual(pool.fetched, 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_not_found_does_not_hide_failures(self):
+        policy = self.policy(StubPool(http_error(503), http_error(503), http_error(404), http_error(503)),
+                             max_attempts=1)
+        for _ in range(4):
+            self.assertRaises(urllib.error.HTTPError, policy.fetch, URL)
+        self.assertTrue(self.breaker.is_open(HOST))
+
+    def test_open_circuit_stops_retries(self):
+        pool = StubPool(*[http_error(503)] * 5)
+        self.assertRaises(urllib.error.HTTPError, self.policy(pool, max_attempts=5).fetch, URL)
+        self.assertEqual(pool.fetched, 3)
+        self.assertRaises(CircuitOpenError, self.policy(pool).fetch, URL)
+        self.assertEqual(pool.fetched, 3)
+        # Half-open: the trial request succeeds and closes the circuit
+        self.clock.now += 60
+        pool.results = [b"page"]
+        self.assertEqual(self.policy(pool).fetch(URL), b"page")
+        self.assertFalse(self.breaker.is_open(HOST))
+
+
+if __name__ == "__main__":
+    unittest.main()
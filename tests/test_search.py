@@ -0,0 +1,144 @@
+"""Tests of the content search index and its indexer"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from salesforce_reference.crawler import RateLimiter
+from salesforce_reference.search import SearchIndex, SearchIndexer
+
+PAGES = {
+    "string.htm": ("String Class", "Contains methods for the String primitive data type. "
+                                   "Use trim to remove leading and trailing white space."),
+    "math.htm": ("Math Class", "Contains methods for mathematical operations, such as abs and max."),
+    "list.htm": ("List Class", "Contains methods for the List collection type. A list is an ordered collection."),
+}
+
+
+def results(index, query, **kwargs):
+    return [(result.doc_type, result.page, result.score, result.snippet) for result in index.search(query, **kwargs)]
+
+
+class StubPolicy(object):
+    """Serves page content by page file name, as the documentation's content API does"""
+    def __init__(self, pages):
+        self.pages = pages
+        self.fetched = []
+
+    def fetch(self, url, headers=None):
+        page = url.split("/")[-1]
+        self.fetched.append(page)
+        return json.dumps({"content": "<h1>%s</h1><p>%s</p>" % self.pages[page]}).encode("utf-8")
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "search.idx")
+        self.index = SearchIndex()
+        for page, (title, text) in sorted(PAGES.items()):
+            self.index.add("APEX", page, title, text)
+        self.index.add("VISUALFORCE", "page.htm", "apex:page",
+                       "A single Visualforce page, which abs positioning can move. Contains methods? No.")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_search(self):
+        found = self.index.search("trim white space")
+        self.assertEqual([result.page for result in found], ["string.htm"])
+        self.assertEqual(found[0].title, "String Class")
+        self.assertIn("trim", found[0].snippet)
+        # No page has both words: pages with either
+        self.assertEqual(sorted(result.page for result in self.index.search("max collection")),
+                         ["list.htm", "math.htm"])
+        self.assertEqual(self.index.search("nothing"), [])
+
+    def test_doc_types(self):
+        self.assertEqual(len(self.index.search("contains methods")), 4)
+        self.assertEqual(sorted(result.page for result in self.index.search("contains methods", doc_types=["APEX"])),
+                         ["list.htm", "math.htm", "string.htm"])
+        # Only the Visualforce page has both words, but it isn't searched
+        self.assertEqual([result.page for result in self.index.search("single abs")], ["page.htm"])
+        self.assertEqual([result.page for result in self.index.search("single abs", doc_types=["APEX"])], ["math.htm"])
+        self.assertEqual(self.index.search("single", doc_types=["APEX"]), [])
+
+    def test_save_and_load(self):
+        self.index.doc_type_versions["APEX"] = "244.0"
+        self.index.save(self.path)
+        self.assertEqual(os.listdir(self.directory), ["search.idx"])
+        loaded = SearchIndex.load(self.path)
+        self.assertEqual(len(loaded), 4)
+        self.assertEqual(loaded.doc_type_versions, {"APEX": "244.0"})
+        for query in ("contains methods", "list collection", "abs collection", "white"):
+            self.assertEqual(results(loaded, query), results(self.index, query))
+
+    def test_remove(self):
+        self.index.remove("APEX", "string.htm")
+        self.assertEqual(self.index.search("trim"), [])
+        self.assertEqual(self.index.document("APEX", "string.htm"), None)
+        self.assertEqual(self.index.pages("APEX"), set(["math.htm", "list.htm"]))
+        self.index.save(self.path)
+        self.assertEqual(SearchIndex.load(self.path).search("trim"), [])
+
+    def test_unchanged_content_is_not_indexed_again(self):
+        title, text = PAGES["math.htm"]
+        self.assertFalse(self.index.add("APEX", "math.htm", "Math Methods", text))
+        self.assertEqual(self.index.document("APEX", "math.htm").title, "Math Methods")
+        self.assertTrue(self.index.add("APEX", "math.htm", title, text + " And min."))
+        self.assertEqual([result.page for result in self.index.search("min")], ["math.htm"])
+
+    def test_unreadable_file_loads_empty(self):
+        self.index.save(self.path)
+        with open(self.path, "rb") as index_file:
+            data = index_file.read()
+        for damaged in (data[:-10], data[:10], b"", data[:30] + b"\0" * (len(data) - 30)):
+            with open(self.path, "wb") as index_file:
+                index_file.write(damaged)
+            self.assertEqual(len(SearchIndex.load(self.path)), 0)
+        self.assertEqual(len(SearchIndex.load(os.path.join(self.directory, "missing.idx"))), 0)
+
+
+class SearchIndexerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "search.idx")
+        self.policy = StubPolicy(PAGES)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def update(self, version, pages=PAGES):
+        targets = [("APEX", page, title, "https://example.com/content/" + page)
+                   for page, (title, text) in sorted(pages.items())]
+        index = SearchIndex.load(self.path)
+        indexer = SearchIndexer(index, self.path, {"APEX": (version, targets)}, RateLimiter(1000),
+                                policy=self.policy)
+        indexer.update()
+        return indexer, index
+
+    def test_pages_of_the_same_version_are_not_fetched_again(self):
+        indexer, index = self.update("244.0")
+        self.assertEqual(indexer.pages_indexed, 3)
+        self.assertEqual([result.page for result in index.search("trim")], ["string.htm"])
+        self.policy.fetched = []
+        indexer, index = self.update("244.0")
+        self.assertEqual(self.policy.fetched, [])
+        self.assertEqual(indexer.pages_fetched, 0)
+        self.assertEqual(len(index), 3)
+
+    def test_new_version_is_fetched_but_not_indexed_again(self):
+        self.update("244.0")
+        self.policy.fetched = []
+        indexer, index = self.update("246.0", dict((page, PAGES[page]) for page in ("math.htm", "string.htm")))
+        self.assertEqual(sorted(self.policy.fetched), ["math.htm", "string.htm"])
+        self.assertEqual(indexer.pages_indexed, 0)
+        self.assertEqual(index.pages("APEX"), set(["math.htm", "string.htm"]))
+        self.assertEqual(index.doc_type_versions, {"APEX": "246.0"})
+
+
+if __name__ == "__main__":
+    unittest.main()
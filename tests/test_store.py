@@ -0,0 +1,173 @@
+"""Tests of the index file shared between processes"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from salesforce_reference.cache import SalesforceReferenceCache, SalesforceReferenceCacheEntry
+from salesforce_reference.store import (
+    IndexLock,
+    SharedIndex,
+    dump_index,
+    index_entries,
+    read_index,
+    read_index_header,
+    write_index,
+)
+
+
+def in_thread(function):
+    """Call `function` on another thread, returning its result"""
+    results = []
+    thread = threading.Thread(target=lambda: results.append(function()))
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+class IndexFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "index.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_dump_and_read(self):
+        cache = SalesforceReferenceCache()
+        cache.extend([SalesforceReferenceCacheEntry("String Class", "string.htm", "APEX"),
+                      SalesforceReferenceCacheEntry("apex:page", "page.htm", "VISUALFORCE")])
+        write_index(self.path, dump_index(cache, {"APEX": {"version": "244.0"}}), generation=3)
+        index = read_index(self.path)
+        self.assertEqual(index["header"]["generation"], 3)
+        self.assertEqual(index["doc_types"]["APEX"]["meta"], {"version": "244.0"})
+        self.assertEqual(index["doc_types"]["VISUALFORCE"]["meta"], {})
+        self.assertEqual([entry.title for entry in index_entries(index, ["APEX"])], ["String Class"])
+        self.assertEqual(len(index_entries(index)), 2)
+        self.assertEqual(os.listdir(self.directory), ["index.json"])
+
+    def test_doc_type_retrieved_empty_is_kept(self):
+        index = dump_index(SalesforceReferenceCache(), {"SERVICECONSOLE": {"locale": "ja-jp"}})
+        self.assertEqual(index["doc_types"], {"SERVICECONSOLE": {"meta": {"locale": "ja-jp"}, "entries": []}})
+
+    def test_unknown_format_is_ignored(self):
+        with open(self.path, "w", encoding="utf-8") as index_file:
+            index_file.write(json.dumps({"format": -1}) + "\n{}")
+        self.assertEqual(read_index_header(self.path), None)
+        self.assertEqual(read_index(self.path), None)
+
+    def test_missing_index(self):
+        self.assertEqual(read_index(self.path), None)
+        self.assertEqual(SharedIndex(self.path).load(), None)
+
+
+class IndexLockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.lock = IndexLock(os.path.join(self.directory, "sub", "index.json"))
+
+    def tearDown(self):
+        self.lock.release()
+        shutil.rmtree(self.directory)
+
+    def test_acquire_and_release(self):
+        self.assertTrue(self.lock.acquire(0))
+        self.assertTrue(self.lock.held)
+        self.lock.release()
+        self.assertFalse(self.lock.held)
+        self.assertTrue(self.lock.acquire(0))
+
+    def test_other_thread_waits(self):
+        self.lock.acquire()
+        self.assertFalse(in_thread(lambda: self.lock.acquire(0.1)))
+        self.assertFalse(in_thread(lambda: self.lock.held))
+        self.assertTrue(self.lock.held)
+
+    def test_other_thread_cannot_release(self):
+        self.lock.acquire()
+        in_thread(self.lock.release)
+        self.assertTrue(self.lock.held)
+        self.assertFalse(in_thread(lambda: self.lock.acquire(0)))
+
+    def test_other_thread_acquires_once_released(self):
+        self.lock.acquire()
+        self.lock.release()
+        def acquire_and_release():
+            acquired = self.lock.acquire(0)
+            self.lock.release()
+            return acquired
+        self.assertTrue(in_thread(acquire_and_release))
+
+    def test_second_lock_on_the_same_file_waits(self):
+        # As another process's lock would
+        other = IndexLock(os.path.join(self.directory, "sub", "index.json"))
+        self.lock.acquire()
+        self.assertFalse(other.acquire(0.1))
+        self.lock.release()
+        self.assertTrue(other.acquire(0))
+        other.release()
+
+
+class SharedIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "index.json")
+        self.index = {"doc_types": {"APEX": {"meta": {}, "entries": [["String Class", "string.htm"]]}}}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def publish(self, shared, index):
+        with shared.lock:
+            shared.publish(index)
+
+    def test_publish_requires_the_lock(self):
+        shared = SharedIndex(self.path)
+        self.assertRaises(RuntimeError, shared.publish, self.index)
+        shared.lock.acquire()
+        in_thread(shared.lock.release)
+        shared.publish(self.index)
+        shared.lock.release()
+        self.assertEqual(shared.generation, 1)
+
+    def test_publish_after_another_thread_timed_out(self):
+        shared = SharedIndex(self.path)
+        shared.lock.acquire()
+        def time_out():
+            if shared.lock.acquire(0.1):
+                shared.lock.release()
+            return shared.lock.held
+        self.assertFalse(in_thread(time_out))
+        shared.publish(self.index)
+        shared.lock.release()
+
+    def test_generations(self):
+        writer = SharedIndex(self.path)
+        reader = SharedIndex(self.path)
+        self.assertFalse(reader.changed())
+        self.publish(writer, self.index)
+        self.assertTrue(reader.changed())
+        self.assertEqual(reader.load()["doc_types"], self.index["doc_types"])
+        self.assertEqual(reader.generation, 1)
+        self.assertFalse(reader.changed())
+        self.publish(writer, self.index)
+        self.assertEqual(writer.generation, 2)
+        self.assertTrue(reader.changed())
+        reader.load()
+        self.assertEqual(reader.generation, 2)
+
+    def test_publish_continues_from_the_file(self):
+        self.publish(SharedIndex(self.path), self.index)
+        shared = SharedIndex(self.path)
+        self.publish(shared, self.index)
+        self.assertEqual(shared.generation, 2)
+        self.assertFalse(shared.changed())
+
+
+if __name__ == "__main__":
+    unittest.main()
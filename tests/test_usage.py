@@ -0,0 +1,56 @@
+"""Tests of page usage statistics"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from salesforce_reference.cache import SalesforceReferenceCacheEntry
+from salesforce_reference.usage import UsageStats
+
+
+class UsageStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "usage.json")
+        self.entries = [SalesforceReferenceCacheEntry(title, title.lower() + ".htm", "APEX")
+                        for title in ("Alpha", "Beta", "Gamma")]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_rank_puts_used_pages_first(self):
+        stats = UsageStats()
+        stats.record(self.entries[2], when=0)
+        stats.record(self.entries[1], when=0)
+        stats.record(self.entries[1], when=0)
+        ranked = stats.rank(self.entries)
+        self.assertEqual([entry.title for entry in ranked], ["Beta", "Gamma", "Alpha"])
+
+    def test_save_and_load(self):
+        stats = UsageStats()
+        stats.load(self.path)
+        stats.record(self.entries[0])
+        stats.save()
+        # Written under a name of its own, then renamed into place
+        self.assertEqual(os.listdir(self.directory), ["usage.json"])
+        loaded = UsageStats()
+        loaded.load(self.path)
+        self.assertEqual(loaded.count(self.entries[0]), 1)
+        self.assertEqual(loaded.ranking, stats.ranking)
+
+    def test_load_ignores_a_file_of_the_wrong_shape(self):
+        for stored in ([], {"pages": []}, {"pages": {"k": 1}}, {"pages": {"k": ["high", 1]}}):
+            with open(self.path, "w", encoding="utf-8") as stats_file:
+                json.dump(stored, stats_file)
+            stats = UsageStats()
+            stats.record(self.entries[0])
+            stats.load(self.path)
+            self.assertEqual(stats.ranking, [], stored)
+            stats.record(self.entries[1])
+            self.assertEqual(stats.count(self.entries[1]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()